@@ -14,46 +14,316 @@
 
 import abc
 import binascii
+import contextlib
+import ctypes
+import errno
+import fcntl
 import functools
+import importlib
 import json
+import mmap
 from multiprocessing.pool import ThreadPool
 import os
 import re
+import select
 import shlex
+import signal
+import socket
+import sys
+import threading
 import time
 
 from ironic_lib import disk_utils
 from ironic_lib import utils as il_utils
-import netaddr
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log
-import pint
-import psutil
-import pyudev
 import six
-import stevedore
-import yaml
 
 from ironic_python_agent import encoding
 from ironic_python_agent import errors
 from ironic_python_agent import netutils
 from ironic_python_agent import utils
 
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+
+class _LazyObject(object):
+    """Proxy creating the object it stands for on first use.
+
+    Used for the heavy dependencies of this module, so that importing it (on
+    each agent start) does not pay for the ones a given run never needs.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+
+    def _get(self):
+        if self._object is None:
+            self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._get()(*args, **kwargs)
+
+
+def _lazy_import(name):
+    return _LazyObject(functools.partial(importlib.import_module, name))
+
+
+def _make_unit_converter():
+    unit_converter = pint.UnitRegistry(filename=None)
+    unit_converter.define('bytes = []')
+    unit_converter.define('MB = 1048576 bytes')
+    return unit_converter
+
+
+netaddr = _lazy_import('netaddr')
+pint = _lazy_import('pint')
+psutil = _lazy_import('psutil')
+pyudev = _lazy_import('pyudev')
+stevedore = _lazy_import('stevedore')
+yaml = _lazy_import('yaml')
+
 _global_managers = None
+# Guards the replacement of _global_managers and _dispatch_table
+_managers_lock = threading.Lock()
+# Set on the threads loading the hardware managers or evaluating their
+# hardware support, which must not dispatch to the managers being loaded:
+# that would wait for the loading to end, forever
+_managers_loading = threading.local()
+_hardware_support_timings = {}
+# The managers the dispatch table was resolved for, and the table mapping
+# each dispatched method to the managers which may handle it
+_dispatch_table = (None, {})
 LOG = log.getLogger()
 CONF = cfg.CONF
+_APARAMS = utils.get_agent_params()
+
+hardware_opts = [
+    cfg.BoolOpt('concurrent_inventory',
+                default=_APARAMS.get('ipa-concurrent-inventory', False),
+                help='Run the inventory collectors in parallel, each within '
+                     'its own time budget, instead of one after the other. '
+                     'Can be supplied as "ipa-concurrent-inventory" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('native_block_device_enumeration',
+                default=_APARAMS.get('ipa-native-block-device-enumeration',
+                                     False),
+                help='List block devices from sysfs and the udev database '
+                     'rather than with lsblk, which is still used when those '
+                     'are not available. Can be supplied as '
+                     '"ipa-native-block-device-enumeration" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('live_device_inventory',
+                default=_APARAMS.get('ipa-live-device-inventory', False),
+                help='Build the block device and network interface view '
+                     'from sysfs and the udev database once and keep it up '
+                     'to date from udev events in a background thread, '
+                     'instead of settling udev and rescanning on each call. '
+                     'Can be supplied as "ipa-live-device-inventory" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('event_driven_disk_wait',
+                default=_APARAMS.get('ipa-event-driven-disk-wait', False),
+                help='Wait for the root device by following udev block '
+                     'events rather than by polling every disk_wait_delay '
+                     'seconds, within the same overall time. Polling is '
+                     'still used when udev events can not be received. Can '
+                     'be supplied as "ipa-event-driven-disk-wait" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('native_ipmi',
+                default=_APARAMS.get('ipa-native-ipmi', False),
+                help='Read the BMC addresses through the IPMI device, in a '
+                     'single session, rather than with one ipmitool run per '
+                     'channel and parameter. ipmitool is still used when the '
+                     'device can not be used. Can be supplied as '
+                     '"ipa-native-ipmi" kernel parameter.'),
+    cfg.BoolOpt('native_cpu_info',
+                default=_APARAMS.get('ipa-native-cpu-info', False),
+                help='Read the CPU model, frequency, count and flags from '
+                     '/proc/cpuinfo and sysfs rather than with lscpu and '
+                     'grep. lscpu is still used when /proc/cpuinfo lacks the '
+                     'model name. Can be supplied as "ipa-native-cpu-info" '
+                     'kernel parameter.'),
+    cfg.BoolOpt('native_dmi',
+                default=_APARAMS.get('ipa-native-dmi', False),
+                help='Read the installed memory and the system vendor '
+                     'information from the SMBIOS table in sysfs rather '
+                     'than with lshw, which is still used when the table '
+                     'can not be read. Can be supplied as "ipa-native-dmi" '
+                     'kernel parameter.'),
+]
+
+CONF.register_opts(hardware_opts)
 
 WARN_BIOSDEVNAME_NOT_FOUND = False
 
-UNIT_CONVERTER = pint.UnitRegistry(filename=None)
-UNIT_CONVERTER.define('bytes = []')
-UNIT_CONVERTER.define('MB = 1048576 bytes')
+UNIT_CONVERTER = _LazyObject(_make_unit_converter)
 _MEMORY_ID_RE = re.compile(r'^memory(:\d+)?$')
 NODE = None
+_node_lock = threading.Lock()
 
 SUPPORTED_SOFTWARE_RAID_LEVELS = frozenset(['0', '1', '1+0'])
 
+# Partition table written on the software RAID disks unless the 'disk_label'
+# of the target_raid_config asks otherwise (on BIOS nodes a GPT gets a
+# RAID_BIOS_GRUB_SIZE bios_grub partition first, for grub to embed itself),
+# and the boundary (in bytes) the partitions are at least aligned to, further
+# raised to the optimal I/O size and physical block size of each disk when
+# they are sane: powers of two, the optimal I/O size a multiple of the
+# physical block size and at most RAID_MAX_OPTIMAL_IO_SIZE
+RAID_DISK_LABEL = 'msdos'
+SUPPORTED_RAID_DISK_LABELS = frozenset(['msdos', 'gpt'])
+RAID_PARTITION_ALIGNMENT = 1024 * 1024
+RAID_MAX_OPTIMAL_IO_SIZE = 16 * 1024 * 1024
+RAID_BIOS_GRUB_SIZE = 1024 * 1024
+# An msdos partition table holds at most four primary partitions
+MAX_MSDOS_PRIMARY_PARTITIONS = 4
+
+# Values of the software RAID 'bitmap' option besides the absolute path of an
+# external write-intent bitmap file
+SOFTWARE_RAID_BITMAPS = frozenset(['internal', 'none'])
+
+# Inventory keys and the HardwareManager methods collecting them, in the order
+# they are reported by list_hardware_info
+INVENTORY_COLLECTORS = (
+    ('interfaces', 'list_network_interfaces'),
+    ('cpu', 'get_cpus'),
+    ('disks', 'list_block_devices'),
+    ('memory', 'get_memory'),
+    ('bmc_address', 'get_bmc_address'),
+    ('bmc_v6address', 'get_bmc_v6address'),
+    ('system_vendor', 'get_system_vendor_info'),
+    ('boot', 'get_boot_info'),
+)
+
+# Time budget (in seconds) of each inventory collector when they run in
+# parallel (see the concurrent_inventory option). The commands run by a
+# collector are killed once its budget is spent; the keys required by
+# ironic-inspector are then collected again serially, within the same budget,
+# and any other key (or a required key failing again) gets the value of
+# _EMPTY_INVENTORY.
+INVENTORY_COLLECTOR_TIMEOUT = 60
+INVENTORY_COLLECTOR_TIMEOUTS = {
+    'interfaces': 120,
+    'disks': 120,
+}
+INVENTORY_REQUIRED_KEYS = frozenset(['interfaces', 'cpu', 'disks', 'memory'])
+
+_UDEV_DATA_DIR = '/run/udev/data'
+# lsblk names of the SCSI peripheral device types found in sysfs
+_SCSI_DEVICE_TYPES = {
+    '0': 'disk',
+    '1': 'tape',
+    '4': 'worm',
+    '5': 'rom',
+    '7': 'mo-disk',
+    '8': 'changer',
+    '14': 'rbc',
+}
+# Major number of the RAM disks, which lsblk only lists with -a
+_RAMDISK_MAJOR = '1'
+
+# Seconds a hardware snapshot (see get_hardware_snapshot) is reused before the
+# tool producing it is run again
+HARDWARE_SNAPSHOT_TTL = 300
+
+# Concurrency of each group of disks sharing a controller and a media type
+# when erasing with the adaptive scheduler (disk_erasure_scheduler set to
+# 'adaptive' in the node driver_internal_info); overridden by the
+# disk_erasure_concurrency_rotational and
+# disk_erasure_concurrency_solid_state keys
+ERASE_GROUP_CONCURRENCY = {'rotational': 4, 'solid_state': 2}
+
+# Throughput (in bytes per second) assumed to estimate how long erasing a disk
+# takes when hdparm does not report it
+ERASE_THROUGHPUT_ESTIMATES = {'rotational': 150 * 1024 * 1024,
+                              'solid_state': 500 * 1024 * 1024}
+
+# Workers and buffer size (in bytes, a multiple of the page size) of the
+# native eraser, used instead of shred when agent_erase_devices_engine is set
+# to 'native' in the node driver_internal_info
+ERASE_WORKERS = 4
+ERASE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Disks whose metadata are erased at the same time by erase_devices_metadata,
+# overridden by metadata_erasure_concurrency in the node driver_internal_info
+METADATA_ERASURE_CONCURRENCY = 8
+
+# Block devices whose ATA security is probed at the same time before erasing
+ATA_PROBE_CONCURRENCY = 16
+
+# Seconds between refreshes of the md resync progress (it is also refreshed
+# on /proc/mdstat events), and between logs of the syncing arrays
+MD_MONITOR_INTERVAL = 5
+MD_MONITOR_LOG_INTERVAL = 60
+
+# Default policy of the wait_for_raid_resync clean step: 'wait' for the
+# arrays to reach RAID_RESYNC_TARGET progress within RAID_RESYNC_TIMEOUT
+# seconds, or 'throttle' their resync to RAID_RESYNC_SPEED_MAX KB/s; each is
+# overridden by the argument of the step, see RAID_RESYNC_ARGSINFO
+RAID_RESYNC_POLICY = 'wait'
+RAID_RESYNC_TARGET = 1.0
+RAID_RESYNC_TIMEOUT = 6 * 3600
+RAID_RESYNC_SPEED_MAX = 10000
+
+RAID_RESYNC_ARGSINFO = {
+    'policy': {
+        'description': (
+            "'wait' for the software RAID devices to reach the target "
+            "resync progress, or 'throttle' their resync. Default value is "
+            "'%s'." % RAID_RESYNC_POLICY
+        ),
+        'required': False,
+    },
+    'target': {
+        'description': (
+            "The resync progress to wait for, a number in (0, 1]. Default "
+            "value is %s." % RAID_RESYNC_TARGET
+        ),
+        'required': False,
+    },
+    'timeout': {
+        'description': (
+            "The seconds to wait for the target resync progress. Default "
+            "value is %d." % RAID_RESYNC_TIMEOUT
+        ),
+        'required': False,
+    },
+    'speed_max': {
+        'description': (
+            "The maximum resync speed in KB/s when throttling, a positive "
+            "integer. Default value is %d." % RAID_RESYNC_SPEED_MAX
+        ),
+        'required': False,
+    },
+}
+
+# Where the progress of the running erase is published while cleaning, and
+# how often (in seconds) it is rewritten as data is written
+ERASE_PROGRESS_FILE = '/run/ironic-python-agent/erase-progress.json'
+ERASE_PROGRESS_INTERVAL = 5
+
+# Call the hardware managers at the same time in dispatch_to_all_managers, for
+# independent vendor managers (RAID, firmware, NIC...) only
+CONCURRENT_DISPATCH = False
+
+# Where the resolved hardware manager entry points are cached between agent
+# restarts; the cache is dropped whenever a sys.path entry changes
+HARDWARE_MANAGERS_CACHE = '/run/ironic-python-agent/hardware-managers.json'
+
+# Seconds to wait for the BMC to answer a request sent through the IPMI
+# device (see the native_ipmi option)
+IPMI_REQUEST_TIMEOUT = 5
+_IPMI_MODULES_LOADED = False
+
 
 def _get_device_info(dev, devclass, field):
     """Get the device info according to device class and field."""
@@ -68,16 +338,417 @@ def _get_device_info(dev, devclass, field):
                 field, dev, devclass))
 
 
+class _CollectorTimeout(Exception):
+    """An inventory collector spent its time budget."""
+
+
+# Deadline (a time.time() value) of the inventory collector running in the
+# current thread, if any
+_collector_state = threading.local()
+
+
+@contextlib.contextmanager
+def _collector_deadline(deadline):
+    """Bound the commands run through _execute in this thread.
+
+    :param deadline: The time.time() value after which the commands are
+                     killed.
+    """
+    _collector_state.deadline = deadline
+    try:
+        yield
+    finally:
+        _collector_state.deadline = None
+
+
+def _kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # Already gone
+        pass
+
+
+def _execute(*cmd, **kwargs):
+    """Run a command of an inventory collector with utils.execute.
+
+    Within _collector_deadline the command runs in its own session and is
+    killed, with the commands it started (e.g. those of a shell pipeline),
+    once the deadline passes. Otherwise this is utils.execute.
+
+    :raises: _CollectorTimeout if the command was killed at the deadline,
+             otherwise whatever utils.execute raises.
+    """
+    deadline = getattr(_collector_state, 'deadline', None)
+    if deadline is None:
+        return utils.execute(*cmd, **kwargs)
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise _CollectorTimeout('No time left to run %s' % (cmd,))
+    timers = []
+    killed = []
+
+    def kill(process):
+        killed.append(process.pid)
+        _kill_process_group(process)
+
+    def start_timer(process):
+        timer = threading.Timer(remaining, kill, (process,))
+        timer.daemon = True
+        timers.append(timer)
+        timer.start()
+
+    try:
+        return utils.execute(*cmd, on_execute=start_timer,
+                             preexec_fn=os.setsid, **kwargs)
+    except processutils.ProcessExecutionError:
+        if killed:
+            raise _CollectorTimeout('%s killed after %.1f seconds'
+                                    % (cmd, remaining))
+        raise
+    finally:
+        for timer in timers:
+            timer.cancel()
+
+
+def _load_lshw():
+    out, _e = _execute('lshw', '-quiet', '-json', log_stdout=False)
+    return json.loads(out)
+
+
+def _load_lscpu():
+    return _execute('lscpu')[0]
+
+
+def _load_cpuinfo():
+    with open('/proc/cpuinfo', 'r') as f:
+        return f.read()
+
+
+def _load_dmi():
+    with open('/sys/firmware/dmi/tables/DMI', 'rb') as f:
+        return f.read()
+
+
+class _IpmiError(Exception):
+    """An IPMI request through the IPMI device failed."""
+
+
+class _IpmiMsg(ctypes.Structure):
+    _fields_ = [('netfn', ctypes.c_ubyte),
+                ('cmd', ctypes.c_ubyte),
+                ('data_len', ctypes.c_ushort),
+                ('data', ctypes.c_void_p)]
+
+
+class _IpmiReq(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_void_p),
+                ('addr_len', ctypes.c_uint),
+                ('msgid', ctypes.c_long),
+                ('msg', _IpmiMsg)]
+
+
+class _IpmiRecv(ctypes.Structure):
+    _fields_ = [('recv_type', ctypes.c_int),
+                ('addr', ctypes.c_void_p),
+                ('addr_len', ctypes.c_uint),
+                ('msgid', ctypes.c_long),
+                ('msg', _IpmiMsg)]
+
+
+class _IpmiSystemInterfaceAddr(ctypes.Structure):
+    _fields_ = [('addr_type', ctypes.c_int),
+                ('channel', ctypes.c_short),
+                ('lun', ctypes.c_ubyte)]
+
+
+def _ipmi_ioc(direction, number, struct):
+    # _IOC() from asm-generic/ioctl.h, with the 'i' type of linux/ipmi.h
+    return ((direction << 30) | (ctypes.sizeof(struct) << 16) |
+            (ord('i') << 8) | number)
+
+
+_IPMICTL_RECEIVE_MSG_TRUNC = _ipmi_ioc(3, 11, _IpmiRecv)
+_IPMICTL_SEND_COMMAND = _ipmi_ioc(2, 13, _IpmiReq)
+
+
+class _IpmiDevice(object):
+    """Minimal client of the Linux IPMI device interface.
+
+    Sends requests to the local BMC through the ioctls of /dev/ipmi0, in
+    process and without ipmitool. Use as a context manager to keep the
+    device open for several requests.
+    """
+
+    paths = ('/dev/ipmi0', '/dev/ipmi/0', '/dev/ipmidev/0')
+
+    def __init__(self, timeout=IPMI_REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self._fd = None
+        self._msgid = 0
+        self._libc = ctypes.CDLL(None, use_errno=True)
+
+    def __enter__(self):
+        error = None
+        for path in self.paths:
+            try:
+                self._fd = os.open(path, os.O_RDWR)
+                return self
+            except OSError as e:
+                error = e
+        raise error
+
+    def __exit__(self, *exc_info):
+        os.close(self._fd)
+        self._fd = None
+
+    def _ioctl(self, request, arg):
+        if self._libc.ioctl(self._fd, request, ctypes.byref(arg)) < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def request(self, netfn, cmd, data=()):
+        """Send a request to the BMC and wait for its response.
+
+        :param netfn: The network function of the request.
+        :param cmd: The command of the request.
+        :param data: The request data, as a sequence of byte values.
+        :raises: _IpmiError if the BMC does not answer in time or answers
+                 with a completion code other than success, OSError if the
+                 IPMI device can not be used.
+        :return: The response data, without the completion code, as a
+                 bytearray.
+        """
+        self._msgid += 1
+        addr = _IpmiSystemInterfaceAddr(0x0c, 0x0f, 0)
+        request_data = (ctypes.c_ubyte * max(len(data), 1))(*data)
+        req = _IpmiReq(ctypes.cast(ctypes.byref(addr), ctypes.c_void_p),
+                       ctypes.sizeof(addr), self._msgid,
+                       _IpmiMsg(netfn, cmd, len(data),
+                                ctypes.cast(request_data, ctypes.c_void_p)))
+        self._ioctl(_IPMICTL_SEND_COMMAND, req)
+
+        deadline = time.time() + self.timeout
+        response_addr = ctypes.create_string_buffer(64)
+        response_data = ctypes.create_string_buffer(512)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([self._fd], [], [],
+                                                   remaining)[0]:
+                raise _IpmiError('No response from the BMC to netfn '
+                                 '0x%02x command 0x%02x' % (netfn, cmd))
+            recv = _IpmiRecv(0, ctypes.cast(response_addr, ctypes.c_void_p),
+                             ctypes.sizeof(response_addr), 0,
+                             _IpmiMsg(0, 0, ctypes.sizeof(response_data),
+                                      ctypes.cast(response_data,
+                                                  ctypes.c_void_p)))
+            self._ioctl(_IPMICTL_RECEIVE_MSG_TRUNC, recv)
+            if recv.msgid == self._msgid:
+                break
+
+        response = bytearray(response_data.raw[:recv.msg.data_len])
+        if not response or response[0] != 0:
+            raise _IpmiError('BMC returned completion code 0x%02x to netfn '
+                             '0x%02x command 0x%02x' %
+                             (response[0] if response else 0xff, netfn, cmd))
+        return response[1:]
+
+    def is_lan_channel(self, channel):
+        """Check with Get Channel Info if a channel is an 802.3 LAN."""
+        try:
+            info = self.request(0x06, 0x42, [channel])
+        except _IpmiError:
+            return False
+        return len(info) > 1 and info[1] & 0x7f == 0x04
+
+    def get_lan_config(self, channel, parameter, set_selector=0):
+        """Get a LAN Configuration Parameter of a channel.
+
+        :return: The parameter data, without the revision byte, or None if
+                 the BMC does not support the parameter.
+        """
+        try:
+            response = self.request(0x0c, 0x02,
+                                    [channel, parameter, set_selector, 0])
+        except _IpmiError:
+            return None
+        return response[1:]
+
+
+def _ipv6_addresses_from_lan_config(data, count, dynamic):
+    """Decode the IPv6 address sets (parameters 56 and 59) of a channel."""
+    addresses = []
+    for set_selector in range(count):
+        entry = data(set_selector)
+        # set selector, source/type, 16 bytes of address, prefix, status
+        if entry is None or len(entry) < 20:
+            continue
+        source = entry[1] & 0x0f
+        addresses.append({
+            'address': socket.inet_ntop(socket.AF_INET6,
+                                        bytes(entry[2:18])),
+            'prefix_length': entry[18],
+            'enabled': (source in (1, 2)) if dynamic
+            else bool(entry[1] & 0x80),
+            'active': entry[19] == 0,
+        })
+    return addresses
+
+
+def _load_bmc_lan():
+    """Read the LAN configuration of every BMC channel in one session.
+
+    :raises: OSError if the IPMI device can not be used, _IpmiError if the
+             BMC does not answer.
+    :return: A dict mapping the LAN channel numbers to dicts with the
+             'ipv4_address' of the channel, its 'ipv6_enables' (0 for IPv4
+             only, 1 for IPv6 only, 2 for both) and its 'ipv6_dynamic' and
+             'ipv6_static' addresses.
+    """
+    lan_config = {}
+    with _IpmiDevice() as ipmi:
+        # Get Device ID, so that an unresponsive BMC fails once rather
+        # than once per channel
+        ipmi.request(0x06, 0x01)
+        # From all the channels 0-15, only 1-11 can be assigned to
+        # different types of communication media and protocols and
+        # effectively used
+        for channel in range(1, 12):
+            if not ipmi.is_lan_channel(channel):
+                continue
+
+            channel_config = {'ipv4_address': None, 'ipv6_enables': None,
+                              'ipv6_dynamic': [], 'ipv6_static': []}
+            lan_config[channel] = channel_config
+
+            address = ipmi.get_lan_config(channel, 3)
+            if address is not None and len(address) >= 4:
+                channel_config['ipv4_address'] = '.'.join(
+                    str(octet) for octet in address[:4])
+
+            enables = ipmi.get_lan_config(channel, 51)
+            if not enables:
+                continue
+            channel_config['ipv6_enables'] = enables[0]
+            if enables[0] not in (1, 2):
+                continue
+
+            status = ipmi.get_lan_config(channel, 55)
+            if status is None or len(status) < 2:
+                continue
+            channel_config['ipv6_static'] = _ipv6_addresses_from_lan_config(
+                functools.partial(ipmi.get_lan_config, channel, 56),
+                status[0], dynamic=False)
+            channel_config['ipv6_dynamic'] = _ipv6_addresses_from_lan_config(
+                functools.partial(ipmi.get_lan_config, channel, 59),
+                status[1], dynamic=True)
+
+    return lan_config
+
+
+def _get_bmc_lan_config():
+    """Get the LAN configuration of the BMC channels, if it can be read.
+
+    :return: The 'bmc_lan' hardware snapshot, see _load_bmc_lan, or None if
+             the native_ipmi option is not set or the IPMI device can not be
+             used, for ipmitool to be used instead.
+    """
+    if not CONF.native_ipmi:
+        return None
+    try:
+        return get_hardware_snapshot('bmc_lan')
+    except (EnvironmentError, _IpmiError) as e:
+        LOG.debug('Cannot read the BMC LAN configuration through the '
+                  'IPMI device, falling back to ipmitool: %s', e)
+
+
+def _load_ipmi_modules():
+    """Load the IPMI kernel modules, once per agent run."""
+    global _IPMI_MODULES_LOADED
+    if not _IPMI_MODULES_LOADED:
+        # These modules are rarely loaded automatically
+        utils.try_execute('modprobe', 'ipmi_msghandler')
+        utils.try_execute('modprobe', 'ipmi_devintf')
+        utils.try_execute('modprobe', 'ipmi_si')
+        _IPMI_MODULES_LOADED = True
+
+
+class _HardwareSnapshot(object):
+    """Memoized output of the tools describing static hardware.
+
+    Each source is loaded at most once per HARDWARE_SNAPSHOT_TTL seconds and
+    shared by every caller, so the collectors of an inventory pass (and the
+    passes made during lookup, heartbeat and inspection) do not run the same
+    full hardware scan again. Concurrent callers of the same source wait for
+    the first one instead of running the tool in parallel. Errors are not
+    cached.
+    """
+
+    loaders = {
+        'lshw': _load_lshw,
+        'lscpu': _load_lscpu,
+        'cpuinfo': _load_cpuinfo,
+        'dmi': _load_dmi,
+        'bmc_lan': _load_bmc_lan,
+    }
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = dict((name, threading.Lock()) for name in self.loaders)
+
+    def get(self, name):
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and time.time() - entry[0] < (
+                    HARDWARE_SNAPSHOT_TTL):
+                return entry[1]
+            value = self.loaders[name]()
+            self._entries[name] = (time.time(), value)
+            return value
+
+    def invalidate(self, name=None):
+        for key in [name] if name else list(self.loaders):
+            with self._locks[key]:
+                self._entries.pop(key, None)
+
+
+_hardware_snapshot = _HardwareSnapshot()
+
+
+def get_hardware_snapshot(name):
+    """Get the memoized output of a static hardware source.
+
+    :param name: One of 'lshw' (parsed JSON), 'lscpu' (text), 'cpuinfo'
+                 (text of /proc/cpuinfo), 'dmi' (raw SMBIOS table) and
+                 'bmc_lan' (LAN configuration of the BMC channels, read
+                 through the IPMI device, see _load_bmc_lan).
+    :return: The output of the source, loaded at most once per
+             HARDWARE_SNAPSHOT_TTL seconds. Callers must not modify it.
+    :raises: Whatever the underlying tool raises, usually
+             ProcessExecutionError, OSError or ValueError.
+    """
+    return _hardware_snapshot.get(name)
+
+
+def invalidate_hardware_snapshot(name=None):
+    """Drop a memoized hardware source, forcing it to be loaded again.
+
+    :param name: The source to drop, or None to drop all of them.
+    """
+    _hardware_snapshot.invalidate(name)
+
+
 def _get_system_lshw_dict():
     """Get a dict representation of the system from lshw
 
     Retrieves a json representation of the system from lshw and converts
-    it to a python dict
+    it to a python dict. The result is shared through the hardware snapshot
+    and must not be modified.
 
     :return: A python dict from the lshw json output
     """
-    out, _e = utils.execute('lshw', '-quiet', '-json', log_stdout=False)
-    return json.loads(out)
+    return get_hardware_snapshot('lshw')
 
 
 def _udev_settle():
@@ -88,7 +759,7 @@ def _udev_settle():
 
     """
     try:
-        utils.execute('udevadm', 'settle')
+        _execute('udevadm', 'settle')
     except processutils.ProcessExecutionError as e:
         LOG.warning('Something went wrong when waiting for udev '
                     'to settle. Error: %s', e)
@@ -116,6 +787,374 @@ def _check_for_iscsi():
                     "Error: %s", e)
 
 
+def _get_capabilities(root):
+    """Return the capabilities of node properties or instance info as a dict.
+
+    :param root: The properties or instance_info of a node, holding the
+                 capabilities as a dict, a JSON object or a
+                 'key1:value1,key2:value2' string.
+    """
+    capabilities = root.get('capabilities') or {}
+    if isinstance(capabilities, dict):
+        return capabilities
+    try:
+        capabilities = json.loads(capabilities)
+        if isinstance(capabilities, dict):
+            return capabilities
+    except (TypeError, ValueError):
+        pass
+    result = {}
+    for capability in six.text_type(capabilities).split(','):
+        key, sep, value = capability.partition(':')
+        if sep:
+            result[key.strip()] = value.strip()
+    return result
+
+
+def _get_node_boot_mode(node):
+    """Return the mode the deployed node boots in, 'bios' or 'uefi'.
+
+    The boot_mode capability of the instance, then of the node, is used,
+    else the mode the agent ramdisk was booted in.
+
+    :param node: A dictionary of the node object.
+    """
+    for root in (node.get('instance_info', {}), node.get('properties', {})):
+        boot_mode = _get_capabilities(root).get('boot_mode')
+        if boot_mode:
+            return boot_mode
+    return 'uefi' if os.path.isdir('/sys/firmware/efi') else 'bios'
+
+
+def _get_raid_disk_label(raid_config):
+    """Return the partition table type of the software RAID disks.
+
+    The disk_label capability of the node is not used: it is meant for the
+    partition image, not for the RAID layout.
+
+    :param raid_config: The target RAID configuration.
+    :return: 'msdos' or 'gpt', as set by the 'disk_label' of the RAID
+             configuration, else RAID_DISK_LABEL.
+    """
+    return raid_config.get('disk_label') or RAID_DISK_LABEL
+
+
+def _get_partition_alignment(device):
+    """Return the sector size and partition alignment of a disk.
+
+    Partitions start on a multiple of RAID_PARTITION_ALIGNMENT which is also
+    a multiple of the optimal I/O size (e.g. the stripe width of a hardware
+    RAID volume) and of the physical block size of the disk, offset by the
+    alignment offset the disk reports. Like parted and libblkid, the sizes
+    which are not powers of two, or an optimal I/O size which is not a
+    multiple of the physical block size or is above
+    RAID_MAX_OPTIMAL_IO_SIZE, are ignored: some controllers report values
+    like 33553920 which would waste most of the disk.
+
+    :param device: The path of the disk.
+    :return: A tuple of the logical sector size, the alignment and the
+             alignment offset, all in bytes.
+    """
+    sys_dir = '/sys/block/%s' % os.path.basename(device)
+
+    def read(name, default):
+        value = _read_sysfs(os.path.join(sys_dir, name))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def is_power_of_two(size):
+        return size > 0 and not size & (size - 1)
+
+    sector_size = read('queue/logical_block_size', 512) or 512
+    alignment = RAID_PARTITION_ALIGNMENT
+    physical_block_size = read('queue/physical_block_size', 0)
+    if (is_power_of_two(physical_block_size)
+            and not physical_block_size % sector_size):
+        alignment = max(alignment, physical_block_size)
+    else:
+        physical_block_size = sector_size
+    optimal_io_size = read('queue/optimal_io_size', 0)
+    if (is_power_of_two(optimal_io_size)
+            and not optimal_io_size % physical_block_size
+            and optimal_io_size <= RAID_MAX_OPTIMAL_IO_SIZE):
+        alignment = max(alignment, optimal_io_size)
+    elif optimal_io_size:
+        LOG.debug('Ignoring the optimal I/O size %(size)d of %(dev)s',
+                  {'size': optimal_io_size, 'dev': device})
+    offset = read('alignment_offset', 0) % alignment
+    if offset % sector_size:
+        offset = 0
+    return sector_size, alignment, offset
+
+
+def _get_raid_partition_script(device, logical_disks, disk_label,
+                               bios_grub=False):
+    """Build the parted commands partitioning a software RAID disk.
+
+    A partition is created for each logical disk, in order, on the boundaries
+    given by _get_partition_alignment; a logical disk of size 'MAX' (only the
+    last one may be) spans the rest of the disk.
+
+    :param device: The path of the disk.
+    :param logical_disks: The logical disks of the RAID configuration.
+    :param disk_label: The partition table type, 'msdos' or 'gpt'.
+    :param bios_grub: Whether to create a RAID_BIOS_GRUB_SIZE bios_grub
+                      partition first, numbered 1, for grub to be installed
+                      on a GPT disk of a BIOS node.
+    :return: The parted commands, as a list.
+    """
+    sector_size, alignment, offset = _get_partition_alignment(device)
+
+    def align(position):
+        # The first aligned byte at or after position
+        return (-(-(position - offset) // alignment) * alignment) + offset
+
+    parted_script = ['mklabel', disk_label]
+    start = align(RAID_PARTITION_ALIGNMENT)
+    if bios_grub:
+        parted_script += [
+            'mkpart', 'bios_grub', '%ds' % (start // sector_size),
+            '%ds' % ((start + RAID_BIOS_GRUB_SIZE) // sector_size - 1),
+            'set', '1', 'bios_grub', 'on']
+        start = align(start + RAID_BIOS_GRUB_SIZE)
+    for logical_disk in logical_disks:
+        first_sector = '%ds' % (start // sector_size)
+        if logical_disk['size_gb'] == 'MAX':
+            last_sector = '100%'
+        else:
+            size = int(logical_disk['size_gb']) * 1024 ** 3
+            last_sector = '%ds' % ((start + size) // sector_size - 1)
+            start = align(start + size)
+        parted_script += ['mkpart', 'primary', first_sector, last_sector]
+    LOG.debug('Partitioning %(dev)s with %(alignment)d bytes alignment '
+              '(offset %(offset)d): %(script)s',
+              {'dev': device, 'alignment': alignment, 'offset': offset,
+               'script': parted_script})
+    return parted_script
+
+
+def _get_mdadm_layout_options(logical_disk):
+    """Return the mdadm --create options for the layout of a logical disk.
+
+    :param logical_disk: A logical disk of the RAID configuration.
+    :return: A tuple of mdadm options.
+    """
+    options = ()
+    if logical_disk.get('chunk_size_kb'):
+        options += ('--chunk=%dK' % logical_disk['chunk_size_kb'],)
+    if logical_disk.get('bitmap'):
+        options += ('--bitmap=%s' % logical_disk['bitmap'],)
+    if logical_disk.get('bitmap_chunk_kb'):
+        options += ('--bitmap-chunk=%dK' % logical_disk['bitmap_chunk_kb'],)
+    return options
+
+
+def _partition_raid_disk(device, parted_script):
+    """Write the partition table of a software RAID disk.
+
+    :param device: The path of the disk.
+    :param parted_script: The parted commands to run on the disk.
+    :return: An error message, or None on success.
+    """
+    LOG.info("Creating partition table on {}".format(device))
+    try:
+        utils.execute('parted', device, '-s', '-a', 'optimal', '--',
+                      *parted_script)
+    except processutils.ProcessExecutionError as e:
+        return "Failed to create partitions on {}: {}".format(device, e)
+
+
+def _get_md_sysfs_dir(md_device):
+    """Get the sysfs directory of an md device, e.g. /sys/block/md0/md."""
+    return '/sys/block/%s/md' % os.path.basename(md_device)
+
+
+def _set_md_sync_speed(md_device, minimum, maximum):
+    """Throttle the resync of a software RAID device.
+
+    Only the limits of the device itself are set in sysfs: the system wide
+    limits in /proc/sys/dev/raid would outlive the step and apply to every
+    array.
+
+    :param md_device: The path of the md device.
+    :param minimum: The minimum resync speed in KB/s, or None.
+    :param maximum: The maximum resync speed in KB/s, or None.
+    """
+    md_dir = _get_md_sysfs_dir(md_device)
+    for limit, speed in (('min', minimum), ('max', maximum)):
+        if speed is None:
+            continue
+        path = os.path.join(md_dir, 'sync_speed_%s' % limit)
+        try:
+            with open(path, 'w') as f:
+                f.write('%d\n' % speed)
+        except EnvironmentError as e:
+            LOG.warning('Could not set the %(limit)s resync speed of '
+                        '%(dev)s in %(path)s: %(error)s',
+                        {'limit': limit, 'dev': md_device, 'path': path,
+                         'error': e})
+            continue
+        LOG.info('Set the %(limit)s resync speed of %(dev)s to %(speed)d '
+                 'KB/s', {'limit': limit, 'dev': md_device, 'speed': speed})
+
+
+class MdArray(object):
+    """A Linux software RAID (md) array.
+
+    :ivar device: The path of the md device, e.g. /dev/md0.
+    :ivar level: The RAID level, e.g. 'raid1', or None if unknown.
+    :ivar state: The array state, e.g. 'clean' or 'active', or None if
+                 unknown.
+    :ivar members: A list of (device path, state) tuples in slot order, the
+                   state being e.g. 'in_sync', 'spare' or 'faulty'.
+    :ivar sync_action: The running sync action, e.g. 'idle', 'resync' or
+                       'recover', or None if unknown.
+    :ivar sync_progress: The completed fraction of the running sync action,
+                         or None if there is none or it is unknown.
+    """
+
+    def __init__(self, device, level=None, state=None, members=(),
+                 sync_action=None, sync_progress=None):
+        self.device = device
+        self.level = level
+        self.state = state
+        self.members = list(members)
+        self.sync_action = sync_action
+        self.sync_progress = sync_progress
+
+    @property
+    def component_devices(self):
+        """The members actively in sync."""
+        return [member for member, state in self.members
+                if 'in_sync' in state.split(',')]
+
+    @property
+    def holder_disks(self):
+        """The disks holding the members actively in sync."""
+        holder_disks = []
+        for member in self.component_devices:
+            disk = _get_parent_disk(member)
+            if disk:
+                holder_disks.append('/dev/%s' % disk)
+            else:
+                holder_disks += re.findall(r'/dev/\D+', member)
+        return holder_disks
+
+    @classmethod
+    def from_sysfs(cls, device):
+        """Read an md array from /sys/block/mdX/md.
+
+        :returns: An MdArray, or None if sysfs does not know the array.
+        """
+        md_dir = _get_md_sysfs_dir(device)
+        if not os.path.isdir(md_dir):
+            return None
+
+        members = []
+        for entry in os.listdir(md_dir):
+            if not entry.startswith('dev-'):
+                continue
+            member_dir = os.path.join(md_dir, entry)
+            slot = _read_sysfs(os.path.join(member_dir, 'slot'))
+            members.append((
+                int(slot) if slot and slot.isdigit() else float('inf'),
+                '/dev/%s' % os.path.basename(
+                    os.path.realpath(os.path.join(member_dir, 'block'))),
+                _read_sysfs(os.path.join(member_dir, 'state')) or ''))
+        members.sort()
+
+        sync_progress = None
+        completed = _read_sysfs(os.path.join(md_dir, 'sync_completed'))
+        if completed and '/' in completed:
+            done, _sep, total = completed.partition('/')
+            try:
+                sync_progress = float(done) / float(total)
+            except (ValueError, ZeroDivisionError):
+                pass
+
+        return cls(device,
+                   level=_read_sysfs(os.path.join(md_dir, 'level')),
+                   state=_read_sysfs(os.path.join(md_dir, 'array_state')),
+                   members=[(member, state)
+                            for _slot, member, state in members],
+                   sync_action=_read_sysfs(os.path.join(md_dir,
+                                                        'sync_action')),
+                   sync_progress=sync_progress)
+
+    @classmethod
+    def from_mdadm(cls, device):
+        """Read an md array from mdadm --detail --export.
+
+        The export format has neither the array state nor the sync
+        progress; members with a numeric role are reported in sync.
+
+        :raises: ProcessExecutionError if mdadm fails.
+        """
+        out, _ = utils.execute('mdadm', '--detail', '--export', device,
+                               use_standard_locale=True)
+        properties = {}
+        for line in out.splitlines():
+            key, _sep, value = line.partition('=')
+            properties[key.strip()] = value.strip()
+
+        members = []
+        for key, value in properties.items():
+            if key.startswith('MD_DEVICE_') and key.endswith('_DEV'):
+                role = properties.get('%s_ROLE' % key[:-len('_DEV')], '')
+                state = 'in_sync' if role.isdigit() else role
+                members.append((int(role) if role.isdigit() else float('inf'),
+                                value, state))
+        members.sort()
+        return cls(device, level=properties.get('MD_LEVEL'),
+                   members=[(member, state)
+                            for _slot, member, state in members])
+
+
+# MdArrays by device path, while a RAID operation runs (see
+# _md_array_cache_scope)
+_md_arrays = None
+
+
+@contextlib.contextmanager
+def _md_array_cache_scope():
+    """Cache the md arrays read for the duration of a RAID operation."""
+    global _md_arrays
+    _md_arrays = {}
+    try:
+        yield
+    finally:
+        _md_arrays = None
+
+
+def get_md_array(raid_device):
+    """Get an md array, from sysfs or else from mdadm.
+
+    Within a RAID operation the array is read once and cached.
+
+    :param raid_device: A Software RAID block device name.
+    :returns: An MdArray.
+    :raises: ProcessExecutionError if the array is unknown to sysfs and
+             mdadm fails.
+    """
+    cache = _md_arrays
+    if cache is not None and raid_device in cache:
+        return cache[raid_device]
+    md_array = MdArray.from_sysfs(raid_device)
+    if md_array is None:
+        md_array = MdArray.from_mdadm(raid_device)
+    if cache is not None:
+        cache[raid_device] = md_array
+    return md_array
+
+
+def _forget_md_array(raid_device):
+    cache = _md_arrays
+    if cache is not None:
+        cache.pop(raid_device, None)
+
+
 def _get_component_devices(raid_device):
     """Get the component devices of a Software RAID device.
 
@@ -127,24 +1166,13 @@ def _get_component_devices(raid_device):
     if not raid_device:
         return []
 
-    component_devices = []
     try:
-        out, _ = utils.execute('mdadm', '--detail', raid_device,
-                               use_standard_locale=True)
+        return get_md_array(raid_device).component_devices
     except processutils.ProcessExecutionError as e:
         msg = ('Could not get component devices of %(dev)s: %(err)s' %
                {'dev': raid_device, 'err': e})
         raise errors.SoftwareRAIDError(msg)
 
-    lines = out.splitlines()
-    for line in lines:
-        if 'active sync' not in line:
-            continue
-        device = re.findall(r'/dev/\w+', line)
-        component_devices += device
-
-    return component_devices
-
 
 def get_holder_disks(raid_device):
     """Get the holder disks of a Software RAID device.
@@ -157,25 +1185,13 @@ def get_holder_disks(raid_device):
     if not raid_device:
         return []
 
-    holder_disks = []
-
     try:
-        out, _ = utils.execute('mdadm', '--detail', raid_device,
-                               use_standard_locale=True)
+        return get_md_array(raid_device).holder_disks
     except processutils.ProcessExecutionError as e:
         msg = ('Could not get holder disks of %(dev)s: %(err)s' %
                {'dev': raid_device, 'err': e})
         raise errors.SoftwareRAIDError(msg)
 
-    lines = out.splitlines()
-    for line in lines:
-        if 'active sync' not in line:
-            continue
-        device = re.findall(r'/dev/\D+', line)
-        holder_disks += device
-
-    return holder_disks
-
 
 def is_md_device(raid_device):
     """Check if a device is an md device
@@ -186,7 +1202,7 @@ def is_md_device(raid_device):
     :returns: True if the device is an md device, False otherwise.
     """
     try:
-        utils.execute('mdadm', '--detail', raid_device)
+        get_md_array(raid_device)
         LOG.debug("%s is an md device", raid_device)
         return True
     except processutils.ProcessExecutionError:
@@ -194,158 +1210,1566 @@ def is_md_device(raid_device):
         return False
 
 
-def md_restart(raid_device):
-    """Restart an md device
+def md_restart(raid_device):
+    """Restart an md device
+
+    Stop and re-assemble a Software RAID (md) device.
+
+    :param raid_device: A Software RAID block device name.
+    :raises: CommandExecutionError in case the restart fails.
+    """
+    try:
+        component_devices = _get_component_devices(raid_device)
+        _forget_md_array(raid_device)
+        utils.execute('mdadm', '--stop', raid_device)
+        utils.execute('mdadm', '--assemble', raid_device,
+                      *component_devices)
+    except processutils.ProcessExecutionError as e:
+        error_msg = ('Could not restart md device %(dev)s: %(err)s' %
+                     {'dev': raid_device, 'err': e})
+        LOG.error(error_msg)
+        raise errors.CommandExecutionError(error_msg)
+
+
+_MDSTAT_ARRAY_RE = re.compile(r'^(md\w+)\s*:')
+_MDSTAT_SYNC_RE = re.compile(r'(resync|recovery|reshape|check|repair)\s*=\s*'
+                             r'([\d.]+)%.*?finish=([\d.]+)min\s+'
+                             r'speed=(\d+)K/sec')
+
+
+def _parse_mdstat(text):
+    """Parse the sync progress of the md arrays in /proc/mdstat.
+
+    :param text: The content of /proc/mdstat.
+    :return: A dict mapping md device paths to dicts like the ones of
+             get_md_resync_status.
+    """
+    arrays = {}
+    current = None
+    for line in text.splitlines():
+        match = _MDSTAT_ARRAY_RE.match(line)
+        if match:
+            current = {'action': 'idle', 'progress': None,
+                       'speed_kb_per_second': None, 'eta_seconds': None}
+            arrays['/dev/%s' % match.group(1)] = current
+            continue
+        if current is None:
+            continue
+        match = _MDSTAT_SYNC_RE.search(line)
+        if match:
+            current.update(action=match.group(1),
+                           progress=float(match.group(2)) / 100,
+                           eta_seconds=float(match.group(3)) * 60,
+                           speed_kb_per_second=int(match.group(4)))
+        elif 'resync=DELAYED' in line or 'resync=PENDING' in line:
+            current['action'] = 'delayed'
+    return arrays
+
+
+def _read_md_sync_status(md_device):
+    """Read the sync progress of an md array from sysfs.
+
+    :return: A dict like the ones of get_md_resync_status, or None if sysfs
+             does not know the array.
+    """
+    md_dir = _get_md_sysfs_dir(md_device)
+    action = _read_sysfs(os.path.join(md_dir, 'sync_action'))
+    if action is None:
+        return None
+
+    status = {'action': action, 'progress': None,
+              'speed_kb_per_second': None, 'eta_seconds': None}
+    completed = _read_sysfs(os.path.join(md_dir, 'sync_completed')) or ''
+    speed = _read_sysfs(os.path.join(md_dir, 'sync_speed')) or ''
+    if '/' in completed:
+        done, _sep, total = completed.partition('/')
+        try:
+            done, total = int(done), int(total)
+        except ValueError:
+            return status
+        if total:
+            status['progress'] = float(done) / total
+        if speed.isdigit() and int(speed):
+            status['speed_kb_per_second'] = int(speed)
+            # sync_completed counts 512 bytes sectors
+            status['eta_seconds'] = (total - done) / 2.0 / int(speed)
+    return status
+
+
+def get_md_resync_status():
+    """Get the resync (or rebuild) progress of the md arrays.
+
+    :return: A dict mapping md device paths to dicts with the action
+             ('idle', 'resync', 'recover(y)', 'check', 'delayed'...), the
+             completed progress fraction, the speed_kb_per_second and the
+             eta_seconds, the last three being None when not syncing.
+    """
+    try:
+        with open('/proc/mdstat', 'r') as f:
+            arrays = _parse_mdstat(f.read())
+    except EnvironmentError:
+        arrays = {}
+
+    try:
+        names = [name for name in os.listdir('/sys/block')
+                 if name.startswith('md')]
+    except OSError:
+        names = []
+    for name in names:
+        status = _read_md_sync_status(name)
+        if status is not None:
+            # sysfs is more precise than the rounded /proc/mdstat values,
+            # which are kept for delayed resyncs sysfs shows as idle
+            if arrays.get('/dev/%s' % name, {}).get('action') == 'delayed':
+                status['action'] = 'delayed'
+            arrays['/dev/%s' % name] = status
+    return arrays
+
+
+def _is_md_syncing(status):
+    return status['action'] not in ('idle', 'frozen', None)
+
+
+class _MdMonitor(object):
+    """Background follower of the md arrays resync progress.
+
+    Refreshes get_md_resync_status() every MD_MONITOR_INTERVAL seconds, or
+    as soon as the kernel signals a change of /proc/mdstat, and logs the
+    progress of the syncing arrays every MD_MONITOR_LOG_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self.status = {}
+        self.generation = 0
+        self.running = False
+
+    def start(self):
+        self._refresh()
+        thread = threading.Thread(target=self._follow, name='md-monitor')
+        thread.daemon = True
+        self.running = True
+        thread.start()
+
+    def _refresh(self):
+        status = get_md_resync_status()
+        with self._changed:
+            self.status = status
+            self.generation += 1
+            self._changed.notify_all()
+        return status
+
+    def _follow(self):
+        logged_at = 0
+        try:
+            with open('/proc/mdstat', 'r') as mdstat:
+                poller = select.poll()
+                poller.register(mdstat, select.POLLPRI | select.POLLERR)
+                while True:
+                    # Reading the file arms the notification again
+                    mdstat.seek(0)
+                    mdstat.read()
+                    status = self._refresh()
+                    syncing = dict((device, array)
+                                   for device, array in status.items()
+                                   if _is_md_syncing(array))
+                    if (syncing and time.time() - logged_at
+                            >= MD_MONITOR_LOG_INTERVAL):
+                        logged_at = time.time()
+                        for device, array in sorted(syncing.items()):
+                            LOG.info('md device %(dev)s %(action)s: '
+                                     '%(progress)s, %(speed)s KB/s, '
+                                     '%(eta)s seconds left',
+                                     {'dev': device,
+                                      'action': array['action'],
+                                      'progress': array['progress'],
+                                      'speed': array['speed_kb_per_second'],
+                                      'eta': array['eta_seconds']})
+                    poller.poll(MD_MONITOR_INTERVAL * 1000)
+        except Exception as e:
+            LOG.warning('The md monitor stopped: %s', e)
+        finally:
+            with self._changed:
+                self.running = False
+                self._changed.notify_all()
+
+    def wait_for_change(self, generation, timeout):
+        """Wait until the status has been refreshed after generation.
+
+        :param generation: The value of `generation` the caller has seen.
+        :param timeout: Maximum number of seconds to wait.
+        :return: True if the status was refreshed, False on timeout.
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while self.generation == generation and self.running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return self.generation != generation
+
+
+_md_monitor = None
+_md_monitor_lock = threading.Lock()
+
+
+def get_md_monitor():
+    """Get the md monitor, starting it on first use.
+
+    :return: The running md monitor, or None if it can not run on this
+             system.
+    """
+    global _md_monitor
+    with _md_monitor_lock:
+        if _md_monitor is None or not _md_monitor.running:
+            _md_monitor = _MdMonitor()
+            if os.path.exists('/proc/mdstat'):
+                try:
+                    _md_monitor.start()
+                except Exception as e:
+                    LOG.warning('Could not start the md monitor: %s', e)
+    return _md_monitor if _md_monitor.running else None
+
+
+def _read_sysfs(path):
+    """Read a sysfs attribute, returning None if it does not exist."""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _get_udev_properties(devno):
+    """Read the properties of a block device from the udev database.
+
+    :param devno: The device number of the block device, as 'major:minor'.
+    :return: A dict of udev properties, empty if udev has no record of it.
+    """
+    properties = {}
+    try:
+        with open(os.path.join(_UDEV_DATA_DIR, 'b%s' % devno), 'r') as f:
+            for line in f:
+                if line.startswith('E:'):
+                    key, _sep, value = line[2:].rstrip('\n').partition('=')
+                    properties[key] = value
+    except (IOError, OSError):
+        pass
+    return properties
+
+
+def _get_by_path_mapping():
+    """Map device names to the /dev/disk/by-path links pointing to them."""
+    by_path_mapping = {}
+
+    disk_by_path_dir = '/dev/disk/by-path'
+
+    try:
+        paths = os.listdir(disk_by_path_dir)
+
+        for path in paths:
+            path = os.path.join(disk_by_path_dir, path)
+            # Turn possibly relative symbolic link into absolute
+            devname = os.path.join(disk_by_path_dir, os.readlink(path))
+            devname = os.path.abspath(devname)
+            by_path_mapping[devname] = path
+
+    except OSError as e:
+        # NOTE(TheJulia): This is for multipath detection, and will raise
+        # some warning logs with unrelated tests.
+        LOG.warning("Path %(path)s is inaccessible, /dev/disk/by-path/* "
+                    "version of block device name is unavailable "
+                    "Cause: %(error)s", {'path': disk_by_path_dir, 'error': e})
+
+    return by_path_mapping
+
+
+def _is_wanted_block_type(devtype, block_type, ignore_raid, description):
+    """Check if a device of type devtype should be listed.
+
+    :param devtype: The lsblk-style TYPE of the device.
+    :param block_type: Type of block device to find.
+    :param ignore_raid: Ignore auto-identified raid devices.
+    :param description: Description of the device used in the logs.
+    :return: True if the device should be listed, False otherwise.
+    """
+    # Search for raid in the reply type, as RAID is a
+    # disk device, and we should honor it if is present.
+    # Other possible type values, which we skip recording:
+    #   lvm, part, rom, loop
+    if devtype != block_type:
+        if devtype is not None and 'raid' in devtype and not ignore_raid:
+            LOG.debug(
+                "TYPE detected to contain 'raid', signifying a RAID "
+                "volume. Found: {!r}".format(description))
+        else:
+            LOG.debug(
+                "TYPE did not match. Wanted: {!r} but found: {!r}".format(
+                    block_type, description))
+            return False
+    return True
+
+
+def _get_hctl(kname):
+    # NOTE(lucasagomes): Newer versions of the lsblk tool supports
+    # HCTL as a parameter but let's get it from sysfs to avoid breaking
+    # old distros.
+    try:
+        return os.listdir('/sys/block/%s/device/scsi_device' % kname)[0]
+    except (OSError, IndexError):
+        LOG.warning('Could not find the SCSI address (HCTL) for '
+                    'device %s. Skipping', os.path.join('/dev', kname))
+
+
+def _get_sysfs_block_device_type(sysfs_dir, name):
+    """Get the lsblk-style TYPE of a block device from sysfs.
+
+    :param sysfs_dir: The sysfs directory of the block device.
+    :param name: The kernel name of the block device.
+    :return: The device type, e.g. 'disk', 'part', 'raid1' or 'lvm'.
+    """
+    if os.path.exists(os.path.join(sysfs_dir, 'partition')):
+        return 'part'
+    if name.startswith('md'):
+        return _read_sysfs(os.path.join(sysfs_dir, 'md', 'level')) or 'md'
+    if name.startswith('dm-'):
+        dm_uuid = _read_sysfs(os.path.join(sysfs_dir, 'dm', 'uuid')) or ''
+        prefix = dm_uuid.split('-', 1)[0].lower()
+        if prefix.startswith('part'):
+            return 'part'
+        return prefix if '-' in dm_uuid and prefix else 'dm'
+    if name.startswith('loop'):
+        return 'loop'
+    return _SCSI_DEVICE_TYPES.get(
+        _read_sysfs(os.path.join(sysfs_dir, 'device', 'type')), 'disk')
+
+
+def _is_hidden_block_device(sysfs_dir):
+    """Check if lsblk leaves a block device out of its default listing.
+
+    lsblk lists RAM disks only with -a, and util-linux up to 2.33 (as in
+    CentOS/RHEL ramdisks) also leaves out devices of size 0, e.g. card
+    readers without a medium.
+
+    :param sysfs_dir: The sysfs directory of the block device.
+    """
+    devno = _read_sysfs(os.path.join(sysfs_dir, 'dev')) or ''
+    if devno.split(':')[0] == _RAMDISK_MAJOR:
+        return True
+    try:
+        return int(_read_sysfs(os.path.join(sysfs_dir, 'size'))) == 0
+    except (TypeError, ValueError):
+        return True
+
+
+def _iter_sysfs_block_devices():
+    """Walk /sys/block, yielding each device followed by its partitions.
+
+    :return: An iterator of (kernel name, sysfs directory, parent sysfs
+             directory) tuples; the parent is None for whole devices.
+    """
+    for name in sorted(os.listdir('/sys/block')):
+        sysfs_dir = os.path.join('/sys/block', name)
+        yield name, sysfs_dir, None
+        for child in sorted(os.listdir(sysfs_dir)):
+            child_dir = os.path.join(sysfs_dir, child)
+            if os.path.exists(os.path.join(child_dir, 'partition')):
+                yield child, child_dir, sysfs_dir
+
+
+def _get_sysfs_block_device(sysfs_name, sysfs_dir, parent_dir,
+                            by_path_mapping):
+    """Build the BlockDevice of a block device from sysfs and udev.
+
+    :param sysfs_name: The sysfs name of the device, e.g. 'sda1'.
+    :param sysfs_dir: The sysfs directory of the device.
+    :param parent_dir: The sysfs directory of the disk holding the device
+                       if it is a partition, None otherwise.
+    :param by_path_mapping: A dict mapping device names to by-path links.
+    :return: A BlockDevice.
+    """
+    name = os.path.join('/dev', sysfs_name.replace('!', '/'))
+    device_dir = parent_dir or sysfs_dir
+    udev = _get_udev_properties(_read_sysfs(os.path.join(sysfs_dir, 'dev')))
+    # NOTE(lucasagomes): See _list_block_devices_from_lsblk for why
+    # ID_SERIAL_SHORT is used as the serial.
+    extra = {key: udev.get('ID_%s' % udev_key) for key, udev_key in
+             [('wwn', 'WWN'), ('serial', 'SERIAL_SHORT'),
+              ('wwn_with_extension', 'WWN_WITH_EXTENSION'),
+              ('wwn_vendor_extension', 'WWN_VENDOR_EXTENSION')]}
+    if parent_dir is None:
+        extra['hctl'] = _get_hctl(sysfs_name)
+
+    model = _read_sysfs(os.path.join(device_dir, 'device', 'model'))
+    if model is None and 'ID_MODEL_ENC' in udev:
+        model = udev['ID_MODEL_ENC'].replace('\\x20', ' ')
+    size = _read_sysfs(os.path.join(sysfs_dir, 'size')) or 0
+    rotational = _read_sysfs(
+        os.path.join(device_dir, 'queue', 'rotational')) or 0
+
+    return BlockDevice(
+        name=name,
+        model=(model or '').strip(),
+        size=int(size) * 512,
+        rotational=bool(int(rotational)),
+        vendor=_read_sysfs(os.path.join(sysfs_dir, 'device', 'vendor')),
+        by_path=by_path_mapping.get(name),
+        **extra)
+
+
+def _can_enumerate_from_sysfs():
+    return os.path.isdir('/sys/block') and os.path.isdir(_UDEV_DATA_DIR)
+
+
+def _list_block_devices_from_sysfs(block_type, ignore_raid, by_path_mapping,
+                                   all_devices=False):
+    """List block devices by walking /sys/block and the udev database.
+
+    This produces the same BlockDevices as _list_block_devices_from_lsblk
+    without running a subprocess per device, including leaving out the
+    devices lsblk hides by default unless all_devices is set.
+
+    :return: A list of BlockDevices, or None if sysfs or the udev database
+             can not be used and lsblk should be used instead.
+    """
+    if not _can_enumerate_from_sysfs():
+        return None
+
+    try:
+        entries = list(_iter_sysfs_block_devices())
+    except OSError as e:
+        LOG.warning('Could not walk /sys/block, falling back to lsblk. '
+                    'Error: %s', e)
+        return None
+
+    devices = BlockDeviceRegistry()
+    for sysfs_name, sysfs_dir, parent_dir in entries:
+        if not all_devices and _is_hidden_block_device(sysfs_dir):
+            continue
+        devtype = _get_sysfs_block_device_type(sysfs_dir, sysfs_name)
+        if not _is_wanted_block_type(devtype, block_type, ignore_raid,
+                                     '{} {}'.format(sysfs_name, devtype)):
+            continue
+        devices.add(_get_sysfs_block_device(sysfs_name, sysfs_dir,
+                                            parent_dir, by_path_mapping))
+    return list(devices)
+
+
+def _list_block_devices_from_lsblk(block_type, ignore_raid, by_path_mapping,
+                                   all_devices=False):
+    """List block devices using lsblk.
+
+    The switches we use for lsblk: P for KEY="value" output, b for size output
+    in bytes, i to ensure ascii characters only, o to specify the
+    fields/columns we need, and a to list all devices if asked to.
+
+    :return: A list of BlockDevices
+    """
+    columns = ['KNAME', 'MODEL', 'SIZE', 'ROTA', 'TYPE']
+    switches = '-Pbia' if all_devices else '-Pbi'
+    report = _execute('lsblk', switches,
+                      '-o{}'.format(','.join(columns)),
+                      check_exit_code=[0])[0]
+    lines = report.splitlines()
+    context = pyudev.Context()
+
+    devices = BlockDeviceRegistry()
+    for line in lines:
+        device = {}
+        # Split into KEY=VAL pairs
+        vals = shlex.split(line)
+        for key, val in (v.split('=', 1) for v in vals):
+            device[key] = val.strip()
+        # Ignore block types not specified
+        devtype = device.get('TYPE')
+
+        # We already have devices, we should ensure we don't store duplicates.
+        if os.path.join('/dev', device.get('KNAME', '')) in devices:
+            continue
+
+        if not _is_wanted_block_type(devtype, block_type, ignore_raid, line):
+            continue
+
+        # Ensure all required columns are at least present, even if blank
+        missing = set(columns) - set(device)
+        if missing:
+            raise errors.BlockDeviceError(
+                '%s must be returned by lsblk.' % ', '.join(sorted(missing)))
+
+        name = os.path.join('/dev', device['KNAME'])
+
+        try:
+            udev = pyudev.Device.from_device_file(context, name)
+        # pyudev started raising another error in 0.18
+        except (ValueError, EnvironmentError, pyudev.DeviceNotFoundError) as e:
+            LOG.warning("Device %(dev)s is inaccessible, skipping... "
+                        "Error: %(error)s", {'dev': name, 'error': e})
+            extra = {}
+        else:
+            # TODO(lucasagomes): Since lsblk only supports
+            # returning the short serial we are using
+            # ID_SERIAL_SHORT here to keep compatibility with the
+            # bash deploy ramdisk
+            extra = {key: udev.get('ID_%s' % udev_key) for key, udev_key in
+                     [('wwn', 'WWN'), ('serial', 'SERIAL_SHORT'),
+                      ('wwn_with_extension', 'WWN_WITH_EXTENSION'),
+                      ('wwn_vendor_extension', 'WWN_VENDOR_EXTENSION')]}
+
+        hctl = _get_hctl(device['KNAME'])
+        if hctl is not None:
+            extra['hctl'] = hctl
+
+        # Not all /dev entries are pointed to from /dev/disk/by-path
+        by_path_name = by_path_mapping.get(name)
+
+        devices.add(BlockDevice(name=name,
+                                model=device['MODEL'],
+                                size=int(device['SIZE']),
+                                rotational=bool(int(device['ROTA'])),
+                                vendor=_get_device_info(device['KNAME'],
+                                                        'block', 'vendor'),
+                                by_path=by_path_name,
+                                **extra))
+    return list(devices)
+
+
+def list_all_block_devices(block_type='disk',
+                           ignore_raid=False,
+                           all_devices=False):
+    """List all physical block devices
+
+    Devices are answered from the live device inventory when it runs (see
+    the live_device_inventory option). Otherwise they are enumerated from sysfs and the
+    udev database when the native_block_device_enumeration option is set and
+    both are available, and from lsblk if not.
+
+    Broken out as its own function to facilitate custom hardware managers that
+    don't need to subclass GenericHardwareManager.
+
+    :param block_type: Type of block device to find
+    :param ignore_raid: Ignore auto-identified raid devices, example: md0
+                        Defaults to false as these are generally disk
+                        devices and should be treated as such if encountered.
+    :param all_devices: Also list the devices lsblk leaves out by default,
+                        RAM disks and (on older util-linux) empty devices.
+    :return: A list of BlockDevices
+    """
+    live_inventory = get_live_device_inventory()
+    if live_inventory is not None:
+        return live_inventory.list_block_devices(block_type, ignore_raid,
+                                                 all_devices=all_devices)
+
+    _udev_settle()
+
+    by_path_mapping = _get_by_path_mapping()
+
+    devices = None
+    if CONF.native_block_device_enumeration:
+        devices = _list_block_devices_from_sysfs(block_type, ignore_raid,
+                                                 by_path_mapping,
+                                                 all_devices=all_devices)
+    if devices is None:
+        devices = _list_block_devices_from_lsblk(block_type, ignore_raid,
+                                                 by_path_mapping,
+                                                 all_devices=all_devices)
+    return devices
+
+
+def _may_be_root_device(udev):
+    """Check if a udev block event may have revealed the root device.
+
+    :param udev: The pyudev Device of the event.
+    :return: False if the event is about a disk that does not satisfy the
+             root device hints of the cached node, True otherwise.
+    """
+    if udev.action not in ('add', 'change') or udev.device_type != 'disk':
+        return False
+    cached_node = get_cached_node()
+    hints = cached_node and cached_node['properties'].get('root_device')
+    if not hints or not _can_enumerate_from_sysfs():
+        return True
+
+    device = _get_sysfs_block_device(udev.sys_name, udev.sys_path, None,
+                                     _get_by_path_mapping())
+    try:
+        return _match_root_device_hints(BlockDeviceRegistry([device]),
+                                        hints) is not None
+    except ValueError:
+        return True
+
+
+def _parse_dmi_table(table):
+    """Parse a raw SMBIOS structure table.
+
+    :param table: The content of /sys/firmware/dmi/tables/DMI.
+    :return: A list of (type, formatted area, strings) tuples, one for each
+             structure, where the formatted area is a bytearray starting
+             with the structure header and strings is the list of the
+             strings of the structure.
+    """
+    data = bytearray(table)
+    structures = []
+    offset = 0
+    while offset + 4 <= len(data):
+        struct_type, length = data[offset], data[offset + 1]
+        if length < 4:
+            break
+        end = data.find(b'\x00\x00', offset + length)
+        if end < 0:
+            break
+        strings = [string.decode('ascii', 'replace').strip()
+                   for string in data[offset + length:end].split(b'\x00')]
+        structures.append((struct_type, data[offset:offset + length],
+                           strings))
+        # type 127 is the end-of-table marker
+        if struct_type == 127:
+            break
+        offset = end + 2
+    return structures
+
+
+def _dmi_string(formatted, strings, offset):
+    """Get a string field of an SMBIOS structure, None if it is unset."""
+    if offset >= len(formatted) or not formatted[offset]:
+        return None
+    index = formatted[offset] - 1
+    return strings[index] if index < len(strings) else None
+
+
+def _dmi_word(formatted, offset):
+    if offset + 2 > len(formatted):
+        return None
+    return formatted[offset] | formatted[offset + 1] << 8
+
+
+def _get_dmi_system_info():
+    """Get the System Information (SMBIOS type 1) from the DMI table.
+
+    :raises: EnvironmentError if the DMI table can not be read, ValueError
+             if it has no System Information.
+    :return: A dict with the manufacturer, product_name and serial_number.
+    """
+    for struct_type, formatted, strings in _parse_dmi_table(
+            get_hardware_snapshot('dmi')):
+        if struct_type == 1:
+            return {'manufacturer': _dmi_string(formatted, strings, 0x04),
+                    'product_name': _dmi_string(formatted, strings, 0x05),
+                    'serial_number': _dmi_string(formatted, strings, 0x07)}
+    raise ValueError('No System Information structure in the DMI table')
+
+
+def _get_dmi_memory_devices():
+    """Get the installed DIMMs (SMBIOS type 17) from the DMI table.
+
+    Only the devices of the physical memory arrays (type 16) used as system
+    memory are reported, if such arrays are described.
+
+    :raises: EnvironmentError if the DMI table can not be read.
+    :return: A list of dicts with the locator, bank_locator, size_mb and
+             speed (in MT/s, None if unknown) of each installed DIMM.
+    """
+    structures = _parse_dmi_table(get_hardware_snapshot('dmi'))
+    arrays = dict((_dmi_word(formatted, 0x02), formatted[0x05])
+                  for struct_type, formatted, _strings in structures
+                  if struct_type == 16 and len(formatted) > 0x05)
+
+    dimms = []
+    for struct_type, formatted, strings in structures:
+        if struct_type != 17 or len(formatted) < 0x15:
+            continue
+        # 0x03 is the "System memory" use of the memory array
+        if arrays.get(_dmi_word(formatted, 0x04), 0x03) != 0x03:
+            continue
+
+        size = _dmi_word(formatted, 0x0C)
+        if not size or size == 0xFFFF:
+            # not installed or unknown
+            continue
+        if size == 0x7FFF and len(formatted) >= 0x20:
+            # the size is in the Extended Size field, in MB
+            size_mb = (_dmi_word(formatted, 0x1C) |
+                       _dmi_word(formatted, 0x1E) << 16) & 0x7FFFFFFF
+        elif size & 0x8000:
+            size_mb = (size & 0x7FFF) // 1024
+        else:
+            size_mb = size
+
+        dimms.append({'locator': _dmi_string(formatted, strings, 0x10),
+                      'bank_locator': _dmi_string(formatted, strings, 0x11),
+                      'size_mb': size_mb,
+                      'speed': _dmi_word(formatted, 0x15) or None})
+    return dimms
+
+
+def _parse_cpuinfo(cpuinfo):
+    """Parse the text of /proc/cpuinfo.
+
+    :param cpuinfo: The text of /proc/cpuinfo.
+    :return: A list with a dict per processor, mapping the lower case field
+             names to their values.
+    """
+    processors = []
+    for block in cpuinfo.strip().split('\n\n'):
+        fields = {}
+        for line in block.splitlines():
+            key, sep, value = line.partition(':')
+            if sep:
+                fields[key.strip().lower()] = value.strip()
+        if 'processor' in fields:
+            processors.append(fields)
+    return processors
+
+
+def _parse_cpu_list(cpu_list):
+    """Expand a kernel CPU list such as '0-3,8-11' into CPU numbers."""
+    cpus = []
+    for item in cpu_list.split(','):
+        if '-' in item:
+            first, last = item.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        elif item:
+            cpus.append(int(item))
+    return cpus
+
+
+def _parse_cache_size(size):
+    """Convert a sysfs cache size such as '32K' into bytes."""
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if size[-1:].upper() in multipliers:
+        return int(size[:-1]) * multipliers[size[-1:].upper()]
+    return int(size)
+
+
+def _get_cpu_topology(count):
+    """Get the CPU topology from /sys/devices/system.
+
+    :param count: The number of logical CPUs.
+    :return: A dict with the sockets, cores, threads_per_core, caches and
+             numa_nodes arguments of CPU. Missing information is left out.
+    """
+    cpu_dir = '/sys/devices/system/cpu'
+    topology = {}
+
+    packages = set()
+    cores = set()
+    try:
+        cpu_names = [name for name in os.listdir(cpu_dir)
+                     if re.match(r'^cpu\d+$', name)]
+    except OSError as e:
+        LOG.warning('Could not read the CPU topology: %s', e)
+        cpu_names = []
+    for name in cpu_names:
+        package = _read_sysfs(os.path.join(cpu_dir, name, 'topology',
+                                           'physical_package_id'))
+        core = _read_sysfs(os.path.join(cpu_dir, name, 'topology',
+                                        'core_id'))
+        # offline CPUs have no topology
+        if package is not None and core is not None:
+            packages.add(package)
+            cores.add((package, core))
+    if cores:
+        topology['sockets'] = len(packages)
+        topology['cores'] = len(cores)
+        topology['threads_per_core'] = max(count // len(cores), 1)
+
+    caches = {}
+    cache_dir = os.path.join(cpu_dir, 'cpu0', 'cache')
+    try:
+        indexes = [name for name in os.listdir(cache_dir)
+                   if name.startswith('index')]
+    except OSError:
+        indexes = []
+    for index in indexes:
+        level = _read_sysfs(os.path.join(cache_dir, index, 'level'))
+        size = _read_sysfs(os.path.join(cache_dir, index, 'size'))
+        cache_type = _read_sysfs(os.path.join(cache_dir, index, 'type'))
+        if level and size:
+            name = 'L%s%s' % (level, {'Data': 'd', 'Instruction': 'i'}.get(
+                cache_type, ''))
+            try:
+                caches[name] = _parse_cache_size(size)
+            except ValueError:
+                LOG.warning('Malformed size %(size)s of CPU cache %(name)s',
+                            {'size': size, 'name': name})
+    topology['caches'] = caches
+
+    numa_nodes = []
+    node_dir = '/sys/devices/system/node'
+    try:
+        node_names = [name for name in os.listdir(node_dir)
+                      if re.match(r'^node\d+$', name)]
+    except OSError:
+        node_names = []
+    for name in sorted(node_names, key=lambda name: int(name[4:])):
+        cpu_list = _read_sysfs(os.path.join(node_dir, name, 'cpulist'))
+        if cpu_list is not None:
+            numa_nodes.append({'id': int(name[4:]),
+                               'cpus': _parse_cpu_list(cpu_list)})
+    topology['numa_nodes'] = numa_nodes
+
+    return topology
+
+
+class _CollectorThread(threading.Thread):
+    """Daemon thread running a single inventory collector.
+
+    The commands run by the collector through _execute are killed at its
+    deadline. The thread is still a daemon so that a collector stuck
+    elsewhere never blocks the agent from exiting.
+    """
+
+    def __init__(self, name, func, deadline):
+        super(_CollectorThread, self).__init__(name='inventory-%s' % name)
+        self.daemon = True
+        self.func = func
+        self.deadline = deadline
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            with _collector_deadline(self.deadline):
+                self.result = self.func()
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+
+# The collector thread last started for each inventory key, not started again
+# while it is still running
+_collector_threads = {}
+_collector_threads_lock = threading.Lock()
+
+
+class _EraseProgress(object):
+    """Progress of the block devices being erased.
+
+    Tracks, for each device, the erase method in use, the bytes written and
+    the resulting throughput, and publishes it to ERASE_PROGRESS_FILE. Only
+    the overwrite methods report the bytes they write as they go; the other
+    methods count the device size once they succeed. Only the devices
+    started by erase_devices are tracked, erasing any other device (e.g.
+    with a direct erase_block_device call) leaves no entry behind.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._published_at = 0
+
+    def reset(self):
+        with self._lock:
+            self._devices = {}
+
+    def start(self, device, size):
+        now = time.time()
+        with self._lock:
+            self._devices[device] = {
+                'state': 'running', 'method': None, 'size': size,
+                'total_bytes': None, 'bytes_done': 0, 'started_at': now,
+                'finished_at': None, 'sample': (now, 0), 'current_rate': None}
+        self.publish()
+
+    def set_method(self, device, method, total_bytes=None):
+        """Record the erase method in use and the bytes it will write."""
+        with self._lock:
+            progress = self._devices.get(device)
+            if progress is None:
+                return
+            progress['method'] = method
+            progress['total_bytes'] = total_bytes
+            progress['bytes_done'] = 0
+            progress['sample'] = (time.time(), 0)
+        self.publish()
+
+    def advance(self, device, nbytes):
+        now = time.time()
+        with self._lock:
+            progress = self._devices.get(device)
+            if progress is None:
+                return
+            progress['bytes_done'] += nbytes
+            sampled_at, sampled_bytes = progress['sample']
+            if now - sampled_at >= 1:
+                progress['current_rate'] = (
+                    (progress['bytes_done'] - sampled_bytes)
+                    / (now - sampled_at))
+                progress['sample'] = (now, progress['bytes_done'])
+            publish = now - self._published_at >= ERASE_PROGRESS_INTERVAL
+        if publish:
+            self.publish()
+
+    def finish(self, device, succeeded):
+        with self._lock:
+            progress = self._devices.get(device)
+            if progress is not None:
+                progress['state'] = 'done' if succeeded else 'failed'
+                progress['finished_at'] = time.time()
+                progress['current_rate'] = None
+                if succeeded and not progress['bytes_done']:
+                    progress['bytes_done'] = progress['size'] or 0
+        self.publish()
+
+    def _report(self, progress, now):
+        elapsed = (progress['finished_at'] or now) - progress['started_at']
+        average_rate = progress['bytes_done'] / elapsed if elapsed else None
+        eta = None
+        if (progress['state'] == 'running' and progress['total_bytes']
+                and average_rate):
+            eta = ((progress['total_bytes'] - progress['bytes_done'])
+                   / average_rate)
+        return {
+            'state': progress['state'],
+            'method': progress['method'],
+            'bytes_done': progress['bytes_done'],
+            'total_bytes': progress['total_bytes'],
+            'seconds': elapsed,
+            'current_mb_per_second': (
+                progress['current_rate'] / 1048576
+                if progress['current_rate'] is not None else None),
+            'average_mb_per_second': (
+                average_rate / 1048576 if average_rate is not None
+                else None),
+            'eta_seconds': eta,
+        }
+
+    def get(self):
+        now = time.time()
+        with self._lock:
+            return dict((device, self._report(progress, now))
+                        for device, progress in self._devices.items())
+
+    def log_summary(self):
+        """Log the throughput of each erased device."""
+        for device, report in sorted(self.get().items()):
+            LOG.info('Erase of %(dev)s %(state)s with %(method)s: '
+                     '%(bytes)d bytes in %(seconds).1f seconds '
+                     '(%(rate)s MiB/s)',
+                     {'dev': device, 'state': report['state'],
+                      'method': report['method'] or 'no method',
+                      'bytes': report['bytes_done'],
+                      'seconds': report['seconds'],
+                      'rate': ('%.1f' % report['average_mb_per_second']
+                               if report['average_mb_per_second']
+                               is not None else 'n/a')})
+
+    def publish(self):
+        """Write the progress to ERASE_PROGRESS_FILE."""
+        self._published_at = time.time()
+        progress = self.get()
+        try:
+            progress_dir = os.path.dirname(ERASE_PROGRESS_FILE)
+            if not os.path.isdir(progress_dir):
+                os.makedirs(progress_dir, 0o700)
+            temporary_file = '%s.%s' % (ERASE_PROGRESS_FILE,
+                                        threading.current_thread().ident)
+            with open(temporary_file, 'w') as f:
+                json.dump(progress, f)
+            os.rename(temporary_file, ERASE_PROGRESS_FILE)
+        except EnvironmentError as e:
+            LOG.debug('Could not write the erase progress to %(file)s: '
+                      '%(error)s', {'file': ERASE_PROGRESS_FILE, 'error': e})
+
+
+_erase_progress = _EraseProgress()
+
+
+def get_erase_progress():
+    """Get the progress of the block devices being erased.
+
+    :return: A dictionary mapping each device of the running (or last)
+             erase_devices run to its state ('running', 'done' or
+             'failed'), method, bytes_done, total_bytes (when known),
+             seconds, current_mb_per_second, average_mb_per_second and
+             eta_seconds (when known).
+    """
+    return _erase_progress.get()
+
+
+def _erase_block_device_tracked(node, block_device):
+    """Dispatch erase_block_device, tracking the progress of the device."""
+    _erase_progress.start(block_device.name, block_device.size)
+    try:
+        result = dispatch_to_managers('erase_block_device', node=node,
+                                      block_device=block_device)
+    except Exception:
+        _erase_progress.finish(block_device.name, False)
+        raise
+    _erase_progress.finish(block_device.name, True)
+    return result
+
+
+_ATA_ERASE_TIME_RE = re.compile(r'(\d+)min for (ENHANCED )?SECURITY '
+                                r'ERASE UNIT')
+_PCI_PATH_RE = re.compile(r'^pci-([0-9a-fA-F:.]+)')
+
+
+def _get_parent_disk(device):
+    """Get the disk a block device belongs to.
+
+    :param device: The path of a block device.
+    :return: The kernel name of the disk holding a partition, the kernel name
+             of the device itself if it is not a partition, or None if sysfs
+             does not know the device.
+    """
+    name = os.path.basename(device)
+    sysfs_dir = os.path.join('/sys/class/block', name)
+    if not os.path.exists(sysfs_dir):
+        return None
+    if os.path.exists(os.path.join(sysfs_dir, 'partition')):
+        return os.path.basename(os.path.dirname(os.path.realpath(sysfs_dir)))
+    return name
+
+
+_VIRTUAL_MEDIA_LABEL = '/dev/disk/by-label/ir-vfd-dev'
+
+
+def _get_virtual_media_device():
+    """Get the path of the virtual media device, None if there is none."""
+    if not os.path.exists(_VIRTUAL_MEDIA_LABEL):
+        return None
+    link = os.readlink(_VIRTUAL_MEDIA_LABEL)
+    return os.path.normpath(os.path.join(
+        os.path.dirname(_VIRTUAL_MEDIA_LABEL), link))
+
+
+def _classify_block_devices_from_sysfs():
+    """Read the filesystem type and relations of block devices from sysfs.
+
+    :return: A dict mapping device paths to dicts with the fstype, the
+             partitions and the holders (as device paths), or None if the
+             udev database has no record of some device.
+    """
+    if not _can_enumerate_from_sysfs():
+        return None
+
+    devices = {}
+    for name in os.listdir('/sys/class/block'):
+        sysfs_dir = os.path.join('/sys/class/block', name)
+        devno = _read_sysfs(os.path.join(sysfs_dir, 'dev'))
+        properties = _get_udev_properties(devno) if devno else {}
+        if not properties:
+            LOG.debug('The udev database has no record of %s', name)
+            return None
+        try:
+            holders = os.listdir(os.path.join(sysfs_dir, 'holders'))
+        except OSError:
+            holders = []
+        devices['/dev/%s' % name] = {
+            'fstype': properties.get('ID_FS_TYPE') or None,
+            'partitions': [],
+            'holders': ['/dev/%s' % holder for holder in holders]}
+
+    for name in os.listdir('/sys/class/block'):
+        parent = _get_parent_disk(name)
+        if parent and parent != name and '/dev/%s' % parent in devices:
+            devices['/dev/%s' % parent]['partitions'].append('/dev/%s' % name)
+    return devices
+
+
+def _classify_block_devices_from_lsblk():
+    """Read the filesystem type and relations of block devices from lsblk.
+
+    :return: A dict like _classify_block_devices_from_sysfs.
+    :raises ProcessExecutionError, OSError, ValueError: if lsblk fails.
+    """
+    output = utils.execute('lsblk', '--json', '--paths',
+                           '--output', 'NAME,FSTYPE,TYPE')[0]
+    devices = {}
+
+    def _walk(node):
+        device = devices.setdefault(node['name'], {
+            'fstype': node.get('fstype') or None,
+            'partitions': [], 'holders': []})
+        for child in node.get('children', []):
+            key = 'partitions' if child.get('type') == 'part' else 'holders'
+            if child['name'] not in device[key]:
+                device[key].append(child['name'])
+            _walk(child)
+
+    for node in json.loads(output).get('blockdevices', []):
+        _walk(node)
+    return devices
+
+
+def _classify_block_devices():
+    """Classify all block devices in a single pass.
+
+    Reads the filesystem type, partitions and holders of every block device
+    from the udev database and sysfs, or else from one lsblk call, and
+    derives which devices are (or hold partitions that are) Linux RAID
+    members and which one is the virtual media device.
+
+    :return: A dict mapping device paths to dicts with the fstype,
+             partitions, holders, linux_raid_member and virtual_media keys,
+             or None if the devices cannot be classified.
+    """
+    devices = None
+    try:
+        devices = _classify_block_devices_from_sysfs()
+    except EnvironmentError as e:
+        LOG.debug('Could not classify block devices from sysfs: %s', e)
+    if devices is None:
+        try:
+            devices = _classify_block_devices_from_lsblk()
+        except (processutils.ProcessExecutionError, OSError,
+                ValueError) as e:
+            LOG.warning('Could not classify block devices, checking them '
+                        'one by one: %s', e)
+            return None
+
+    def _is_raid_member(path, seen):
+        # Like "lsblk --fs <device>", consider the device and everything
+        # below it: its partitions and the devices holding them
+        if path in seen or path not in devices:
+            return False
+        seen.add(path)
+        device = devices[path]
+        return (device['fstype'] == 'linux_raid_member'
+                or any(_is_raid_member(child, seen)
+                       for child in device['partitions'] + device['holders']))
+
+    virtual_media_device = _get_virtual_media_device()
+    for path, device in devices.items():
+        device['linux_raid_member'] = _is_raid_member(path, set())
+        device['virtual_media'] = path == virtual_media_device
+    return devices
+
+
+# The classification of the block devices, while erase_devices or
+# erase_devices_metadata runs
+_classification = None
+
+
+@contextlib.contextmanager
+def _block_device_classification():
+    """Classify the block devices for the duration of a cleaning step."""
+    global _classification
+    _classification = _classify_block_devices()
+    try:
+        yield
+    finally:
+        _classification = None
+
+
+def _get_erase_controller(block_device):
+    """Identify the controller a block device is attached to.
+
+    :param block_device: a BlockDevice object.
+    :return: The PCI address from the by-path link, else the SCSI host from
+             the HCTL, else the device name.
+    """
+    if block_device.by_path:
+        match = _PCI_PATH_RE.match(os.path.basename(block_device.by_path))
+        if match:
+            return 'pci-%s' % match.group(1)
+    if block_device.hctl:
+        return 'scsi-host%s' % block_device.hctl.split(':')[0]
+    return block_device.name
+
+
+def _get_media_type(block_device):
+    return 'rotational' if block_device.rotational else 'solid_state'
+
+
+def _parse_ata_security_lines(output):
+    """Get the lines of the Security section of hdparm -I output."""
+    if '\nSecurity: ' not in output:
+        return []
+
+    # Get all lines after the 'Security: ' line
+    security_and_beyond = output.split('\nSecurity: \n')[1]
+    security_and_beyond_lines = security_and_beyond.split('\n')
+
+    security_lines = []
+    for line in security_and_beyond_lines:
+        if line.startswith('\t'):
+            security_lines.append(line.strip().replace('\t', ' '))
+        else:
+            break
+
+    return security_lines
+
+
+def _smartctl_security_check(device):
+    """Check if the security of a device can be queried via smartctl.
+
+    :param device: The path of the block device.
+    :returns: True if we can query the block device via ATA or the smartctl
+              binary is not present. False if we cannot query the device.
+    """
+    try:
+        # NOTE(TheJulia): smartctl has a concept of drivers being how
+        # to query or interpret data from the device. We want to use `ata`
+        # instead of `scsi` or `sat` as smartctl will not be able to read
+        # a bridged device that it doesn't understand, and accordingly
+        # return an error code.
+        output = utils.execute('smartctl', '-d', 'ata', device,
+                               '-g', 'security',
+                               check_exit_code=[0, 127])[0]
+        if 'Unavailable' in output:
+            # Smartctl is reporting it is unavailable, lets return false.
+            LOG.debug('Smartctl has reported that security is '
+                      'unavailable on device %s.', device)
+            return False
+        return True
+    except processutils.ProcessExecutionError:
+        # Things don't look so good....
+        LOG.warning('Refusing to permit ATA Secure Erase as direct '
+                    'ATA commands via the `smartctl` utility with device '
+                    '%s do not succeed.', device)
+        return False
+    except OSError:
+        # Processutils can raise OSError if a path is not found,
+        # and it is okay that we tollerate that since it was the
+        # prior behavior.
+        return True
+
+
+def _probe_ata(block_device):
+    """Probe the ATA security capabilities of a block device.
+
+    :param block_device: a BlockDevice object.
+    :return: A dict with the security_lines of hdparm -I (None if hdparm
+             failed), the supported, enabled, locked, frozen and
+             enhanced_erase flags, the erase_minutes and
+             enhanced_erase_minutes estimates (None if not reported) and the
+             smartctl_check result (None if hdparm failed).
+    """
+    try:
+        output = utils.execute('hdparm', '-I', block_device.name)[0]
+    except (processutils.ProcessExecutionError, OSError) as e:
+        LOG.debug('Could not probe the ATA security of %(dev)s: %(err)s',
+                  {'dev': block_device.name, 'err': e})
+        return {'security_lines': None, 'supported': False,
+                'enabled': False, 'locked': False, 'frozen': False,
+                'enhanced_erase': False, 'erase_minutes': None,
+                'enhanced_erase_minutes': None, 'smartctl_check': None}
+
+    security_lines = _parse_ata_security_lines(output)
+    probe = {
+        'security_lines': security_lines,
+        'supported': 'supported' in security_lines,
+        'enabled': 'enabled' in security_lines,
+        'locked': 'locked' in security_lines,
+        'frozen': 'frozen' in security_lines,
+        'enhanced_erase': 'supported: enhanced erase' in security_lines,
+        'erase_minutes': None,
+        'enhanced_erase_minutes': None,
+        'smartctl_check': None,
+    }
+    for minutes, enhanced in _ATA_ERASE_TIME_RE.findall(output):
+        key = 'enhanced_erase_minutes' if enhanced else 'erase_minutes'
+        probe[key] = int(minutes)
+    if probe['supported']:
+        probe['smartctl_check'] = _smartctl_security_check(block_device.name)
+    return probe
+
+
+# ATA probes by device identity, see _get_ata_probe
+_ata_probes = {}
+_ata_probes_lock = threading.Lock()
+
+
+def _get_ata_identity(block_device):
+    return (block_device.name, block_device.serial, block_device.wwn)
+
+
+def _get_ata_probe(block_device):
+    """Get the ATA probe of a block device, probing it if needed."""
+    identity = _get_ata_identity(block_device)
+    with _ata_probes_lock:
+        probe = _ata_probes.get(identity)
+    if probe is None:
+        probe = _probe_ata(block_device)
+        with _ata_probes_lock:
+            _ata_probes[identity] = probe
+    return probe
+
+
+def _pop_ata_probe(block_device):
+    """Remove and return the cached ATA probe of a block device, if any."""
+    with _ata_probes_lock:
+        return _ata_probes.pop(_get_ata_identity(block_device), None)
+
+
+def _probe_ata_devices(block_devices):
+    """Probe the ATA security of block devices concurrently.
+
+    The probes of a previous run are dropped first.
+
+    :param block_devices: a list of BlockDevice objects.
+    """
+    with _ata_probes_lock:
+        _ata_probes.clear()
+    if not block_devices:
+        return
+    thread_pool = ThreadPool(min(ATA_PROBE_CONCURRENCY, len(block_devices)))
+    try:
+        thread_pool.map(_get_ata_probe, block_devices)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+
 
-    Stop and re-assemble a Software RAID (md) device.
+def _estimate_erase_time(block_device):
+    """Estimate in seconds how long erasing a block device takes.
 
-    :param raid_device: A Software RAID block device name.
-    :raises: CommandExecutionError in case the restart fails.
+    :param block_device: a BlockDevice object.
+    :return: The longest ATA security erase time hdparm reports, or the
+             device size over the throughput assumed for its media type.
     """
-    try:
-        component_devices = _get_component_devices(raid_device)
-        utils.execute('mdadm', '--stop', raid_device)
-        utils.execute('mdadm', '--assemble', raid_device,
-                      *component_devices)
-    except processutils.ProcessExecutionError as e:
-        error_msg = ('Could not restart md device %(dev)s: %(err)s' %
-                     {'dev': raid_device, 'err': e})
-        LOG.error(error_msg)
-        raise errors.CommandExecutionError(error_msg)
+    probe = _get_ata_probe(block_device)
+    minutes = [value for value in (probe['erase_minutes'],
+                                   probe['enhanced_erase_minutes'])
+               if value is not None]
+    if minutes:
+        return max(minutes) * 60
+    throughput = ERASE_THROUGHPUT_ESTIMATES[_get_media_type(block_device)]
+    return float(block_device.size or 0) / throughput
 
 
-def list_all_block_devices(block_type='disk',
-                           ignore_raid=False):
-    """List all physical block devices
-
-    The switches we use for lsblk: P for KEY="value" output, b for size output
-    in bytes, i to ensure ascii characters only, and o to specify the
-    fields/columns we need.
+def _schedule_erase(node, block_devices):
+    """Erase block devices grouped by controller and media type.
 
-    Broken out as its own function to facilitate custom hardware managers that
-    don't need to subclass GenericHardwareManager.
+    Each group of devices sharing a controller and a media type is erased by
+    its own pool of workers, so a busy HBA does not hold back the NVMe
+    devices. Within a group, the devices expected to take the longest are
+    started first.
 
-    :param block_type: Type of block device to find
-    :param ignore_raid: Ignore auto-identified raid devices, example: md0
-                        Defaults to false as these are generally disk
-                        devices and should be treated as such if encountered.
-    :return: A list of BlockDevices
+    :param node: Ironic node object
+    :param block_devices: a list of BlockDevice objects to erase.
+    :return: a dictionary in the form {device.name: AsyncResult}, to be
+             read once all the pools have been joined.
     """
+    info = node.get('driver_internal_info', {})
+    concurrency = {
+        'rotational': info.get('disk_erasure_concurrency_rotational',
+                               ERASE_GROUP_CONCURRENCY['rotational']),
+        'solid_state': info.get('disk_erasure_concurrency_solid_state',
+                                ERASE_GROUP_CONCURRENCY['solid_state']),
+    }
+
+    groups = {}
+    for block_device in block_devices:
+        key = (_get_erase_controller(block_device),
+               _get_media_type(block_device))
+        estimate = _estimate_erase_time(block_device)
+        groups.setdefault(key, []).append((estimate, block_device))
+
+    erase_results = {}
+    thread_pools = []
+    for (controller, media_type), devices in sorted(groups.items()):
+        devices.sort(key=lambda item: item[0], reverse=True)
+        pool_size = max(1, min(concurrency[media_type], len(devices)))
+        LOG.info('Erasing %(devices)s on %(controller)s (%(media)s) '
+                 '%(size)d at a time',
+                 {'devices': ', '.join(device.name
+                                       for _estimate, device in devices),
+                  'controller': controller, 'media': media_type,
+                  'size': pool_size})
+        thread_pool = ThreadPool(pool_size)
+        thread_pools.append(thread_pool)
+        for _estimate, block_device in devices:
+            erase_results[block_device.name] = thread_pool.apply_async(
+                _erase_block_device_tracked, (node, block_device))
 
-    def _is_known_device(existing, new_device_name):
-        """Return true if device name is already known."""
-        for known_dev in existing:
-            if os.path.join('/dev', new_device_name) == known_dev.name:
-                return True
-        return False
+    for thread_pool in thread_pools:
+        thread_pool.close()
+    for thread_pool in thread_pools:
+        thread_pool.join()
+    return erase_results
 
-    _udev_settle()
 
-    # map device names to /dev/disk/by-path symbolic links that points to it
+def _get_block_device_size(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
 
-    by_path_mapping = {}
 
-    disk_by_path_dir = '/dev/disk/by-path'
+# Block device ioctls from linux/fs.h, taking a uint64_t[2] {start, length}
+_BLKSECDISCARD = 0x127d
+_BLKZEROOUT = 0x127f
 
-    try:
-        paths = os.listdir(disk_by_path_dir)
 
-        for path in paths:
-            path = os.path.join(disk_by_path_dir, path)
-            # Turn possibly relative symbolic link into absolute
-            devname = os.path.join(disk_by_path_dir, os.readlink(path))
-            devname = os.path.abspath(devname)
-            by_path_mapping[devname] = path
+def _get_erase_offload_capabilities(block_device):
+    """Read the erase offloads a block device supports from sysfs.
 
-    except OSError as e:
-        # NOTE(TheJulia): This is for multipath detection, and will raise
-        # some warning logs with unrelated tests.
-        LOG.warning("Path %(path)s is inaccessible, /dev/disk/by-path/* "
-                    "version of block device name is unavailable "
-                    "Cause: %(error)s", {'path': disk_by_path_dir, 'error': e})
+    :param block_device: a BlockDevice object.
+    :return: A dict with the discard_max_bytes and write_zeroes_max_bytes
+             queue limits, 0 when unknown.
+    """
+    queue_dir = '/sys/block/%s/queue' % os.path.basename(block_device.name)
+    capabilities = {}
+    for limit in ('discard_max_bytes', 'write_zeroes_max_bytes'):
+        try:
+            capabilities[limit] = int(
+                _read_sysfs(os.path.join(queue_dir, limit)) or 0)
+        except ValueError:
+            capabilities[limit] = 0
+    return capabilities
 
-    columns = ['KNAME', 'MODEL', 'SIZE', 'ROTA', 'TYPE']
-    report = utils.execute('lsblk', '-Pbi', '-o{}'.format(','.join(columns)),
-                           check_exit_code=[0])[0]
-    lines = report.splitlines()
-    context = pyudev.Context()
 
-    devices = []
-    for line in lines:
-        device = {}
-        # Split into KEY=VAL pairs
-        vals = shlex.split(line)
-        for key, val in (v.split('=', 1) for v in vals):
-            device[key] = val.strip()
-        # Ignore block types not specified
-        devtype = device.get('TYPE')
+def _block_range_ioctl(path, request):
+    """Apply a range ioctl (discard, zero out...) to a whole block device.
 
-        # We already have devices, we should ensure we don't store duplicates.
-        if _is_known_device(devices, device.get('KNAME')):
-            continue
+    :raises EnvironmentError: if the device does not support the request.
+    """
+    size = _get_block_device_size(path)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        fcntl.ioctl(fd, request, (ctypes.c_uint64 * 2)(0, size))
+    finally:
+        os.close(fd)
 
-        # Search for raid in the reply type, as RAID is a
-        # disk device, and we should honor it if is present.
-        # Other possible type values, which we skip recording:
-        #   lvm, part, rom, loop
-        if devtype != block_type:
-            if devtype is not None and 'raid' in devtype and not ignore_raid:
-                LOG.debug(
-                    "TYPE detected to contain 'raid', signifying a RAID "
-                    "volume. Found: {!r}".format(line))
-            else:
-                LOG.debug(
-                    "TYPE did not match. Wanted: {!r} but found: {!r}".format(
-                        block_type, line))
-                continue
 
-        # Ensure all required columns are at least present, even if blank
-        missing = set(columns) - set(device)
-        if missing:
-            raise errors.BlockDeviceError(
-                '%s must be returned by lsblk.' % ', '.join(sorted(missing)))
+def _nvme_format(path):
+    """Erase the user data of an NVMe namespace with a format command.
 
-        name = os.path.join('/dev', device['KNAME'])
+    A cryptographic erase is used when the controller supports it. The
+    namespace of the block device is formatted, given explicitly when sysfs
+    tells it, and the format is forced as nvme-cli otherwise asks for a
+    confirmation.
 
-        try:
-            udev = pyudev.Device.from_device_file(context, name)
-        # pyudev started raising another error in 0.18
-        except (ValueError, EnvironmentError, pyudev.DeviceNotFoundError) as e:
-            LOG.warning("Device %(dev)s is inaccessible, skipping... "
-                        "Error: %(error)s", {'dev': name, 'error': e})
-            extra = {}
-        else:
-            # TODO(lucasagomes): Since lsblk only supports
-            # returning the short serial we are using
-            # ID_SERIAL_SHORT here to keep compatibility with the
-            # bash deploy ramdisk
-            extra = {key: udev.get('ID_%s' % udev_key) for key, udev_key in
-                     [('wwn', 'WWN'), ('serial', 'SERIAL_SHORT'),
-                      ('wwn_with_extension', 'WWN_WITH_EXTENSION'),
-                      ('wwn_vendor_extension', 'WWN_VENDOR_EXTENSION')]}
+    :raises ProcessExecutionError, OSError: if the format fails.
+    """
+    secure_erase_setting = 1
+    try:
+        output = utils.execute('nvme', 'id-ctrl', path, '-o', 'json')[0]
+        # FNA bit 2: cryptographic erase supported
+        if json.loads(output).get('fna', 0) & 0x4:
+            secure_erase_setting = 2
+    except (processutils.ProcessExecutionError, OSError, ValueError) as e:
+        LOG.debug('Could not identify the NVMe controller of %(dev)s: '
+                  '%(error)s', {'dev': path, 'error': e})
+    namespace = _read_sysfs('/sys/block/%s/nsid' % os.path.basename(path))
+    namespace_args = ('--namespace-id=%s' % namespace,) if namespace else ()
+    utils.execute('nvme', 'format', path, '--ses=%d' % secure_erase_setting,
+                  '--force', *namespace_args)
+
+
+if six.PY2:
+    def _buffer_view(buf, offset):
+        return buffer(buf, offset)  # noqa: F821
+else:
+    def _buffer_view(buf, offset):
+        """View the data of buf from offset on, without copying it.
+
+        Slicing would copy it out of the page aligned memory O_DIRECT needs.
+        """
+        return memoryview(buf)[offset:]
 
-        # NOTE(lucasagomes): Newer versions of the lsblk tool supports
-        # HCTL as a parameter but let's get it from sysfs to avoid breaking
-        # old distros.
-        try:
-            extra['hctl'] = os.listdir(
-                '/sys/block/%s/device/scsi_device' % device['KNAME'])[0]
-        except (OSError, IndexError):
-            LOG.warning('Could not find the SCSI address (HCTL) for '
-                        'device %s. Skipping', name)
 
-        # Not all /dev entries are pointed to from /dev/disk/by-path
-        by_path_name = by_path_mapping.get(name)
+def _overwrite_region(path, start, end, random_data):
+    """Overwrite a region of a block device with O_DIRECT writes.
 
-        devices.append(BlockDevice(name=name,
-                                   model=device['MODEL'],
-                                   size=int(device['SIZE']),
-                                   rotational=bool(int(device['ROTA'])),
-                                   vendor=_get_device_info(device['KNAME'],
-                                                           'block', 'vendor'),
-                                   by_path=by_path_name,
-                                   **extra))
-    return devices
+    Random data is generated once per call, i.e. per pass over the region:
+    the same ERASE_BUFFER_SIZE random buffer is written to each chunk of the
+    region, which is enough to overwrite it, not to make the data
+    unpredictable.
+
+    :param path: The path of the block device.
+    :param start: The offset of the region, a multiple of ERASE_BUFFER_SIZE.
+    :param end: The end offset of the region.
+    :param random_data: Whether to write random data instead of zeros.
+    :raises EnvironmentError: if the device cannot be written.
+    :return: The number of bytes written.
+    """
+    # Anonymous mappings are page aligned and zero filled, as O_DIRECT needs
+    buf = mmap.mmap(-1, ERASE_BUFFER_SIZE)
+    if random_data:
+        buf.write(os.urandom(ERASE_BUFFER_SIZE))
+
+    fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+    try:
+        os.lseek(fd, start, os.SEEK_SET)
+        offset = start
+        while offset < end:
+            if end - offset < ERASE_BUFFER_SIZE:
+                buf.close()
+                buf = mmap.mmap(-1, end - offset)
+                if random_data:
+                    buf.write(os.urandom(end - offset))
+            # Partial writes are legal, e.g. near the end of the device:
+            # write the rest of the chunk before moving to the next one
+            position = 0
+            while position < len(buf):
+                try:
+                    written = os.write(fd, _buffer_view(buf, position))
+                except EnvironmentError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if not written:
+                    raise IOError('No progress writing to %s at offset %d'
+                                  % (path, offset))
+                position += written
+                offset += written
+                _erase_progress.advance(path, written)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        buf.close()
+    return offset - start
+
+
+def _overwrite_block_device(path, iterations, zeroize):
+    """Overwrite a block device from several workers.
+
+    The device is split in ERASE_WORKERS regions, each written by its own
+    worker with ERASE_BUFFER_SIZE buffers. Like shred, it makes the given
+    number of random passes followed, if zeroize is set, by a pass of zeros.
+    Each pass is verified to have written the whole device.
+
+    :param path: The path of the block device.
+    :param iterations: The number of random passes.
+    :param zeroize: Whether to finish with a pass of zeros.
+    :raises EnvironmentError: if the device cannot be written, or a pass did
+                              not write the whole device.
+    :return: The number of bytes written, over all the passes.
+    """
+    size = _get_block_device_size(path)
+    if not size:
+        return 0
+
+    region_size = -(-size // ERASE_WORKERS)
+    region_size = -(-region_size // ERASE_BUFFER_SIZE) * ERASE_BUFFER_SIZE
+    regions = [(start, min(start + region_size, size))
+               for start in range(0, size, region_size)]
+
+    passes = [True] * iterations + ([False] if zeroize else [])
+    _erase_progress.set_method(path, 'overwrite (native)',
+                               size * len(passes))
+    total = 0
+    thread_pool = ThreadPool(len(regions))
+    try:
+        for index, random_data in enumerate(passes):
+            start = time.time()
+            results = [thread_pool.apply_async(_overwrite_region,
+                                               (path, region_start,
+                                                region_end, random_data))
+                       for region_start, region_end in regions]
+            written = sum(result.get() for result in results)
+            elapsed = time.time() - start
+            if written != size:
+                raise IOError('Pass %(index)d of %(path)s wrote %(written)d '
+                              'of %(size)d bytes' %
+                              {'index': index + 1, 'path': path,
+                               'written': written, 'size': size})
+            LOG.info('Pass %(index)d/%(count)d (%(type)s) of %(path)s: '
+                     '%(written)d bytes in %(elapsed).1f seconds '
+                     '(%(rate).1f MiB/s)',
+                     {'index': index + 1, 'count': len(passes),
+                      'type': 'random' if random_data else 'zeros',
+                      'path': path, 'written': written, 'elapsed': elapsed,
+                      'rate': written / max(elapsed, 0.001) / 1048576})
+            total += written
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+    return total
 
 
 class HardwareSupport(object):
@@ -390,6 +2814,303 @@ class BlockDevice(encoding.SerializableComparable):
         self.by_path = by_path
 
 
+def _get_index_key(value):
+    # Root device hints are compared stripped and in lowercase
+    return six.text_type(value).strip().lower()
+
+
+class BlockDeviceRegistry(object):
+    """A collection of BlockDevices indexed for constant time lookups.
+
+    Devices are indexed by kernel name, by-path link, WWN, serial and HCTL
+    and are iterated in the order they were added. Lookups ignore the case
+    and surrounding white space of the values, as root device hints do.
+    Adding a device whose name is already known is a no-op, so the registry
+    also deduplicates.
+    """
+
+    indexes = ('name', 'by_path', 'wwn', 'serial', 'hctl')
+
+    def __init__(self, devices=()):
+        self._devices = []
+        self._index = dict((attr, {}) for attr in self.indexes)
+        self.update(devices)
+
+    def add(self, device):
+        """Add a BlockDevice.
+
+        :param device: The BlockDevice to add.
+        :return: True if the device was added, False if a device with the
+                 same name is already known.
+        """
+        if device.name in self:
+            return False
+        self._devices.append(device)
+        for attr in self.indexes:
+            value = getattr(device, attr)
+            if value:
+                self._index[attr].setdefault(_get_index_key(value),
+                                             []).append(device)
+        return True
+
+    def update(self, devices):
+        """Add several BlockDevices, skipping the known ones."""
+        for device in devices:
+            self.add(device)
+
+    def remove(self, name):
+        """Remove a BlockDevice by name.
+
+        :param name: The device name, e.g. '/dev/sda' or 'sda'.
+        :return: The removed BlockDevice, or None if it is not known.
+        """
+        device = self.get(name)
+        if device is None:
+            return None
+        self._devices.remove(device)
+        for attr in self.indexes:
+            value = getattr(device, attr)
+            if not value:
+                continue
+            key = _get_index_key(value)
+            devices = self._index[attr].get(key)
+            if devices and device in devices:
+                devices.remove(device)
+                if not devices:
+                    del self._index[attr][key]
+        return device
+
+    def get(self, name):
+        """Get a BlockDevice by name, e.g. '/dev/sda' or 'sda'."""
+        devices = self._index['name'].get(
+            _get_index_key(os.path.join('/dev', name)))
+        return devices[0] if devices else None
+
+    def find(self, attr, value):
+        """Get the BlockDevices whose indexed attribute equals value.
+
+        :param attr: One of the indexed attributes, see `indexes`.
+        :param value: The value to look up.
+        :return: A list of BlockDevices, in the order they were added.
+        """
+        return list(self._index[attr].get(_get_index_key(value), ()))
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __iter__(self):
+        return iter(list(self._devices))
+
+    def __len__(self):
+        return len(self._devices)
+
+
+def _match_root_device_hints(registry, root_device_hints):
+    """Find the BlockDevice matching root device hints.
+
+    When a hint on an indexed attribute is a plain value (without operator),
+    only the devices having that value can match all the hints, so only
+    those are looked up in the registry and matched. Otherwise every device
+    is matched. The devices are matched in the order of the registry, so the
+    device picked is the one ironic-lib picks from the list of all the
+    devices.
+
+    :param registry: A BlockDeviceRegistry.
+    :param root_device_hints: A dictionary with the root device hints.
+    :raises: ValueError, if some information is invalid.
+    :return: The serialized device matching all the hints, or None.
+    """
+    devices = registry
+    for attr in BlockDeviceRegistry.indexes:
+        value = root_device_hints.get(attr)
+        if (isinstance(value, six.string_types) and value.strip()
+                and len(il_utils.ROOT_DEVICE_HINTS_GRAMMAR.parseString(
+                    value.lower())) <= 1):
+            devices = registry.find(attr, value)
+            break
+
+    return il_utils.match_root_device_hints(
+        [dev.serialize() for dev in devices], root_device_hints)
+
+
+class _LiveDeviceInventory(object):
+    """Block device and NIC view kept up to date from udev events.
+
+    The view is built once by walking sysfs and the udev database, then a
+    background thread applies the add, remove and change events received
+    from a pyudev Monitor, so listing devices needs neither a udev settle
+    nor a rescan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # Incremented each time a udev event has been applied
+        self.generation = 0
+        # Maps block device names to their lsblk-style TYPE
+        self._types = {}
+        # Maps block device names to whether lsblk hides them by default
+        self._hidden = {}
+        # Maps block device names to their position in a walk of /sys/block
+        self._order = {}
+        self._block_devices = BlockDeviceRegistry()
+        self._interfaces = []
+        self.running = False
+
+    def start(self):
+        """Build the initial view and start following udev events."""
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by('block')
+        monitor.filter_by('net')
+        # Listen before the initial scan so that no event is lost
+        monitor.start()
+
+        _udev_settle()
+        by_path_mapping = _get_by_path_mapping()
+        with self._lock:
+            for sysfs_name, sysfs_dir, parent_dir in (
+                    _iter_sysfs_block_devices()):
+                self._add_block_device(sysfs_name, sysfs_dir, parent_dir,
+                                       by_path_mapping)
+            self._interfaces = sorted(
+                name for name in os.listdir('/sys/class/net')
+                if os.path.exists('/sys/class/net/%s/device' % name))
+
+        self.running = True
+        thread = threading.Thread(target=self._follow, args=(monitor,),
+                                  name='live-device-inventory')
+        thread.daemon = True
+        thread.start()
+
+    def _add_block_device(self, sysfs_name, sysfs_dir, parent_dir,
+                          by_path_mapping):
+        device = _get_sysfs_block_device(sysfs_name, sysfs_dir, parent_dir,
+                                         by_path_mapping)
+        self._block_devices.remove(device.name)
+        self._block_devices.add(device)
+        self._types[device.name] = _get_sysfs_block_device_type(sysfs_dir,
+                                                                sysfs_name)
+        self._hidden[device.name] = _is_hidden_block_device(sysfs_dir)
+        # The order of _iter_sysfs_block_devices: disks by name, each
+        # followed by its partitions
+        if parent_dir is None:
+            self._order[device.name] = (sysfs_name, '')
+        else:
+            self._order[device.name] = (os.path.basename(parent_dir),
+                                        sysfs_name)
+
+    def _follow(self, monitor):
+        try:
+            for udev in iter(monitor.poll, None):
+                try:
+                    self._handle_event(udev)
+                except Exception:
+                    LOG.exception('Could not apply the %(action)s event for '
+                                  '%(dev)s to the live device inventory',
+                                  {'action': udev.action,
+                                   'dev': udev.sys_path})
+        except Exception:
+            LOG.exception('The live device inventory stopped following '
+                          'udev events, falling back to rescanning devices')
+            with self._changed:
+                self.running = False
+                # Wake up the waiters, no change will come anymore
+                self._changed.notify_all()
+
+    def _handle_event(self, udev):
+        LOG.debug('Live device inventory received %(action)s event for '
+                  '%(dev)s', {'action': udev.action, 'dev': udev.sys_path})
+        with self._lock:
+            if udev.subsystem == 'net':
+                self._interfaces = [name for name in self._interfaces
+                                    if name != udev.sys_name]
+                if udev.action != 'remove' and os.path.exists(
+                        os.path.join(udev.sys_path, 'device')):
+                    self._interfaces = sorted(self._interfaces +
+                                              [udev.sys_name])
+            elif udev.action == 'remove':
+                device = self._block_devices.remove(
+                    udev.sys_name.replace('!', '/'))
+                if device is not None:
+                    self._types.pop(device.name, None)
+                    self._hidden.pop(device.name, None)
+                    self._order.pop(device.name, None)
+            else:
+                parent_dir = None
+                if udev.device_type == 'partition':
+                    parent_dir = os.path.dirname(udev.sys_path)
+                self._add_block_device(udev.sys_name, udev.sys_path,
+                                       parent_dir, _get_by_path_mapping())
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, generation, timeout):
+        """Wait until a udev event has been applied after generation.
+
+        :param generation: The value of `generation` the caller has seen.
+        :param timeout: Maximum number of seconds to wait.
+        :return: True if the view changed, False on timeout.
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while self.generation == generation and self.running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return self.generation != generation
+
+    def list_block_devices(self, block_type='disk', ignore_raid=False,
+                           all_devices=False):
+        """List block devices, see list_all_block_devices.
+
+        The devices are listed in the order a rescan would list them, which
+        udev events do not preserve.
+        """
+        with self._lock:
+            devices = sorted(self._block_devices,
+                             key=lambda device: self._order[device.name])
+            return [device for device in devices
+                    if (all_devices or not self._hidden[device.name])
+                    and _is_wanted_block_type(
+                        self._types[device.name], block_type, ignore_raid,
+                        '{} {}'.format(device.name,
+                                       self._types[device.name]))]
+
+    def list_interface_names(self):
+        """List the names of the physical network interfaces."""
+        with self._lock:
+            return list(self._interfaces)
+
+
+_live_inventory = None
+_live_inventory_lock = threading.Lock()
+
+
+def get_live_device_inventory():
+    """Get the live device inventory, starting it on first use.
+
+    :return: The running live device inventory, or None if it is disabled
+             (see the live_device_inventory option) or can not run on
+             this system.
+    """
+    global _live_inventory
+    if not CONF.live_device_inventory:
+        return None
+    with _live_inventory_lock:
+        if _live_inventory is None:
+            _live_inventory = _LiveDeviceInventory()
+            if _can_enumerate_from_sysfs():
+                try:
+                    _live_inventory.start()
+                except Exception as e:
+                    LOG.warning('Could not start the live device inventory, '
+                                'devices will be rescanned on each call. '
+                                'Error: %s', e)
+    return _live_inventory if _live_inventory.running else None
+
+
 class NetworkInterface(encoding.SerializableComparable):
     serializable_fields = ('name', 'mac_address', 'ipv4_address',
                            'ipv6_address', 'has_carrier', 'lldp',
@@ -416,15 +3137,25 @@ class NetworkInterface(encoding.SerializableComparable):
 
 class CPU(encoding.SerializableComparable):
     serializable_fields = ('model_name', 'frequency', 'count', 'architecture',
-                           'flags')
+                           'flags', 'sockets', 'cores', 'threads_per_core',
+                           'caches', 'numa_nodes')
 
     def __init__(self, model_name, frequency, count, architecture,
-                 flags=None):
+                 flags=None, sockets=None, cores=None, threads_per_core=None,
+                 caches=None, numa_nodes=None):
         self.model_name = model_name
         self.frequency = frequency
         self.count = count
         self.architecture = architecture
         self.flags = flags or []
+        self.sockets = sockets
+        # physical cores, without hyperthreading
+        self.cores = cores
+        self.threads_per_core = threads_per_core
+        # cache sizes in bytes, e.g. {'L1d': 32768, 'L3': 31457280}
+        self.caches = caches or {}
+        # CPUs of each NUMA node, e.g. [{'id': 0, 'cpus': [0, 1, 2, 3]}]
+        self.numa_nodes = numa_nodes or []
 
 
 class Memory(encoding.SerializableComparable):
@@ -453,6 +3184,25 @@ class BootInfo(encoding.SerializableComparable):
         self.pxe_interface = pxe_interface
 
 
+# Factories of the value reported for each inventory key whose collector
+# timed out (see _collect_inventory_concurrently), of the same type as the
+# collected value and matching what the collectors report when the data is
+# not available
+_EMPTY_INVENTORY = {
+    'interfaces': list,
+    'cpu': lambda: CPU(model_name=None, frequency=None, count=0,
+                       architecture=None),
+    'disks': list,
+    'memory': lambda: Memory(total=0),
+    'bmc_address': lambda: '0.0.0.0',
+    'bmc_v6address': lambda: '::/0',
+    'system_vendor': lambda: SystemVendorInfo(product_name='',
+                                              serial_number='',
+                                              manufacturer=''),
+    'boot': lambda: BootInfo(current_boot_mode=None),
+}
+
+
 @six.add_metaclass(abc.ABCMeta)
 class HardwareManager(object):
     @abc.abstractmethod
@@ -527,6 +3277,11 @@ class HardwareManager(object):
         erase additional hardware, although backwards-compatible upstream
         submissions are encouraged.
 
+        The progress of each device is available through
+        get_erase_progress() and ERASE_PROGRESS_FILE while it runs, and
+        until the next run; the throughput of each device is logged once
+        they are all erased.
+
         :param node: Ironic node object
         :param ports: list of Ironic port objects
         :return: a dictionary in the form {device.name: erasure output}
@@ -536,16 +3291,27 @@ class HardwareManager(object):
         if not len(block_devices):
             return {}
 
-        info = node.get('driver_internal_info', {})
-        max_pool_size = info.get('disk_erasure_concurrency', 1)
+        _erase_progress.reset()
 
-        thread_pool = ThreadPool(min(max_pool_size, len(block_devices)))
-        for block_device in block_devices:
-            params = {'node': node, 'block_device': block_device}
-            erase_results[block_device.name] = thread_pool.apply_async(
-                dispatch_to_managers, ('erase_block_device',), params)
-        thread_pool.close()
-        thread_pool.join()
+        info = node.get('driver_internal_info', {})
+        if (info.get('agent_enable_ata_secure_erase', True)
+                or info.get('disk_erasure_scheduler') == 'adaptive'):
+            _probe_ata_devices(block_devices)
+        with _block_device_classification():
+            if info.get('disk_erasure_scheduler') == 'adaptive':
+                erase_results = _schedule_erase(node, block_devices)
+            else:
+                max_pool_size = info.get('disk_erasure_concurrency', 1)
+
+                thread_pool = ThreadPool(min(max_pool_size,
+                                             len(block_devices)))
+                for block_device in block_devices:
+                    erase_results[block_device.name] = (
+                        thread_pool.apply_async(_erase_block_device_tracked,
+                                                (node, block_device)))
+                thread_pool.close()
+                thread_pool.join()
+        _erase_progress.log_summary()
 
         for device_name, result in erase_results.items():
             erase_results[device_name] = result.get()
@@ -563,6 +3329,39 @@ class HardwareManager(object):
         if not CONF.disk_wait_attempts:
             return
 
+        start = time.time()
+        found = None
+        if CONF.event_driven_disk_wait:
+            # The overall deadline is the one of the polling wait, also when
+            # falling back to polling part way
+            deadline = start + (
+                CONF.disk_wait_delay * (CONF.disk_wait_attempts - 1))
+            try:
+                found = self._wait_for_disks_on_events(deadline)
+            except Exception as e:
+                LOG.warning('Could not wait for the root device using udev '
+                            'events, polling for it instead. Error: %s', e)
+            if found is None:
+                found = self._wait_for_disks_polling(deadline)
+        else:
+            found = self._wait_for_disks_polling()
+
+        elapsed = time.time() - start
+        if found:
+            LOG.info('The root device was detected after %.1f seconds',
+                     elapsed)
+        else:
+            LOG.warning('The root device was not detected in %.1f seconds',
+                        elapsed)
+        return elapsed
+
+    def _wait_for_disks_polling(self, deadline=None):
+        """Look for the root device every CONF.disk_wait_delay seconds.
+
+        :param deadline: The time after which to stop looking, at least once,
+                         instead of after CONF.disk_wait_attempts attempts.
+        :return: True if the root device was detected, False otherwise.
+        """
         max_waits = CONF.disk_wait_attempts - 1
         for attempt in range(CONF.disk_wait_attempts):
             try:
@@ -572,16 +3371,69 @@ class HardwareManager(object):
                           'attempt %d of %d', attempt + 1,
                           CONF.disk_wait_attempts)
 
-                if attempt < max_waits:
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(CONF.disk_wait_delay, remaining))
+                elif attempt < max_waits:
                     time.sleep(CONF.disk_wait_delay)
             else:
-                break
-        else:
-            if max_waits:
-                LOG.warning('The root device was not detected in %d seconds',
-                            CONF.disk_wait_delay * max_waits)
-            else:
-                LOG.warning('The root device was not detected')
+                return True
+        return False
+
+    def _wait_for_disks_on_events(self, deadline):
+        """Look for the root device each time a suitable disk appears.
+
+        The root device is looked for once, then again only when udev
+        reports a disk that satisfies the root device hints (or any disk,
+        without hints).
+
+        :param deadline: The time after which to stop waiting.
+        :return: True if the root device was detected, False otherwise, or
+                 None if the live inventory stopped following udev events
+                 and the wait should go on by polling.
+        """
+        live_inventory = get_live_device_inventory()
+        if live_inventory is not None:
+            # The live inventory applies the events itself; wait for it so
+            # that the device is already in its view when looked up.
+            while True:
+                generation = live_inventory.generation
+                try:
+                    self.get_os_install_device()
+                    return True
+                except errors.DeviceNotFound:
+                    pass
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                if not live_inventory.wait_for_change(generation, remaining):
+                    if not live_inventory.running:
+                        LOG.warning('The live device inventory stopped, '
+                                    'polling for the root device instead')
+                        return None
+                    return False
+
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by('block')
+        monitor.start()
+        while True:
+            try:
+                self.get_os_install_device()
+                return True
+            except errors.DeviceNotFound:
+                LOG.debug('Still waiting for the root device to appear')
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                udev = monitor.poll(timeout=remaining)
+                if udev is None:
+                    return False
+                if _may_be_root_device(udev):
+                    break
 
     def list_hardware_info(self):
         """Return full hardware inventory as a serializable dict.
@@ -592,18 +3444,87 @@ class HardwareManager(object):
         :return: a dictionary representing inventory
         """
         # NOTE(dtantsur): don't forget to update docs when extending inventory
-        hardware_info = {}
-        hardware_info['interfaces'] = self.list_network_interfaces()
-        hardware_info['cpu'] = self.get_cpus()
-        hardware_info['disks'] = self.list_block_devices()
-        hardware_info['memory'] = self.get_memory()
-        hardware_info['bmc_address'] = self.get_bmc_address()
-        hardware_info['bmc_v6address'] = self.get_bmc_v6address()
-        hardware_info['system_vendor'] = self.get_system_vendor_info()
-        hardware_info['boot'] = self.get_boot_info()
+        if CONF.concurrent_inventory:
+            hardware_info = self._collect_inventory_concurrently()
+        else:
+            hardware_info = {}
+            for key, method in INVENTORY_COLLECTORS:
+                hardware_info[key] = getattr(self, method)()
         hardware_info['hostname'] = netutils.get_hostname()
         return hardware_info
 
+    def _collect_inventory_concurrently(self):
+        """Run all inventory collectors in parallel.
+
+        Each collector gets its own deadline, counted from the start of the
+        inventory, at which the commands it runs are killed. A collector
+        missing its deadline, or still running from a previous inventory, is
+        not waited for: its key is collected again serially if it is one of
+        INVENTORY_REQUIRED_KEYS, and otherwise (or if that fails as well) set
+        to the value of _EMPTY_INVENTORY. Any other exception raised by a
+        collector is re-raised, as it would be in serial mode.
+
+        :return: a dictionary representing inventory
+        """
+        start = time.time()
+        collectors = []
+        with _collector_threads_lock:
+            for key, method in INVENTORY_COLLECTORS:
+                timeout = INVENTORY_COLLECTOR_TIMEOUTS.get(
+                    key, INVENTORY_COLLECTOR_TIMEOUT)
+                collector = _collector_threads.get(key)
+                if collector is not None and collector.is_alive():
+                    LOG.warning('Inventory collector %s of a previous '
+                                'inventory is still running, not starting '
+                                'it again', key)
+                    collector = None
+                else:
+                    collector = _CollectorThread(key, getattr(self, method),
+                                                 start + timeout)
+                    _collector_threads[key] = collector
+                    collector.start()
+                collectors.append((key, method, timeout, collector))
+
+        hardware_info = {}
+        for key, method, timeout, collector in collectors:
+            if collector is not None:
+                collector.join(max(0, collector.deadline - time.time()))
+                if collector.is_alive():
+                    LOG.warning('Inventory collector %(key)s did not finish '
+                                'within %(timeout)s seconds',
+                                {'key': key, 'timeout': timeout})
+                elif collector.exc_info is None:
+                    hardware_info[key] = collector.result
+                    continue
+                elif issubclass(collector.exc_info[0], _CollectorTimeout):
+                    LOG.warning('Inventory collector %(key)s timed out: '
+                                '%(err)s', {'key': key,
+                                            'err': collector.exc_info[1]})
+                else:
+                    six.reraise(*collector.exc_info)
+            hardware_info[key] = self._collect_timed_out_inventory(
+                key, method, timeout)
+
+        LOG.debug('Collected inventory in %.2f seconds', time.time() - start)
+        return hardware_info
+
+    def _collect_timed_out_inventory(self, key, method, timeout):
+        """Get a value for an inventory key whose collector timed out.
+
+        :return: The value collected again serially within timeout seconds
+                 for the keys in INVENTORY_REQUIRED_KEYS, otherwise the value
+                 of _EMPTY_INVENTORY.
+        """
+        if key in INVENTORY_REQUIRED_KEYS:
+            try:
+                with _collector_deadline(time.time() + timeout):
+                    return getattr(self, method)()
+            except _CollectorTimeout as e:
+                LOG.error('Inventory collector %(key)s timed out again, '
+                          'reporting it as empty: %(err)s',
+                          {'key': key, 'err': e})
+        return _EMPTY_INVENTORY[key]()
+
     def get_clean_steps(self, node, ports):
         """Get a list of clean steps with priority.
 
@@ -683,10 +3604,55 @@ class HardwareManager(object):
         }
 
 
+# The inventory, erase and RAID methods with a <method>_async version on
+# HardwareManager; these run the synchronous method in the event loop's
+# default executor and may be overridden with native implementations
+ASYNC_METHODS = (
+    'list_hardware_info', 'list_network_interfaces', 'get_cpus',
+    'list_block_devices', 'get_memory', 'get_os_install_device',
+    'get_bmc_address', 'get_bmc_v6address', 'get_system_vendor_info',
+    'get_boot_info', 'get_interface_info', 'erase_block_device',
+    'erase_devices', 'erase_devices_metadata', 'validate_configuration',
+    'create_configuration', 'delete_configuration')
+
+
+def _run_in_executor(func, *args, **kwargs):
+    """Run a blocking call in the default executor of the event loop.
+
+    :raises RuntimeError: if asyncio is not available.
+    :returns: An asyncio future of the result.
+    """
+    if asyncio is None:
+        raise RuntimeError('The asynchronous hardware manager API requires '
+                           'asyncio')
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None,
+                                functools.partial(func, *args, **kwargs))
+
+
+def _make_async_method(method):
+    def async_method(self, *args, **kwargs):
+        return _run_in_executor(getattr(self, method), *args, **kwargs)
+
+    async_method.__name__ = '%s_async' % method
+    async_method.__doc__ = (
+        'Awaitable version of %s, run in the default executor.\n\n'
+        'Hardware managers can override it with a coroutine function.'
+        % method)
+    return async_method
+
+
+for _method in ASYNC_METHODS:
+    setattr(HardwareManager, '%s_async' % _method,
+            _make_async_method(_method))
+del _method
+
+
 class GenericHardwareManager(HardwareManager):
     HARDWARE_MANAGER_NAME = 'generic_hardware_manager'
     # 1.1 - Added new clean step called erase_devices_metadata
-    HARDWARE_MANAGER_VERSION = '1.1'
+    # 1.2 - Added new clean step called wait_for_raid_resync
+    HARDWARE_MANAGER_VERSION = '1.2'
 
     def __init__(self):
         self.sys_path = '/sys'
@@ -776,8 +3742,7 @@ class GenericHardwareManager(HardwareManager):
         """
         global WARN_BIOSDEVNAME_NOT_FOUND
         try:
-            stdout, _ = utils.execute('biosdevname', '-i',
-                                      interface_name)
+            stdout, _ = _execute('biosdevname', '-i', interface_name)
             return stdout.rstrip('\n')
         except OSError:
             if not WARN_BIOSDEVNAME_NOT_FOUND:
@@ -799,8 +3764,15 @@ class GenericHardwareManager(HardwareManager):
 
     def list_network_interfaces(self):
         network_interfaces_list = []
-        iface_names = os.listdir('{}/class/net'.format(self.sys_path))
-        iface_names = [name for name in iface_names if self._is_device(name)]
+        live_inventory = None
+        if self.sys_path == '/sys':
+            live_inventory = get_live_device_inventory()
+        if live_inventory is not None:
+            iface_names = live_inventory.list_interface_names()
+        else:
+            iface_names = os.listdir('{}/class/net'.format(self.sys_path))
+            iface_names = [name for name in iface_names
+                           if self._is_device(name)]
 
         if CONF.collect_lldp:
             self.lldp_data = dispatch_to_managers('collect_lldp_data',
@@ -815,33 +3787,61 @@ class GenericHardwareManager(HardwareManager):
         return network_interfaces_list
 
     def get_cpus(self):
-        lines = utils.execute('lscpu')[0]
-        cpu_info = {k.strip().lower(): v.strip() for k, v in
-                    (line.split(':', 1)
-                     for line in lines.split('\n')
-                     if line.strip())}
-        # Current CPU frequency can be different from maximum one on modern
-        # processors
-        freq = cpu_info.get('cpu max mhz', cpu_info.get('cpu mhz'))
+        processors = []
+        if CONF.native_cpu_info:
+            try:
+                processors = _parse_cpuinfo(get_hardware_snapshot('cpuinfo'))
+            except EnvironmentError as e:
+                LOG.warning('Could not read /proc/cpuinfo: %s', e)
+        cpu_info = processors[0] if processors else {}
+
+        if cpu_info.get('model name'):
+            count = len(processors)
+            architecture = os.uname()[4]
+            # Current CPU frequency can be different from maximum one on
+            # modern processors
+            max_khz = _read_sysfs(
+                '/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq')
+            if max_khz:
+                freq = '%.4f' % (int(max_khz) / 1000.0)
+            else:
+                freq = cpu_info.get('cpu mhz')
+        else:
+            # NOTE: /proc/cpuinfo lacks the model name on some
+            # architectures, which lscpu knows how to find.
+            if not processors:
+                # Only the flags are taken from /proc/cpuinfo
+                out = utils.try_execute('grep', '-Em1', '^flags',
+                                        '/proc/cpuinfo')
+                if out:
+                    cpu_info['flags'] = out[0].partition(':')[2].strip()
+            lines = get_hardware_snapshot('lscpu')
+            lscpu_info = {k.strip().lower(): v.strip() for k, v in
+                          (line.split(':', 1)
+                           for line in lines.split('\n')
+                           if line.strip())}
+            cpu_info = dict(cpu_info, **{'model name':
+                                         lscpu_info.get('model name')})
+            freq = lscpu_info.get('cpu max mhz', lscpu_info.get('cpu mhz'))
+            count = int(lscpu_info.get('cpu(s)'))
+            architecture = lscpu_info.get('architecture')
 
         flags = []
-        out = utils.try_execute('grep', '-Em1', '^flags', '/proc/cpuinfo')
-        if out:
-            try:
-                # Example output (much longer for a real system):
-                # flags           : fpu vme de pse
-                flags = out[0].strip().split(':', 1)[1].strip().split()
-            except (IndexError, ValueError):
-                LOG.warning('Malformed CPU flags information: %s', out)
+        if cpu_info.get('flags') is not None:
+            # Example line (much longer for a real system):
+            # flags           : fpu vme de pse
+            flags = cpu_info['flags'].split()
         else:
             LOG.warning('Failed to get CPU flags')
 
+        topology = _get_cpu_topology(count)
         return CPU(model_name=cpu_info.get('model name'),
                    frequency=freq,
                    # this includes hyperthreading cores
-                   count=int(cpu_info.get('cpu(s)')),
-                   architecture=cpu_info.get('architecture'),
-                   flags=flags)
+                   count=count,
+                   architecture=architecture,
+                   flags=flags,
+                   **topology)
 
     def get_memory(self):
         # psutil returns a long, so we force it to an int
@@ -854,6 +3854,30 @@ class GenericHardwareManager(HardwareManager):
             total = None
             LOG.exception(("Cannot fetch total memory size using psutil "
                            "version %s"), psutil.version_info[0])
+        return Memory(total=total, physical_mb=self._get_physical_memory())
+
+    def _get_physical_memory(self):
+        """Get the size of the installed RAM in MB.
+
+        The size is read from the DMI table when the native_dmi option is
+        set, or from lshw if not or if the table can not be read or
+        describes no DIMM.
+
+        :return: The physical memory in MB, or None if unknown.
+        """
+        if CONF.native_dmi:
+            try:
+                dimms = _get_dmi_memory_devices()
+            except (EnvironmentError, ValueError) as e:
+                LOG.debug('Could not get physical RAM from the DMI table, '
+                          'falling back to lshw: %s', e)
+            else:
+                for dimm in dimms:
+                    LOG.debug('Found DIMM %(locator)s (%(bank_locator)s) of '
+                              '%(size_mb)s MB at %(speed)s MT/s', dimm)
+                if dimms:
+                    return sum(dimm['size_mb'] for dimm in dimms)
+
         sys_dict = None
         try:
             sys_dict = _get_system_lshw_dict()
@@ -876,16 +3900,16 @@ class GenericHardwareManager(HardwareManager):
             if not physical:
                 LOG.warning('Did not find any physical RAM')
 
-        return Memory(total=total, physical_mb=physical)
+        return physical
 
     def list_block_devices(self, include_partitions=False):
-        block_devices = list_all_block_devices()
+        block_devices = BlockDeviceRegistry(list_all_block_devices())
         if include_partitions:
-            block_devices.extend(
+            block_devices.update(
                 list_all_block_devices(block_type='part',
                                        ignore_raid=True)
             )
-        return block_devices
+        return list(block_devices)
 
     def get_os_install_device(self):
         cached_node = get_cached_node()
@@ -895,14 +3919,13 @@ class GenericHardwareManager(HardwareManager):
             LOG.debug('Looking for a device matching root hints %s',
                       root_device_hints)
 
-        block_devices = self.list_block_devices()
+        block_devices = BlockDeviceRegistry(self.list_block_devices())
         if not root_device_hints:
-            dev_name = utils.guess_root_disk(block_devices).name
+            dev_name = utils.guess_root_disk(list(block_devices)).name
         else:
-            serialized_devs = [dev.serialize() for dev in block_devices]
             try:
-                device = il_utils.match_root_device_hints(serialized_devs,
-                                                          root_device_hints)
+                device = _match_root_device_hints(block_devices,
+                                                  root_device_hints)
             except ValueError as e:
                 # NOTE(lucasagomes): Just playing on the safe side
                 # here, this exception should never be raised because
@@ -927,6 +3950,18 @@ class GenericHardwareManager(HardwareManager):
         return dev_name
 
     def get_system_vendor_info(self):
+        if CONF.native_dmi:
+            try:
+                system_info = _get_dmi_system_info()
+            except (EnvironmentError, ValueError) as e:
+                LOG.debug('Could not get vendor info from the DMI table, '
+                          'falling back to lshw: %s', e)
+            else:
+                return SystemVendorInfo(
+                    product_name=system_info['product_name'] or '',
+                    serial_number=system_info['serial_number'] or '',
+                    manufacturer=system_info['manufacturer'] or '')
+
         try:
             sys_dict = _get_system_lshw_dict()
         except (processutils.ProcessExecutionError, OSError, ValueError) as e:
@@ -976,6 +4011,20 @@ class GenericHardwareManager(HardwareManager):
                 LOG.error(msg)
                 raise errors.IncompatibleHardwareMethodError(msg)
 
+        # Overwriting does not reliably erase flash, which the device can
+        # erase itself in seconds; this replaces the configured overwrite
+        # passes, so it is only done when asked for
+        if (info.get('agent_enable_erase_offload', False)
+                and not block_device.rotational
+                and self._offload_erase(node, block_device)):
+            return
+
+        if info.get('agent_erase_devices_engine') == 'native':
+            if self._overwrite_block_device(node, block_device):
+                return
+            LOG.warning('Falling back to shred to erase %s',
+                        block_device.name)
+
         if self._shred_block_device(node, block_device):
             return
 
@@ -984,19 +4033,60 @@ class GenericHardwareManager(HardwareManager):
         LOG.error(msg)
         raise errors.IncompatibleHardwareMethodError(msg)
 
-    def erase_devices_metadata(self, node, ports):
-        """Attempt to erase the disk devices metadata.
+    def erase_devices_metadata(self, node, ports):
+        """Attempt to erase the disk devices metadata.
+
+        :param node: Ironic node object
+        :param ports: list of Ironic port objects
+        :raises BlockDeviceEraseError: when there's an error erasing the
+                block device
+        """
+        block_devices = self.list_block_devices(include_partitions=True)
+
+        # Each disk and its partitions form a chain, erased one device at a
+        # time while the chains of the different disks run concurrently.
+        # Devices whose disk is unknown share a single chain.
+        chains = {}
+        for dev in block_devices:
+            chains.setdefault(_get_parent_disk(dev.name), []).append(dev)
+        if not chains:
+            return
+
+        info = node.get('driver_internal_info', {})
+        pool_size = min(info.get('metadata_erasure_concurrency',
+                                 METADATA_ERASURE_CONCURRENCY), len(chains))
+
+        erase_errors = {}
+        with _block_device_classification():
+            thread_pool = ThreadPool(max(1, pool_size))
+            try:
+                results = [thread_pool.apply_async(
+                    self._erase_devices_metadata_chain, (node, chain))
+                    for chain in chains.values()]
+                for result in results:
+                    erase_errors.update(result.get())
+            finally:
+                thread_pool.close()
+                thread_pool.join()
+
+        if erase_errors:
+            excpt_msg = ('Failed to erase the metadata on the device(s): %s' %
+                         '; '.join(['"%s": %s' % (k, v)
+                                    for k, v in erase_errors.items()]))
+            raise errors.BlockDeviceEraseError(excpt_msg)
+
+    def _erase_devices_metadata_chain(self, node, block_devices):
+        """Erase the metadata of a disk and its partitions in order.
 
         :param node: Ironic node object
-        :param ports: list of Ironic port objects
-        :raises BlockDeviceEraseError: when there's an error erasing the
-                block device
+        :param block_devices: a list of BlockDevice objects of the chain.
+        :return: a dictionary in the form {device.name: error}.
         """
-        block_devices = self.list_block_devices(include_partitions=True)
         # NOTE(coreywright): Reverse sort by device name so a partition (eg
         # sda1) is processed before it disappears when its associated disk (eg
         # sda) has its partition table erased and the kernel notified.
-        block_devices.sort(key=lambda dev: dev.name, reverse=True)
+        block_devices = sorted(block_devices, key=lambda dev: dev.name,
+                               reverse=True)
         erase_errors = {}
         for dev in block_devices:
             if self._is_virtual_media_device(dev):
@@ -1014,12 +4104,7 @@ class GenericHardwareManager(HardwareManager):
                 LOG.error('Failed to erase the metadata on device "%(dev)s". '
                           'Error: %(error)s', {'dev': dev.name, 'error': e})
                 erase_errors[dev.name] = e
-
-        if erase_errors:
-            excpt_msg = ('Failed to erase the metadata on the device(s): %s' %
-                         '; '.join(['"%s": %s' % (k, v)
-                                    for k, v in erase_errors.items()]))
-            raise errors.BlockDeviceEraseError(excpt_msg)
+        return erase_errors
 
     def _shred_block_device(self, node, block_device):
         """Erase a block device using shred.
@@ -1037,6 +4122,8 @@ class GenericHardwareManager(HardwareManager):
 
         args += ('--verbose', '--iterations', str(npasses), block_device.name)
 
+        _erase_progress.set_method(block_device.name, 'overwrite (shred)')
+
         try:
             utils.execute(*args)
         except (processutils.ProcessExecutionError, OSError) as e:
@@ -1046,20 +4133,93 @@ class GenericHardwareManager(HardwareManager):
 
         return True
 
+    def _offload_erase(self, node, block_device):
+        """Erase a block device with a command the device carries out.
+
+        Tries, in order: an NVMe format, a secure discard and, when the
+        configured erase is a single pass of zeros, a write zeroes offload.
+        Discards and write zeroes are only tried when the queue limits in
+        sysfs show the device supports them. A plain discard is not tried:
+        since Linux 4.12 no device reports reading discarded blocks back as
+        zeros.
+
+        :param node: Ironic node info.
+        :param block_device: a BlockDevice object to be erased
+        :returns: True if the erase succeeds, False if no offload applies
+        """
+        info = node.get('driver_internal_info', {})
+        npasses = info.get('agent_erase_devices_iterations', 1)
+        zeroize = info.get('agent_erase_devices_zeroize', True)
+        capabilities = _get_erase_offload_capabilities(block_device)
+        name = block_device.name
+
+        tiers = []
+        if os.path.basename(name).startswith('nvme'):
+            tiers.append(('NVMe format', functools.partial(_nvme_format,
+                                                           name)))
+        if capabilities['discard_max_bytes']:
+            tiers.append(('secure discard', functools.partial(
+                _block_range_ioctl, name, _BLKSECDISCARD)))
+        if capabilities['write_zeroes_max_bytes'] and (
+                npasses == 0 and zeroize):
+            tiers.append(('write zeroes', functools.partial(
+                _block_range_ioctl, name, _BLKZEROOUT)))
+
+        for tier, erase in tiers:
+            _erase_progress.set_method(name, 'offload (%s)' % tier)
+            start = time.time()
+            try:
+                erase()
+            except (processutils.ProcessExecutionError,
+                    EnvironmentError) as e:
+                LOG.info('Could not erase block device %(dev)s with '
+                         '%(tier)s: %(err)s',
+                         {'dev': name, 'tier': tier, 'err': e})
+                continue
+            LOG.warning('Erased block device %(dev)s with %(tier)s in '
+                        '%(elapsed).1f seconds, instead of %(npasses)d '
+                        'random pass(es)%(zeroize)s',
+                        {'dev': name, 'tier': tier,
+                         'elapsed': time.time() - start, 'npasses': npasses,
+                         'zeroize': ' and a pass of zeros' if zeroize
+                         else ''})
+            return True
+        return False
+
+    def _overwrite_block_device(self, node, block_device):
+        """Erase a block device with the native multi-worker eraser.
+
+        :param node: Ironic node info.
+        :param block_device: a BlockDevice object to be erased
+        :returns: True if the erase succeeds, False if it fails for any reason
+        """
+        info = node.get('driver_internal_info', {})
+        npasses = info.get('agent_erase_devices_iterations', 1)
+        zeroize = info.get('agent_erase_devices_zeroize', True)
+
+        try:
+            written = _overwrite_block_device(block_device.name, npasses,
+                                              zeroize)
+        except EnvironmentError as e:
+            msg = "Erasing block device %(dev)s failed with error %(err)s"
+            LOG.error(msg, {'dev': block_device.name, 'err': e})
+            return False
+
+        LOG.info('Erased block device %(dev)s, %(written)d bytes written',
+                 {'dev': block_device.name, 'written': written})
+        return True
+
     def _is_virtual_media_device(self, block_device):
         """Check if the block device corresponds to Virtual Media device.
 
         :param block_device: a BlockDevice object
         :returns: True if it's a virtual media device, else False
         """
-        vm_device_label = '/dev/disk/by-label/ir-vfd-dev'
-        if os.path.exists(vm_device_label):
-            link = os.readlink(vm_device_label)
-            device = os.path.normpath(os.path.join(os.path.dirname(
-                                                   vm_device_label), link))
-            if block_device.name == device:
-                return True
-        return False
+        classification = _classification
+        if classification and block_device.name in classification:
+            return classification[block_device.name]['virtual_media']
+
+        return block_device.name == _get_virtual_media_device()
 
     def _is_linux_raid_member(self, block_device):
         """Check if a block device is a Linux RAID member.
@@ -1068,6 +4228,10 @@ class GenericHardwareManager(HardwareManager):
         :returns: True if it's Linux RAID member (or if we do not
                   manage to verify), False otherwise.
         """
+        classification = _classification
+        if classification and block_device.name in classification:
+            return classification[block_device.name]['linux_raid_member']
+
         try:
             # Don't use the '--nodeps' of lsblk to also catch the
             # parent device of partitions which are RAID members.
@@ -1082,22 +4246,7 @@ class GenericHardwareManager(HardwareManager):
 
     def _get_ata_security_lines(self, block_device):
         output = utils.execute('hdparm', '-I', block_device.name)[0]
-
-        if '\nSecurity: ' not in output:
-            return []
-
-        # Get all lines after the 'Security: ' line
-        security_and_beyond = output.split('\nSecurity: \n')[1]
-        security_and_beyond_lines = security_and_beyond.split('\n')
-
-        security_lines = []
-        for line in security_and_beyond_lines:
-            if line.startswith('\t'):
-                security_lines.append(line.strip().replace('\t', ' '))
-            else:
-                break
-
-        return security_lines
+        return _parse_ata_security_lines(output)
 
     def _smartctl_security_check(self, block_device):
         """Checks if we can query security via smartctl.
@@ -1108,32 +4257,7 @@ class GenericHardwareManager(HardwareManager):
                       or the smartctl binary is not present.
                       False if we cannot query the device.
         """
-        try:
-            # NOTE(TheJulia): smartctl has a concept of drivers being how
-            # to query or interpret data from the device. We want to use `ata`
-            # instead of `scsi` or `sat` as smartctl will not be able to read
-            # a bridged device that it doesn't understand, and accordingly
-            # return an error code.
-            output = utils.execute('smartctl', '-d', 'ata', block_device.name,
-                                   '-g', 'security',
-                                   check_exit_code=[0, 127])[0]
-            if 'Unavailable' in output:
-                # Smartctl is reporting it is unavailable, lets return false.
-                LOG.debug('Smartctl has reported that security is '
-                          'unavailable on device %s.', block_device.name)
-                return False
-            return True
-        except processutils.ProcessExecutionError:
-            # Things don't look so good....
-            LOG.warning('Refusing to permit ATA Secure Erase as direct '
-                        'ATA commands via the `smartctl` utility with device '
-                        '%s do not succeed.', block_device.name)
-            return False
-        except OSError:
-            # Processutils can raise OSError if a path is not found,
-            # and it is okay that we tollerate that since it was the
-            # prior behavior.
-            return True
+        return _smartctl_security_check(block_device.name)
 
     def _ata_erase(self, block_device):
 
@@ -1161,14 +4285,21 @@ class GenericHardwareManager(HardwareManager):
                 security_lines = self._get_ata_security_lines(block_device)
             return security_lines
 
-        security_lines = self._get_ata_security_lines(block_device)
+        # The probe made before erasing is used once, as the security state
+        # changes from here on
+        probe = _pop_ata_probe(block_device)
+        if probe is not None and probe['security_lines'] is not None:
+            security_lines = probe['security_lines']
+            smartctl_check = probe['smartctl_check']
+        else:
+            security_lines = self._get_ata_security_lines(block_device)
+            smartctl_check = self._smartctl_security_check(block_device)
 
         # If secure erase isn't supported return False so erase_block_device
         # can try another mechanism. Below here, if secure erase is supported
         # but fails in some way, error out (operators of hardware that supports
         # secure erase presumably expect this to work).
-        if (not self._smartctl_security_check(block_device)
-                or 'supported' not in security_lines):
+        if not smartctl_check or 'supported' not in security_lines:
             return False
 
         # At this point, we could be SEC1,2,4,5,6
@@ -1210,6 +4341,7 @@ class GenericHardwareManager(HardwareManager):
         if 'not supported: enhanced erase' not in security_lines:
             erase_option += '-enhanced'
 
+        _erase_progress.set_method(block_device.name, 'ata')
         try:
             utils.execute('hdparm', '--user-master', 'u', erase_option,
                           'NULL', block_device.name)
@@ -1240,17 +4372,23 @@ class GenericHardwareManager(HardwareManager):
         :return: IP address of lan channel or 0.0.0.0 in case none of them is
                  configured properly
         """
-        # These modules are rarely loaded automatically
-        utils.try_execute('modprobe', 'ipmi_msghandler')
-        utils.try_execute('modprobe', 'ipmi_devintf')
-        utils.try_execute('modprobe', 'ipmi_si')
+        _load_ipmi_modules()
+        lan_config = _get_bmc_lan_config()
+        if lan_config is not None:
+            for channel in sorted(lan_config):
+                address = lan_config[channel]['ipv4_address']
+                # In case we get 0.0.0.0 on a valid channel, we need to
+                # keep querying
+                if address and address != '0.0.0.0':
+                    return address
+            return '0.0.0.0'
 
         try:
             # From all the channels 0-15, only 1-11 can be assigned to
             # different types of communication media and protocols and
             # effectively used
             for channel in range(1, 12):
-                out, e = utils.execute(
+                out, e = _execute(
                     "ipmitool lan print {} | awk '/IP Address[ \\t]*:/"
                     " {{print $4}}'".format(channel), shell=True)
                 if e.startswith("Invalid channel"):
@@ -1282,18 +4420,28 @@ class GenericHardwareManager(HardwareManager):
                  configured properly. May return None value if it cannot
                  interract with system tools or critical error occurs.
         """
-        # These modules are rarely loaded automatically
-        utils.try_execute('modprobe', 'ipmi_msghandler')
-        utils.try_execute('modprobe', 'ipmi_devintf')
-        utils.try_execute('modprobe', 'ipmi_si')
+        _load_ipmi_modules()
 
         null_address_re = re.compile(r'^::(/\d{1,3})*$')
 
+        lan_config = _get_bmc_lan_config()
+        if lan_config is not None:
+            for channel in sorted(lan_config):
+                channel_config = lan_config[channel]
+                if channel_config['ipv6_enables'] not in (1, 2):
+                    continue
+                for addr in (channel_config['ipv6_dynamic'] +
+                             channel_config['ipv6_static']):
+                    if (addr['active'] and addr['enabled']
+                            and not null_address_re.match(addr['address'])):
+                        return addr['address']
+            return '::/0'
+
         def get_addr(channel, dynamic=False):
             cmd = "ipmitool lan6 print {} {}_addr".format(
                 channel, 'dynamic' if dynamic else 'static')
             try:
-                out, e = utils.execute(cmd, shell=True)
+                out, e = _execute(cmd, shell=True)
             except processutils.ProcessExecutionError:
                 return
 
@@ -1323,7 +4471,7 @@ class GenericHardwareManager(HardwareManager):
             # different types of communication media and protocols and
             # effectively used
             for channel in range(1, 12):
-                addr_mode, e = utils.execute(
+                addr_mode, e = _execute(
                     r"ipmitool lan6 print {} enables | "
                     r"awk '/IPv6\/IPv4 Addressing Enables[ \t]*:/"
                     r"{{print $NF}}'".format(channel), shell=True)
@@ -1375,6 +4523,14 @@ class GenericHardwareManager(HardwareManager):
                 'interface': 'raid',
                 'reboot_requested': False,
                 'abortable': True
+            },
+            {
+                'step': 'wait_for_raid_resync',
+                'priority': 0,
+                'interface': 'raid',
+                'reboot_requested': False,
+                'abortable': True,
+                'argsinfo': RAID_RESYNC_ARGSINFO
             }
         ]
 
@@ -1428,64 +4584,72 @@ class GenericHardwareManager(HardwareManager):
                   partitions)
             raise errors.SoftwareRAIDError(msg)
 
-        # Create an MBR partition table on each disk.
-        # TODO(arne_wiebalck): Check if GPT would work as well.
-        for block_device in block_devices:
-            LOG.info("Creating partition table on {}".format(
-                block_device.name))
-            try:
-                utils.execute('parted', block_device.name, '-s', '--',
-                              'mklabel', 'msdos')
-            except processutils.ProcessExecutionError as e:
-                msg = "Failed to create partition table on {}: {}".format(
-                    block_device.name, e)
-                raise errors.SoftwareRAIDError(msg)
-
-        # Create the partitions which will become the component devices.
-        sector = '2048s'
-        for logical_disk in logical_disks:
-            psize = logical_disk['size_gb']
-            if psize == 'MAX':
-                psize = '-1'
-            else:
-                psize = int(psize) * 1024
-            for device in block_devices:
-                try:
-                    LOG.debug("Creating partition on {}: {} {}".format(
-                        device.name, sector, psize))
-                    utils.execute('parted', device.name, '-s', '-a',
-                                  'optimal', '--', 'mkpart', 'primary',
-                                  sector, psize)
-                except processutils.ProcessExecutionError as e:
-                    msg = "Failed to create partitions on {}: {}".format(
-                        device.name, e)
-                    raise errors.SoftwareRAIDError(msg)
-            sector = psize
+        # Create the partition table and the partitions which will become
+        # the component devices on each disk, aligned for each disk, with a
+        # single parted run per disk and all the disks at once. BIOS nodes
+        # need a bios_grub partition for grub to be installed on a GPT disk.
+        disk_label = _get_raid_disk_label(raid_config)
+        bios_grub = (disk_label == 'gpt'
+                     and _get_node_boot_mode(node) == 'bios')
+        parted_scripts = dict(
+            (device.name, _get_raid_partition_script(device.name,
+                                                     logical_disks,
+                                                     disk_label,
+                                                     bios_grub=bios_grub))
+            for device in block_devices)
+
+        thread_pool = ThreadPool(len(block_devices))
+        try:
+            results = [thread_pool.apply_async(_partition_raid_disk,
+                                               (device, parted_script))
+                       for device, parted_script in parted_scripts.items()]
+            partition_errors = [result.get() for result in results]
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+        partition_errors = [error for error in partition_errors if error]
+        if partition_errors:
+            raise errors.SoftwareRAIDError('; '.join(partition_errors))
 
         # Create the RAID devices.
         raid_device_count = len(block_devices)
         for index, logical_disk in enumerate(logical_disks):
             md_device = '/dev/md%d' % index
-            component_devices = [device.name + str(index + 1)
+            partition_number = index + 1 + (1 if bios_grub else 0)
+            component_devices = [device.name + str(partition_number)
                                  for device in block_devices]
             raid_level = logical_disk['raid_level']
             # The schema check allows '1+0', but mdadm knows it as '10'.
             if raid_level == '1+0':
                 raid_level = '10'
+            # Skipping the initial resync is only safe for RAID-1 and RAID-10
+            # data which is entirely written (e.g. by the image) before being
+            # read
+            assume_clean = (('--assume-clean',)
+                            if logical_disk.get('assume_clean') else ())
             try:
                 LOG.debug("Creating md device {} on {}".format(
                           md_device, component_devices))
                 utils.execute('mdadm', '--create', md_device, '--force',
                               '--run', '--metadata=1', '--level', raid_level,
                               '--raid-devices', raid_device_count,
-                              *component_devices)
+                              *(assume_clean
+                                + _get_mdadm_layout_options(logical_disk)
+                                + tuple(component_devices)))
             except processutils.ProcessExecutionError as e:
                 msg = "Failed to create md device {} on {}: {}".format(
                     md_device, ' '.join(component_devices), e)
                 raise errors.SoftwareRAIDError(msg)
 
+            _set_md_sync_speed(md_device,
+                               logical_disk.get('sync_speed_min'),
+                               logical_disk.get('sync_speed_max'))
+
         LOG.info("Successfully created Software RAID")
 
+        # Follow the initial resync of the new arrays
+        get_md_monitor()
+
         return raid_config
 
     def delete_configuration(self, node, ports):
@@ -1505,61 +4669,146 @@ class GenericHardwareManager(HardwareManager):
 
         raid_devices = list_all_block_devices(block_type='raid',
                                               ignore_raid=False)
-        for raid_device in raid_devices:
-            LOG.info("Deleting Software RAID device {}".format(
-                     raid_device.name))
+        with _md_array_cache_scope():
+            for raid_device in raid_devices:
+                self._delete_raid_device(raid_device)
+
+        LOG.debug("Finished deleting Software RAID(s)")
+
+    def _delete_raid_device(self, raid_device):
+        """Delete a Software RAID device and its partitions.
+
+        :param raid_device: The BlockDevice of the md device.
+        """
+        LOG.info("Deleting Software RAID device {}".format(
+                 raid_device.name))
 
-            component_devices = _get_component_devices(raid_device.name)
-            LOG.debug('Found component devices %s', component_devices)
-            holder_disks = get_holder_disks(raid_device.name)
-            LOG.debug('Found holder disks %s', holder_disks)
+        component_devices = _get_component_devices(raid_device.name)
+        LOG.debug('Found component devices %s', component_devices)
+        holder_disks = get_holder_disks(raid_device.name)
+        LOG.debug('Found holder disks %s', holder_disks)
 
-            # Remove md devices.
+        # Remove md devices.
+        try:
+            utils.execute('wipefs', '-af', raid_device.name)
+        except processutils.ProcessExecutionError as e:
+            LOG.warning('Failed to wipefs %s: %s',
+                        raid_device.name, e)
+        try:
+            utils.execute('mdadm', '--stop', raid_device.name)
+        except processutils.ProcessExecutionError as e:
+            LOG.warning('Failed to stop %s: %s',
+                        raid_device.name, e)
+        _forget_md_array(raid_device.name)
+
+        # Remove md metadata from component devices.
+        for component_device in component_devices:
             try:
-                utils.execute('wipefs', '-af', raid_device.name)
+                utils.execute('mdadm', '--examine', component_device,
+                              use_standard_locale=True)
             except processutils.ProcessExecutionError as e:
-                LOG.warning('Failed to wipefs %s: %s',
-                            raid_device.name, e)
+                if "No md superblock detected" in str(e):
+                    # actually not a component device
+                    continue
+                else:
+                    msg = "Failed to examine device {}: {}".format(
+                          component_device, e)
+                    raise errors.SoftwareRAIDError(msg)
+
+            LOG.debug('Deleting md superblock on %s', component_device)
             try:
-                utils.execute('mdadm', '--stop', raid_device.name)
+                utils.execute('mdadm', '--zero-superblock',
+                              component_device)
             except processutils.ProcessExecutionError as e:
-                LOG.warning('Failed to stop %s: %s',
+                LOG.warning('Failed to remove superblock from %s: %s',
                             raid_device.name, e)
 
-            # Remove md metadata from component devices.
-            for component_device in component_devices:
-                try:
-                    utils.execute('mdadm', '--examine', component_device,
-                                  use_standard_locale=True)
-                except processutils.ProcessExecutionError as e:
-                    if "No md superblock detected" in str(e):
-                        # actually not a component device
-                        continue
-                    else:
-                        msg = "Failed to examine device {}: {}".format(
-                              component_device, e)
-                        raise errors.SoftwareRAIDError(msg)
+        # Remove the partitions we created during create_configuration.
+        for holder_disk in holder_disks:
+            LOG.debug('Removing partitions on %s', holder_disk)
+            try:
+                utils.execute('wipefs', '-af', holder_disk)
+            except processutils.ProcessExecutionError as e:
+                LOG.warning('Failed to remove partitions on %s',
+                            holder_disk)
 
-                LOG.debug('Deleting md superblock on %s', component_device)
-                try:
-                    utils.execute('mdadm', '--zero-superblock',
-                                  component_device)
-                except processutils.ProcessExecutionError as e:
-                    LOG.warning('Failed to remove superblock from %s: %s',
-                                raid_device.name, e)
+        LOG.info('Deleted Software RAID device %s', raid_device.name)
 
-            # Remove the partitions we created during create_configuration.
-            for holder_disk in holder_disks:
-                LOG.debug('Removing partitions on %s', holder_disk)
-                try:
-                    utils.execute('wipefs', '-af', holder_disk)
-                except processutils.ProcessExecutionError as e:
-                    LOG.warning('Failed to remove partitions on %s',
-                                holder_disk)
+    def wait_for_raid_resync(self, node, ports, policy=RAID_RESYNC_POLICY,
+                             target=RAID_RESYNC_TARGET,
+                             timeout=RAID_RESYNC_TIMEOUT,
+                             speed_max=RAID_RESYNC_SPEED_MAX):
+        """Wait for or throttle the resync of the software RAID devices.
 
-            LOG.info('Deleted Software RAID device %s', raid_device.name)
+        The arguments are given as the args of the manual clean step, see
+        RAID_RESYNC_ARGSINFO.
 
-        LOG.debug("Finished deleting Software RAID(s)")
+        :param node: A dictionary of the node object
+        :param ports: A list of dictionaries containing information
+                      of ports for the node
+        :param policy: 'wait' until every syncing array reaches the target
+                       progress, or 'throttle' the resync so that it does
+                       not slow down writing the image.
+        :param target: The resync progress to wait for, in (0, 1].
+        :param timeout: The seconds to wait for the target progress.
+        :param speed_max: The maximum resync speed in KB/s when throttling.
+        :returns: The resync status of the md arrays, see
+                  get_md_resync_status.
+        :raises: SoftwareRAIDError if the arrays do not reach the target
+                 progress in time.
+        :raises: InvalidCommandParamsError if an argument is invalid.
+        """
+        if policy == 'throttle':
+            if (not isinstance(speed_max, six.integer_types)
+                    or isinstance(speed_max, bool) or speed_max <= 0):
+                raise errors.InvalidCommandParamsError(
+                    'speed_max must be a positive integer (KB/s), got %r'
+                    % (speed_max,))
+            status = get_md_resync_status()
+            for md_device, array in sorted(status.items()):
+                if _is_md_syncing(array):
+                    _set_md_sync_speed(md_device, None, speed_max)
+            return status
+
+        if policy != 'wait':
+            raise errors.InvalidCommandParamsError(
+                "policy must be 'wait' or 'throttle', got %r" % (policy,))
+
+        if (not isinstance(target, (float,) + six.integer_types)
+                or isinstance(target, bool) or not 0 < target <= 1):
+            raise errors.InvalidCommandParamsError(
+                'target must be a number in (0, 1], got %r' % (target,))
+        if (not isinstance(timeout, (float,) + six.integer_types)
+                or isinstance(timeout, bool) or timeout <= 0):
+            raise errors.InvalidCommandParamsError(
+                'timeout must be a positive number of seconds, got %r'
+                % (timeout,))
+        deadline = time.time() + timeout
+        monitor = get_md_monitor()
+        while True:
+            generation = monitor.generation if monitor else None
+            status = get_md_resync_status()
+            pending = sorted(
+                md_device for md_device, array in status.items()
+                if _is_md_syncing(array)
+                and (array['progress'] or 0) < target)
+            if not pending:
+                LOG.info('Software RAID devices are in sync')
+                return status
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise errors.SoftwareRAIDError(
+                    'Software RAID devices %(devs)s did not reach %(target)s '
+                    'resync progress within %(timeout)s seconds' %
+                    {'devs': ', '.join(pending), 'target': target,
+                     'timeout': timeout})
+            LOG.debug('Waiting for the resync of %s', ', '.join(pending))
+            wait = min(remaining, MD_MONITOR_INTERVAL)
+            if monitor is not None and monitor.running:
+                monitor.wait_for_change(generation, wait)
+            else:
+                time.sleep(wait)
 
     def validate_configuration(self, raid_config, node):
         """Validate a (software) RAID configuration
@@ -1583,10 +4832,17 @@ class GenericHardwareManager(HardwareManager):
 
         raid_errors = []
 
-        # Only one or two RAID devices are supported for now.
-        if len(logical_disks) not in [1, 2]:
-            msg = ("Software RAID configuration requires one or "
-                   "two logical disks")
+        # An msdos partition table limits the number of RAID devices.
+        disk_label = _get_raid_disk_label(raid_config)
+        if disk_label not in SUPPORTED_RAID_DISK_LABELS:
+            msg = ("Software RAID configuration does not support disk "
+                   "label %s" % disk_label)
+            raid_errors.append(msg)
+        elif (disk_label == 'msdos'
+                and len(logical_disks) > MAX_MSDOS_PRIMARY_PARTITIONS):
+            msg = ("Software RAID configuration with an msdos disk label "
+                   "supports at most %d logical disks"
+                   % MAX_MSDOS_PRIMARY_PARTITIONS)
             raid_errors.append(msg)
 
         # All disks need to be flagged for Software RAID
@@ -1602,24 +4858,76 @@ class GenericHardwareManager(HardwareManager):
                    "first logical disk")
             raid_errors.append(msg)
 
-        # Additional checks when we have two RAID devices.
-        if len(logical_disks) == 2:
-            size1 = logical_disks[0]['size_gb']
-            size2 = logical_disks[1]['size_gb']
-
-            # Only one logical disk is allowed to span the whole device.
-            if size1 == 'MAX' and size2 == 'MAX':
+        # Only the last logical disk is allowed to span the rest of the
+        # devices, as the partitions are laid out in order.
+        for logical_disk in logical_disks[:-1]:
+            if logical_disk['size_gb'] == 'MAX':
                 msg = ("Software RAID can have only one RAID device with "
-                       "size 'MAX'")
+                       "size 'MAX', the last one")
                 raid_errors.append(msg)
+                break
 
-            # Check the accepted RAID levels.
-            current_level = logical_disks[1]['raid_level']
+        # Check the accepted RAID levels.
+        for logical_disk in logical_disks[1:]:
+            current_level = logical_disk['raid_level']
             if current_level not in SUPPORTED_SOFTWARE_RAID_LEVELS:
                 msg = ("Software RAID configuration does not support "
                        "RAID level %s" % current_level)
                 raid_errors.append(msg)
 
+        # Check the layout options.
+        for logical_disk in logical_disks:
+            chunk_size = logical_disk.get('chunk_size_kb')
+            if chunk_size is not None:
+                if (not isinstance(chunk_size, six.integer_types)
+                        or isinstance(chunk_size, bool) or chunk_size < 4
+                        or chunk_size & (chunk_size - 1)):
+                    raid_errors.append("Software RAID 'chunk_size_kb' must "
+                                       "be a power of two of at least 4")
+                elif logical_disk['raid_level'] == '1':
+                    raid_errors.append("Software RAID 'chunk_size_kb' is "
+                                       "not supported by RAID level 1")
+            bitmap = logical_disk.get('bitmap')
+            if bitmap is not None and not (
+                    bitmap in SOFTWARE_RAID_BITMAPS
+                    or (isinstance(bitmap, six.string_types)
+                        and os.path.isabs(bitmap))):
+                raid_errors.append("Software RAID 'bitmap' must be one of "
+                                   "%s or the absolute path of a bitmap file"
+                                   % ', '.join(sorted(SOFTWARE_RAID_BITMAPS)))
+            bitmap_chunk = logical_disk.get('bitmap_chunk_kb')
+            if bitmap_chunk is not None:
+                if (not isinstance(bitmap_chunk, six.integer_types)
+                        or isinstance(bitmap_chunk, bool)
+                        or bitmap_chunk <= 0):
+                    raid_errors.append("Software RAID 'bitmap_chunk_kb' must "
+                                       "be a positive integer")
+                elif bitmap == 'none':
+                    raid_errors.append("Software RAID 'bitmap_chunk_kb' "
+                                       "requires a bitmap")
+
+        # Check the resync options.
+        for logical_disk in logical_disks:
+            if not isinstance(logical_disk.get('assume_clean', False), bool):
+                raid_errors.append("Software RAID 'assume_clean' must be a "
+                                   "boolean")
+            speeds = []
+            for option in ('sync_speed_min', 'sync_speed_max'):
+                speed = logical_disk.get(option)
+                if speed is None:
+                    continue
+                if (not isinstance(speed, six.integer_types)
+                        or isinstance(speed, bool) or speed <= 0):
+                    raid_errors.append("Software RAID '%s' must be a "
+                                       "positive integer (KB/s)" % option)
+                else:
+                    speeds.append(speed)
+            if (len(speeds) == 2
+                    and logical_disk['sync_speed_min']
+                    > logical_disk['sync_speed_max']):
+                raid_errors.append("Software RAID 'sync_speed_min' must not "
+                                   "exceed 'sync_speed_max'")
+
         if raid_errors:
             error = ('Could not validate Software RAID config for %(node)s: '
                      '%(errors)s') % {'node': node['uuid'],
@@ -1627,10 +4935,121 @@ class GenericHardwareManager(HardwareManager):
             raise errors.SoftwareRAIDError(error)
 
 
-def _compare_extensions(ext1, ext2):
-    mgr1 = ext1.obj
-    mgr2 = ext2.obj
-    return mgr2.evaluate_hardware_support() - mgr1.evaluate_hardware_support()
+class _HardwareManagerExtension(object):
+    """A hardware manager loaded from the entry point cache.
+
+    Provides the attributes of the stevedore extensions used here.
+    """
+
+    def __init__(self, name, entry_point_target, obj):
+        self.name = name
+        self.entry_point_target = entry_point_target
+        self.obj = obj
+
+
+def _get_hardware_managers_cache_key():
+    """Identify the installed packages by the sys.path entries and mtimes."""
+    key = [sys.version]
+    for path in sys.path:
+        try:
+            key.append([path, os.stat(path or '.').st_mtime])
+        except OSError:
+            key.append([path, None])
+    return key
+
+
+def _on_hardware_manager_load_failure(manager, entry_point, error):
+    """Log a hardware manager which could not be loaded, and skip it."""
+    LOG.error('Could not load the hardware manager %(entry_point)s: '
+              '%(error)s', {'entry_point': entry_point, 'error': error})
+
+
+def _load_cached_hardware_manager(name, target):
+    """Import and instantiate a hardware manager from the cache.
+
+    :return: The extension of the manager, or None if it could not be
+             loaded, which is logged like stevedore does.
+    """
+    try:
+        module_name, _sep, attrs = target.partition(':')
+        obj = importlib.import_module(module_name)
+        for attr in attrs.split('.'):
+            obj = getattr(obj, attr)
+        return _HardwareManagerExtension(name, target, obj())
+    except Exception as e:
+        _on_hardware_manager_load_failure(None, '%s = %s' % (name, target),
+                                          e)
+
+
+def _load_hardware_manager_extensions():
+    """Load and instantiate the hardware managers.
+
+    Scanning the ironic_python_agent.hardware_managers entry points with
+    stevedore requires reading the metadata of every installed package. The
+    resulting "module:attribute" targets are cached in
+    HARDWARE_MANAGERS_CACHE, so that later agent runs with the same
+    packages import the managers directly. Either way, a manager which can
+    not be loaded is logged and skipped, the others are still used.
+
+    :return: A list of extensions with the name, entry_point_target and obj
+             (the hardware manager instance) attributes.
+    """
+    key = _get_hardware_managers_cache_key()
+    try:
+        with open(HARDWARE_MANAGERS_CACHE, 'r') as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            extensions = [
+                _load_cached_hardware_manager(name, target)
+                for name, target in cache['entry_points']]
+            return [extension for extension in extensions if extension]
+    except (EnvironmentError, ValueError, KeyError, TypeError) as e:
+        LOG.debug('Not using the hardware managers cache %(cache)s: '
+                  '%(error)s', {'cache': HARDWARE_MANAGERS_CACHE, 'error': e})
+
+    extensions = list(stevedore.ExtensionManager(
+        namespace='ironic_python_agent.hardware_managers',
+        invoke_on_load=True,
+        on_load_failure_callback=_on_hardware_manager_load_failure))
+    try:
+        cache_dir = os.path.dirname(HARDWARE_MANAGERS_CACHE)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        with open(HARDWARE_MANAGERS_CACHE, 'w') as f:
+            json.dump({'key': key,
+                       'entry_points': [[extension.name,
+                                         extension.entry_point_target]
+                                        for extension in extensions]}, f)
+    except (EnvironmentError, TypeError, ValueError) as e:
+        LOG.debug('Could not write the hardware managers cache %(cache)s: '
+                  '%(error)s', {'cache': HARDWARE_MANAGERS_CACHE, 'error': e})
+    return extensions
+
+
+def _evaluate_hardware_support(extension):
+    """Evaluate the hardware support of a manager, timing the evaluation.
+
+    :param extension: The extension of the hardware manager.
+    :return: A tuple of the support level and the seconds it took.
+    """
+    start = time.time()
+    _managers_loading.active = True
+    try:
+        support = extension.obj.evaluate_hardware_support()
+    finally:
+        _managers_loading.active = False
+    return support, time.time() - start
+
+
+def get_hardware_support_timings():
+    """Get the time spent evaluating the hardware support of each manager.
+
+    :return: A dictionary mapping the entry point target of each hardware
+             manager to its support level and the seconds its
+             evaluate_hardware_support() took, both as recorded by the last
+             _get_managers() run.
+    """
+    return dict(_hardware_support_timings)
 
 
 def _get_managers():
@@ -1640,38 +5059,156 @@ def _get_managers():
     self-reported (via evaluate_hardware_support()) priorities, and return them
     in a list. The resulting list is cached in _global_managers.
 
+    The support of each manager is evaluated only once, all the managers
+    concurrently, as GenericHardwareManager waits for the disks to appear.
+
     :returns: Priority-sorted list of hardware managers
-    :raises HardwareManagerNotFound: if no valid hardware managers found
+    :raises HardwareManagerNotFound: if no valid hardware managers found, or
+                                     when called while loading them (e.g.
+                                     from evaluate_hardware_support())
     """
     global _global_managers
 
-    if not _global_managers:
-        extension_manager = stevedore.ExtensionManager(
-            namespace='ironic_python_agent.hardware_managers',
-            invoke_on_load=True)
+    managers = _global_managers
+    if managers:
+        return managers
+
+    if getattr(_managers_loading, 'active', False):
+        raise errors.HardwareManagerNotFound(
+            'hardware managers can not be dispatched to while they are '
+            'loaded or evaluate their hardware support')
+
+    with _managers_lock:
+        if not _global_managers:
+            _managers_loading.active = True
+            try:
+                _global_managers = _find_managers()
+            finally:
+                _managers_loading.active = False
+
+        return _global_managers
 
-        # There will always be at least one extension available (the
-        # GenericHardwareManager).
-        if six.PY2:
-            extensions = sorted(extension_manager, _compare_extensions)
-        else:
-            extensions = sorted(extension_manager,
-                                key=functools.cmp_to_key(_compare_extensions))
 
-        preferred_managers = []
+def _find_managers():
+    """Load the hardware managers and rank them by hardware support.
+
+    :returns: Priority-sorted list of hardware managers
+    :raises HardwareManagerNotFound: if no valid hardware managers found
+    """
+    # There is normally at least one extension available (the
+    # GenericHardwareManager), unless all of them failed to load.
+    extensions = list(_load_hardware_manager_extensions())
+    if not extensions:
+        raise errors.HardwareManagerNotFound
+
+    thread_pool = ThreadPool(len(extensions))
+    try:
+        evaluations = thread_pool.map(_evaluate_hardware_support,
+                                      extensions)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+
+    _hardware_support_timings.clear()
+    for extension, (support, elapsed) in zip(extensions, evaluations):
+        _hardware_support_timings[extension.entry_point_target] = {
+            'support': support, 'seconds': elapsed}
+        LOG.debug('Hardware manager %(manager)s reported support '
+                  '%(support)s in %(elapsed).2f seconds',
+                  {'manager': extension.entry_point_target,
+                   'support': support, 'elapsed': elapsed})
+
+    # sorted() is stable, so managers with the same support keep the
+    # entry point order
+    ranked = sorted(zip(extensions, evaluations),
+                    key=lambda item: item[1][0], reverse=True)
+
+    preferred_managers = []
+
+    for extension, (support, _elapsed) in ranked:
+        if support > 0:
+            preferred_managers.append(extension.obj)
+            LOG.info('Hardware manager found: {}'.format(
+                extension.entry_point_target))
+
+    if not preferred_managers:
+        raise errors.HardwareManagerNotFound
+
+    return preferred_managers
+
+
+# HardwareManager methods which only raise IncompatibleHardwareMethodError,
+# managers not overriding them are skipped when dispatching
+_HARDWARE_MANAGER_STUBS = frozenset([
+    'list_network_interfaces', 'get_cpus', 'list_block_devices',
+    'get_memory', 'get_os_install_device', 'get_bmc_address',
+    'get_bmc_v6address', 'get_boot_info', 'get_interface_info',
+    'erase_block_device'])
 
-        for extension in extensions:
-            if extension.obj.evaluate_hardware_support() > 0:
-                preferred_managers.append(extension.obj)
-                LOG.info('Hardware manager found: {}'.format(
-                    extension.entry_point_target))
 
-        if not preferred_managers:
-            raise errors.HardwareManagerNotFound
+def _is_hardware_manager_stub(manager, method):
+    if method not in _HARDWARE_MANAGER_STUBS:
+        return False
+    implementation = getattr(type(manager), method, None)
+    stub = getattr(HardwareManager, method)
+    return (getattr(implementation, '__func__', implementation)
+            is getattr(stub, '__func__', stub))
+
+
+def _resolve_method(method):
+    """Get the hardware managers which may handle a method.
+
+    The result for each method is cached until _global_managers changes,
+    including when no manager has the method. The managers may still raise
+    IncompatibleHardwareMethodError depending on the arguments they are
+    called with.
+
+    :param method: hardware manager method to dispatch
+    :raises HardwareManagerNotFound: if no valid hardware managers found
+    :returns: A tuple of hardware managers in priority order.
+    """
+    global _dispatch_table
 
-        _global_managers = preferred_managers
+    managers = _get_managers()
+    resolved_managers, table = _dispatch_table
+    if resolved_managers is managers:
+        try:
+            return table[method]
+        except KeyError:
+            pass
+
+    with _managers_lock:
+        resolved_managers, table = _dispatch_table
+        if resolved_managers is not managers:
+            table = {}
+            _dispatch_table = (managers, table)
+
+        if method not in table:
+            candidates = []
+            for manager in managers:
+                if not getattr(manager, method, None):
+                    LOG.debug('HardwareManager %s does not have method %s',
+                              manager, method)
+                elif _is_hardware_manager_stub(manager, method):
+                    LOG.debug('HardwareManager %s does not support %s',
+                              manager, method)
+                else:
+                    candidates.append(manager)
+            table[method] = tuple(candidates)
+
+        return table[method]
 
-    return _global_managers
+
+def _call_manager(manager, method, args, kwargs):
+    """Call a hardware manager method, capturing its outcome.
+
+    :returns: A tuple of the response and the exception info, one of them
+              being None.
+    """
+    try:
+        return getattr(manager, method)(*args, **kwargs), None
+    except Exception:
+        return None, sys.exc_info()
 
 
 def dispatch_to_all_managers(method, *args, **kwargs):
@@ -1684,6 +5221,10 @@ def dispatch_to_all_managers(method, *args, **kwargs):
     and their responses will be added to a dictionary of the form
     {HardwareManagerClassName: response}.
 
+    With CONCURRENT_DISPATCH, the managers are all called at the same time.
+    The responses are still gathered, and the first unexpected error raised,
+    in priority order; the managers after a failing one have run as well.
+
     :param method: hardware manager method to dispatch
     :param args: arguments to dispatched method
     :param kwargs: keyword arguments to dispatched method
@@ -1693,25 +5234,39 @@ def dispatch_to_all_managers(method, *args, **kwargs):
         a response and the value as a list of results from that hardware
         manager.
     """
+    managers = _resolve_method(method)
+    if CONCURRENT_DISPATCH and len(managers) > 1:
+        thread_pool = ThreadPool(len(managers))
+        try:
+            outcomes = [thread_pool.apply_async(_call_manager,
+                                                (manager, method, args,
+                                                 kwargs))
+                        for manager in managers]
+            outcomes = [outcome.get() for outcome in outcomes]
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+    else:
+        outcomes = None
+
     responses = {}
-    managers = _get_managers()
-    for manager in managers:
-        if getattr(manager, method, None):
-            try:
-                response = getattr(manager, method)(*args, **kwargs)
-            except errors.IncompatibleHardwareMethodError:
-                LOG.debug('HardwareManager {} does not support {}'
-                          .format(manager, method))
-                continue
-            except Exception as e:
-                LOG.exception('Unexpected error dispatching %(method)s to '
-                              'manager %(manager)s: %(e)s',
-                              {'method': method, 'manager': manager, 'e': e})
-                raise
+    for index, manager in enumerate(managers):
+        if outcomes is None:
+            response, exc_info = _call_manager(manager, method, args, kwargs)
+        else:
+            response, exc_info = outcomes[index]
+
+        if exc_info is None:
             responses[manager.__class__.__name__] = response
+        elif issubclass(exc_info[0], errors.IncompatibleHardwareMethodError):
+            LOG.debug('HardwareManager %s does not support %s',
+                      manager, method)
         else:
-            LOG.debug('HardwareManager {} does not have method {}'
-                      .format(manager, method))
+            LOG.error('Unexpected error dispatching %(method)s to '
+                      'manager %(manager)s: %(e)s',
+                      {'method': method, 'manager': manager,
+                       'e': exc_info[1]}, exc_info=exc_info)
+            six.reraise(*exc_info)
 
     if responses == {}:
         raise errors.HardwareManagerMethodNotFound(method)
@@ -1736,24 +5291,180 @@ def dispatch_to_managers(method, *args, **kwargs):
     :raises HardwareManagerMethodNotFound: if all managers failed the method
     :raises HardwareManagerNotFound: if no valid hardware managers found
     """
-    managers = _get_managers()
+    for manager in _resolve_method(method):
+        try:
+            return getattr(manager, method)(*args, **kwargs)
+        except errors.IncompatibleHardwareMethodError:
+            LOG.debug('HardwareManager %s does not support %s',
+                      manager, method)
+        except Exception as e:
+            LOG.exception('Unexpected error dispatching %(method)s to '
+                          'manager %(manager)s: %(e)s',
+                          {'method': method, 'manager': manager, 'e': e})
+            raise
+
+    raise errors.HardwareManagerMethodNotFound(method)
+
+
+def _has_native_async_method(manager, method):
+    implementation = getattr(type(manager), '%s_async' % method, None)
+    default = getattr(HardwareManager, '%s_async' % method, None)
+    return (implementation is not None
+            and getattr(implementation, '__func__', implementation)
+            is not getattr(default, '__func__', default))
+
+
+def _resolve_async_method(method):
+    """Get the hardware managers which may handle a method asynchronously.
+
+    :param method: hardware manager method to dispatch
+    :returns: A tuple of hardware managers in priority order.
+    """
+    candidates = _resolve_method(method)
+    return tuple(manager for manager in _get_managers()
+                 if manager in candidates
+                 or _has_native_async_method(manager, method))
+
+
+def _call_manager_async(manager, method, args, kwargs):
+    """Call the asynchronous version of a hardware manager method.
+
+    Managers without one, not inheriting from HardwareManager, have the
+    synchronous method run in the default executor.
+
+    :returns: An asyncio future of the response.
+    """
+    async_method = getattr(manager, '%s_async' % method, None)
+    if async_method is None:
+        return _run_in_executor(getattr(manager, method), *args, **kwargs)
+    return asyncio.ensure_future(async_method(*args, **kwargs))
+
+
+def dispatch_to_managers_async(method, *args, **kwargs):
+    """Dispatch a method to best suited hardware manager asynchronously.
+
+    Asynchronous version of dispatch_to_managers, the managers are tried one
+    after another in priority order without blocking the event loop. The
+    hardware managers are expected to be loaded already (see load_managers).
+
+    :param method: hardware manager method to dispatch
+    :param args: arguments to dispatched method
+    :param kwargs: keyword arguments to dispatched method
+    :raises RuntimeError: if asyncio is not available.
+    :returns: An asyncio future of the result of the successful dispatch,
+              failing with HardwareManagerMethodNotFound if all managers
+              failed the method.
+    """
+    if asyncio is None:
+        raise RuntimeError('The asynchronous hardware manager API requires '
+                           'asyncio')
+
+    result = asyncio.get_event_loop().create_future()
+    managers = list(_resolve_async_method(method))
+
+    def _dispatch_next():
+        if not managers:
+            result.set_exception(
+                errors.HardwareManagerMethodNotFound(method))
+            return
+
+        manager = managers.pop(0)
+        try:
+            future = _call_manager_async(manager, method, args, kwargs)
+        except Exception as e:
+            _done(manager, e)
+            return
+        future.add_done_callback(
+            lambda future: _done(manager, None, future))
+
+    def _done(manager, error, future=None):
+        if result.done():
+            return
+        if future is not None:
+            if future.cancelled():
+                result.cancel()
+                return
+            error = future.exception()
+
+        if error is None:
+            result.set_result(future.result())
+        elif isinstance(error, errors.IncompatibleHardwareMethodError):
+            LOG.debug('HardwareManager %s does not support %s',
+                      manager, method)
+            _dispatch_next()
+        else:
+            LOG.error('Unexpected error dispatching %(method)s to '
+                      'manager %(manager)s: %(e)s',
+                      {'method': method, 'manager': manager, 'e': error},
+                      exc_info=error)
+            result.set_exception(error)
+
+    _dispatch_next()
+    return result
+
+
+def dispatch_to_all_managers_async(method, *args, **kwargs):
+    """Dispatch a method to all hardware managers asynchronously.
+
+    Asynchronous version of dispatch_to_all_managers, all the managers are
+    called at the same time. The hardware managers are expected to be loaded
+    already (see load_managers).
+
+    :param method: hardware manager method to dispatch
+    :param args: arguments to dispatched method
+    :param kwargs: keyword arguments to dispatched method
+    :raises RuntimeError: if asyncio is not available.
+    :returns: An asyncio future of the dictionary of responses, keyed by
+              hardware manager class name. It fails with the first unexpected
+              error in priority order, or with HardwareManagerMethodNotFound
+              if all managers raise IncompatibleHardwareMethodError.
+    """
+    if asyncio is None:
+        raise RuntimeError('The asynchronous hardware manager API requires '
+                           'asyncio')
+
+    result = asyncio.get_event_loop().create_future()
+    managers = _resolve_async_method(method)
+    futures = []
     for manager in managers:
-        if getattr(manager, method, None):
-            try:
-                return getattr(manager, method)(*args, **kwargs)
-            except(errors.IncompatibleHardwareMethodError):
-                LOG.debug('HardwareManager {} does not support {}'
-                          .format(manager, method))
-            except Exception as e:
-                LOG.exception('Unexpected error dispatching %(method)s to '
-                              'manager %(manager)s: %(e)s',
-                              {'method': method, 'manager': manager, 'e': e})
-                raise
+        try:
+            futures.append(_call_manager_async(manager, method, args,
+                                               kwargs))
+        except Exception as e:
+            error = asyncio.get_event_loop().create_future()
+            error.set_exception(e)
+            futures.append(error)
+
+    def _done(gathered):
+        if result.done():
+            return
+        if gathered.cancelled():
+            result.cancel()
+            return
+
+        responses = {}
+        for manager, response in zip(managers, gathered.result()):
+            if isinstance(response, errors.IncompatibleHardwareMethodError):
+                LOG.debug('HardwareManager %s does not support %s',
+                          manager, method)
+            elif isinstance(response, BaseException):
+                LOG.error('Unexpected error dispatching %(method)s to '
+                          'manager %(manager)s: %(e)s',
+                          {'method': method, 'manager': manager,
+                           'e': response}, exc_info=response)
+                result.set_exception(response)
+                return
+            else:
+                responses[manager.__class__.__name__] = response
+
+        if responses == {}:
+            result.set_exception(
+                errors.HardwareManagerMethodNotFound(method))
         else:
-            LOG.debug('HardwareManager {} does not have method {}'
-                      .format(manager, method))
+            result.set_result(responses)
 
-    raise errors.HardwareManagerMethodNotFound(method)
+    asyncio.gather(*futures, return_exceptions=True).add_done_callback(_done)
+    return result
 
 
 def load_managers():
@@ -1780,8 +5491,9 @@ def cache_node(node):
     :param node: Ironic node object
     """
     global NODE
-    new_node = NODE is None or NODE['uuid'] != node['uuid']
-    NODE = node
+    with _node_lock:
+        new_node = NODE is None or NODE['uuid'] != node['uuid']
+        NODE = node
 
     if new_node:
         LOG.info('Cached node %s, waiting for its root device to appear',
@@ -1793,4 +5505,5 @@ def cache_node(node):
 
 def get_cached_node():
     """Guard function around the module variable NODE."""
-    return NODE
+    with _node_lock:
+        return NODE
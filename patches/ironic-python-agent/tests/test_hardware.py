@@ -0,0 +1,1376 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the patched hardware.py, run against the patched agent tree."""
+
+import binascii
+import ctypes
+import errno
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ironic_lib import utils as il_utils
+
+from ironic_python_agent import hardware
+
+
+class TestListBlockDevicesFromSysfs(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+        for patcher in (
+                mock.patch.object(hardware, '_can_enumerate_from_sysfs',
+                                  return_value=True),
+                mock.patch.object(hardware, '_iter_sysfs_block_devices',
+                                  side_effect=self._iter_devices),
+                mock.patch.object(hardware, '_get_hctl', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.devices = []
+
+    def _add_device(self, name, devno, size):
+        sysfs_dir = os.path.join(self.sysfs, name)
+        os.makedirs(os.path.join(sysfs_dir, 'queue'))
+        for attribute, value in (('dev', devno), ('size', size),
+                                 ('queue/rotational', '0')):
+            with open(os.path.join(sysfs_dir, attribute), 'w') as f:
+                f.write('%s\n' % value)
+        self.devices.append((name, sysfs_dir, None))
+
+    def _iter_devices(self):
+        return iter(self.devices)
+
+    def _list(self, **kwargs):
+        devices = hardware._list_block_devices_from_sysfs('disk', False, {},
+                                                          **kwargs)
+        return [device.name for device in devices]
+
+    def test_ram_disks_skipped(self):
+        self._add_device('sda', '8:0', 2048)
+        self._add_device('ram0', '1:0', 2048)
+        self.assertEqual(['/dev/sda'], self._list())
+        self.assertEqual(['/dev/sda', '/dev/ram0'],
+                         self._list(all_devices=True))
+
+    def test_zero_size_devices_skipped(self):
+        self._add_device('sda', '8:0', 2048)
+        self._add_device('sdb', '8:16', 0)
+        self._add_device('zram0', '252:0', 0)
+        self.assertEqual(['/dev/sda'], self._list())
+        self.assertEqual(['/dev/sda', '/dev/sdb', '/dev/zram0'],
+                         self._list(all_devices=True))
+
+
+class TestMatchRootDeviceHints(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = [
+            hardware.BlockDevice('/dev/sdb', 'big', 1073741824000, True,
+                                 serial='mpath0'),
+            hardware.BlockDevice('/dev/sda', 'small', 10737418240, False),
+            hardware.BlockDevice('/dev/sdc', 'big', 1073741824000, True,
+                                 serial='mpath0'),
+        ]
+        self.registry = hardware.BlockDeviceRegistry(self.devices)
+
+    def _assert_matches_ironic_lib(self, hints, expected):
+        device = hardware._match_root_device_hints(self.registry, hints)
+        self.assertEqual(expected, device['name'])
+        self.assertEqual(il_utils.match_root_device_hints(
+            [dev.serialize() for dev in self.devices], hints), device)
+
+    def test_unindexed_hint_two_matches(self):
+        self._assert_matches_ironic_lib({'size': 1000}, '/dev/sdb')
+        self._assert_matches_ironic_lib({'rotational': True}, '/dev/sdb')
+
+    def test_indexed_hint_two_matches(self):
+        self._assert_matches_ironic_lib({'serial': 'mpath0'}, '/dev/sdb')
+        self._assert_matches_ironic_lib(
+            {'serial': 'mpath0', 'model': 'big'}, '/dev/sdb')
+        self._assert_matches_ironic_lib({'serial': ' MPATH0'}, '/dev/sdb')
+        self._assert_matches_ironic_lib({'name': '/dev/sdc'}, '/dev/sdc')
+
+    def test_indexed_hint_no_match(self):
+        for hints in ({'serial': 'mpath0', 'model': 'small'},
+                      {'name': 'sda'}):
+            self.assertIsNone(
+                hardware._match_root_device_hints(self.registry, hints))
+            self.assertIsNone(il_utils.match_root_device_hints(
+                [dev.serialize() for dev in self.devices], hints))
+
+    def test_indexed_hint_serializes_candidates_only(self):
+        with mock.patch.object(hardware.BlockDevice, 'serialize',
+                               autospec=True,
+                               return_value={'name': '/dev/sdb'}) as ser:
+            hardware._match_root_device_hints(self.registry,
+                                              {'serial': 'mpath0'})
+        self.assertEqual([self.devices[0], self.devices[2]],
+                         [call[0][0] for call in ser.call_args_list])
+
+    def test_operator_hint(self):
+        self._assert_matches_ironic_lib({'serial': '<in> mpath0'},
+                                        '/dev/sdb')
+
+
+class TestRaidPartitionScript(unittest.TestCase):
+
+    def _script(self, disk_label='msdos', bios_grub=False, **queue):
+        attributes = dict(('/sys/block/sda/queue/%s' % name, str(value))
+                          for name, value in queue.items())
+        with mock.patch.object(hardware, '_read_sysfs',
+                               side_effect=attributes.get):
+            return hardware._get_raid_partition_script(
+                '/dev/sda', [{'size_gb': 10}, {'size_gb': 'MAX'}],
+                disk_label, bios_grub=bios_grub)
+
+    def test_default_alignment(self):
+        self.assertEqual(
+            ['mklabel', 'msdos',
+             'mkpart', 'primary', '2048s', '20973567s',
+             'mkpart', 'primary', '20973568s', '100%'],
+            self._script(logical_block_size=512, physical_block_size=512,
+                         optimal_io_size=0))
+
+    def test_optimal_io_size_alignment(self):
+        self.assertEqual(
+            ['mklabel', 'msdos',
+             'mkpart', 'primary', '8192s', '20979711s',
+             'mkpart', 'primary', '20979712s', '100%'],
+            self._script(logical_block_size=512, physical_block_size=4096,
+                         optimal_io_size=4194304))
+
+    def test_optimal_io_size_not_power_of_two(self):
+        self.assertEqual(
+            ['mklabel', 'msdos',
+             'mkpart', 'primary', '2048s', '20973567s',
+             'mkpart', 'primary', '20973568s', '100%'],
+            self._script(logical_block_size=512, physical_block_size=512,
+                         optimal_io_size=33553920))
+
+    def test_optimal_io_size_too_large(self):
+        self.assertEqual(
+            ['mklabel', 'msdos',
+             'mkpart', 'primary', '2048s', '20973567s',
+             'mkpart', 'primary', '20973568s', '100%'],
+            self._script(logical_block_size=512, physical_block_size=4096,
+                         optimal_io_size=67108864))
+
+    def test_bios_grub(self):
+        self.assertEqual(
+            ['mklabel', 'gpt',
+             'mkpart', 'bios_grub', '2048s', '4095s',
+             'set', '1', 'bios_grub', 'on',
+             'mkpart', 'primary', '4096s', '20975615s',
+             'mkpart', 'primary', '20975616s', '100%'],
+            self._script(disk_label='gpt', bios_grub=True,
+                         logical_block_size=512, physical_block_size=512,
+                         optimal_io_size=0))
+
+    def test_disk_label(self):
+        self.assertEqual('msdos', hardware._get_raid_disk_label({}))
+        self.assertEqual('gpt', hardware._get_raid_disk_label(
+            {'disk_label': 'gpt'}))
+
+    def test_node_boot_mode(self):
+        node = {'properties': {'capabilities': 'boot_mode:uefi'},
+                'instance_info': {'capabilities': '{"boot_mode": "bios"}'}}
+        self.assertEqual('bios', hardware._get_node_boot_mode(node))
+        del node['instance_info']
+        self.assertEqual('uefi', hardware._get_node_boot_mode(node))
+
+
+class TestConcurrentInventory(unittest.TestCase):
+
+    def setUp(self):
+        hardware.CONF.set_override('concurrent_inventory', True)
+        self.addCleanup(hardware.CONF.clear_override, 'concurrent_inventory')
+        self.addCleanup(hardware._collector_threads.clear)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.hardware = hardware.GenericHardwareManager()
+        self.collectors = {}
+        for key, method in hardware.INVENTORY_COLLECTORS:
+            patcher = mock.patch.object(
+                self.hardware, method, autospec=True,
+                return_value=getattr(mock.sentinel, key))
+            self.collectors[key] = patcher.start()
+            self.addCleanup(patcher.stop)
+        for patcher in (
+                mock.patch.object(hardware.netutils, 'get_hostname',
+                                  return_value='host'),
+                mock.patch.object(hardware, 'INVENTORY_COLLECTOR_TIMEOUT',
+                                  0.2),
+                mock.patch.object(hardware, 'INVENTORY_COLLECTOR_TIMEOUTS',
+                                  {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _hang(self):
+        self.release.wait()
+
+    def _assert_inventory_shape(self, inventory):
+        self.assertEqual(
+            set(key for key, _ in hardware.INVENTORY_COLLECTORS)
+            | set(['hostname']), set(inventory))
+
+    def test_collected(self):
+        inventory = self.hardware.list_hardware_info()
+        self._assert_inventory_shape(inventory)
+        self.assertIs(mock.sentinel.cpu, inventory['cpu'])
+
+    def test_timed_out_required_key_collected_again(self):
+        self.collectors['disks'].side_effect = [
+            hardware._CollectorTimeout(), mock.sentinel.disks]
+        inventory = self.hardware.list_hardware_info()
+        self._assert_inventory_shape(inventory)
+        self.assertIs(mock.sentinel.disks, inventory['disks'])
+
+    def test_timed_out_twice_required_key_empty(self):
+        self.collectors['cpu'].side_effect = hardware._CollectorTimeout()
+        self.collectors['interfaces'].side_effect = (
+            hardware._CollectorTimeout())
+        inventory = self.hardware.list_hardware_info()
+        self._assert_inventory_shape(inventory)
+        self.assertEqual([], inventory['interfaces'])
+        self.assertIsInstance(inventory['cpu'], hardware.CPU)
+        self.assertEqual(0, inventory['cpu'].count)
+        self.assertEqual(2, self.collectors['cpu'].call_count)
+
+    def test_hung_optional_key_not_started_again(self):
+        self.collectors['system_vendor'].side_effect = self._hang
+        for _ in range(2):
+            inventory = self.hardware.list_hardware_info()
+            self._assert_inventory_shape(inventory)
+            self.assertEqual('', inventory['system_vendor'].manufacturer)
+        self.assertEqual(1, self.collectors['system_vendor'].call_count)
+
+    def test_error_reraised(self):
+        self.collectors['memory'].side_effect = RuntimeError('boom')
+        self.assertRaises(RuntimeError, self.hardware.list_hardware_info)
+
+
+class TestExecute(unittest.TestCase):
+
+    def test_no_deadline(self):
+        self.assertEqual('ok\n', hardware._execute('echo', 'ok')[0])
+
+    def test_killed_at_deadline(self):
+        start = time.time()
+        with hardware._collector_deadline(start + 0.5):
+            self.assertRaises(hardware._CollectorTimeout, hardware._execute,
+                              'sleep 30 | cat', shell=True)
+        self.assertLess(time.time() - start, 10)
+
+    def test_deadline_passed(self):
+        with hardware._collector_deadline(time.time() - 1):
+            self.assertRaises(hardware._CollectorTimeout, hardware._execute,
+                              'true')
+
+
+class TestIpmiDevice(unittest.TestCase):
+
+    def setUp(self):
+        self.ipmi = hardware._IpmiDevice(timeout=1)
+        # A readable descriptor standing for /dev/ipmi0
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.write(write_fd, b'x')
+        self.ipmi._fd = read_fd
+        patcher = mock.patch.object(self.ipmi, '_ioctl',
+                                    side_effect=self._ioctl)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.response = b'\x00\x20'
+
+    def _ioctl(self, request, arg):
+        if request == hardware._IPMICTL_RECEIVE_MSG_TRUNC:
+            arg.msgid = self.ipmi._msgid
+            ctypes.memmove(arg.msg.data, self.response, len(self.response))
+            arg.msg.data_len = len(self.response)
+
+    def test_request(self):
+        self.assertEqual(bytearray(b'\x20'), self.ipmi.request(0x06, 0x01))
+
+    def test_request_error_completion_code(self):
+        self.response = b'\xc1'
+        self.assertRaises(hardware._IpmiError, self.ipmi.request, 0x06, 0x01)
+
+    def test_get_lan_config_unsupported(self):
+        self.response = b'\x80'
+        self.assertIsNone(self.ipmi.get_lan_config(1, 3))
+
+
+def _lan_parameter(address, prefix, flags, status, set_selector=0):
+    return bytearray([0x11, set_selector, flags]) + bytearray(
+        socket.inet_pton(socket.AF_INET6, address)) + bytearray(
+        [prefix, status])
+
+
+class TestLoadBmcLan(unittest.TestCase):
+
+    lan_parameters = {
+        (1, 3, 0): bytearray([0x11, 192, 168, 0, 10]),
+        (1, 51, 0): bytearray([0x11, 2]),
+        (1, 55, 0): bytearray([0x11, 1, 2]),
+        (1, 56, 0): _lan_parameter('2001:db8::10', 64, 0x80, 0),
+        (1, 59, 0): _lan_parameter('fe80::1', 64, 0x02, 0),
+        (1, 59, 1): _lan_parameter('2001:db8::20', 64, 0x01, 1, 1),
+        (3, 3, 0): bytearray([0x11, 0, 0, 0, 0]),
+        (3, 51, 0): bytearray([0x11, 0]),
+    }
+
+    def setUp(self):
+        for patcher in (
+                mock.patch.object(hardware._IpmiDevice, '__enter__',
+                                  autospec=True, side_effect=lambda s: s),
+                mock.patch.object(hardware._IpmiDevice, '__exit__',
+                                  autospec=True),
+                mock.patch.object(hardware._IpmiDevice, 'request',
+                                  autospec=True, side_effect=self._request)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _request(self, ipmi, netfn, cmd, data=()):
+        if (netfn, cmd) == (0x06, 0x01):
+            return bytearray(14)
+        if (netfn, cmd) == (0x06, 0x42):
+            if data[0] not in (1, 3):
+                raise hardware._IpmiError('Invalid channel')
+            return bytearray([data[0], 0x04, 0x01])
+        channel, parameter, set_selector, _ = data
+        try:
+            return self.lan_parameters[channel, parameter, set_selector]
+        except KeyError:
+            raise hardware._IpmiError('Parameter not supported')
+
+    def test_load_bmc_lan(self):
+        self.assertEqual({
+            1: {'ipv4_address': '192.168.0.10',
+                'ipv6_enables': 2,
+                'ipv6_static': [{'address': '2001:db8::10',
+                                 'prefix_length': 64, 'enabled': True,
+                                 'active': True}],
+                'ipv6_dynamic': [{'address': 'fe80::1',
+                                  'prefix_length': 64, 'enabled': True,
+                                  'active': True},
+                                 {'address': '2001:db8::20',
+                                  'prefix_length': 64, 'enabled': True,
+                                  'active': False}]},
+            3: {'ipv4_address': '0.0.0.0', 'ipv6_enables': 0,
+                'ipv6_static': [], 'ipv6_dynamic': []},
+        }, hardware._load_bmc_lan())
+
+    def test_bmc_addresses(self):
+        hardware.CONF.set_override('native_ipmi', True)
+        self.addCleanup(hardware.CONF.clear_override, 'native_ipmi')
+        self.addCleanup(hardware.invalidate_hardware_snapshot, 'bmc_lan')
+        hardware.invalidate_hardware_snapshot('bmc_lan')
+        manager = hardware.GenericHardwareManager()
+        with mock.patch.object(hardware, '_load_ipmi_modules',
+                               autospec=True):
+            self.assertEqual('192.168.0.10', manager.get_bmc_address())
+            self.assertEqual('fe80::1', manager.get_bmc_v6address())
+
+    def test_native_ipmi_disabled(self):
+        self.assertIsNone(hardware._get_bmc_lan_config())
+        self.assertFalse(hardware._IpmiDevice.request.called)
+
+
+_CPUINFO = """processor\t: 0
+model name\t: Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz
+cpu MHz\t\t: 1000.000
+flags\t\t: fpu vme de pse
+
+processor\t: 1
+model name\t: Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz
+cpu MHz\t\t: 1000.000
+flags\t\t: fpu vme de pse
+"""
+
+_LSCPU = """Architecture:        x86_64
+CPU(s):              2
+Model name:          Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz
+CPU max MHz:         3700.0000
+"""
+
+
+class TestGetCpus(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshots = {'cpuinfo': _CPUINFO, 'lscpu': _LSCPU}
+        for patcher in (
+                mock.patch.object(hardware, 'get_hardware_snapshot',
+                                  side_effect=self.snapshots.__getitem__),
+                mock.patch.object(hardware, '_get_cpu_topology',
+                                  return_value={'sockets': 1}),
+                mock.patch.object(hardware, '_read_sysfs',
+                                  return_value='3700000'),
+                mock.patch.object(hardware.utils, 'try_execute',
+                                  return_value=('flags\t: fpu vme\n', ''))):
+            self.addCleanup(patcher.stop)
+            setattr(self, patcher.attribute, patcher.start())
+
+    def test_lscpu(self):
+        cpu = hardware.GenericHardwareManager().get_cpus()
+        self.assertEqual(
+            ('Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz', '3700.0000', 2,
+             'x86_64', ['fpu', 'vme'], 1),
+            (cpu.model_name, cpu.frequency, cpu.count, cpu.architecture,
+             cpu.flags, cpu.sockets))
+        self.get_hardware_snapshot.assert_called_once_with('lscpu')
+
+    def test_native(self):
+        hardware.CONF.set_override('native_cpu_info', True)
+        self.addCleanup(hardware.CONF.clear_override, 'native_cpu_info')
+        cpu = hardware.GenericHardwareManager().get_cpus()
+        self.assertEqual(
+            ('Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz', '3700.0000', 2,
+             ['fpu', 'vme', 'de', 'pse'], 1),
+            (cpu.model_name, cpu.frequency, cpu.count, cpu.flags,
+             cpu.sockets))
+        self.get_hardware_snapshot.assert_called_once_with('cpuinfo')
+        self.assertFalse(self.try_execute.called)
+
+    def test_native_without_model_name(self):
+        hardware.CONF.set_override('native_cpu_info', True)
+        self.addCleanup(hardware.CONF.clear_override, 'native_cpu_info')
+        self.snapshots['cpuinfo'] = 'processor\t: 0\nflags\t: fpu\n'
+        cpu = hardware.GenericHardwareManager().get_cpus()
+        self.assertEqual(
+            ('Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz', 2, ['fpu']),
+            (cpu.model_name, cpu.count, cpu.flags))
+
+
+def _smbios_structure(formatted, *strings):
+    """Build an SMBIOS structure from its formatted area (hex) and strings."""
+    return binascii.unhexlify(formatted) + (
+        b''.join(string + b'\x00' for string in strings) or b'\x00') + (
+        b'\x00')
+
+
+# Physical Memory Arrays (type 16) 0x1000, used as system memory, and 0x1001,
+# used as flash memory
+_SMBIOS_MEMORY_ARRAYS = (
+    _smbios_structure('1017001003030600000080feff04000000000000000000') +
+    _smbios_structure('1017011003050600000080feff04000000000000000000'))
+_SMBIOS_END = _smbios_structure('7f04ffff')
+
+
+class TestDmiTable(unittest.TestCase):
+
+    # Memory Devices (type 17), with the expected DIMM or None if the
+    # device is not reported
+    memory_devices = [
+        ('size in MB',
+         '112800110010feff480040000040090001021a80'
+         '006a0a0304000502000000006a0ab004b004b004',
+         {'locator': 'DIMM A1', 'bank_locator': 'P0 CHANNEL A',
+          'size_mb': 16384, 'speed': 2666}),
+        ('size in the Extended Size field',
+         '112801110010feff48004000ff7f090001021a80'
+         '00800c030400050200000100800cb004b004b004',
+         {'locator': 'DIMM A1', 'bank_locator': 'P0 CHANNEL A',
+          'size_mb': 65536, 'speed': 3200}),
+        ('size in KB, unknown speed',
+         '112802110010feff4800400000c0090001021a80'
+         '0000000304000502000000000000b004b004b004',
+         {'locator': 'DIMM A1', 'bank_locator': 'P0 CHANNEL A',
+          'size_mb': 16, 'speed': None}),
+        ('not installed',
+         '112803110010feff480040000000090001021a80'
+         '0000000304000502000000000000b004b004b004',
+         None),
+        ('unknown size',
+         '112804110010feff48004000ffff090001021a80'
+         '0000000304000502000000000000b004b004b004',
+         None),
+        ('in a flash memory array',
+         '112805110110feff480040000004090001021a80'
+         '0000000304000502000000000000b004b004b004',
+         None),
+        ('SMBIOS 2.1, without speed',
+         '111506110010feff480040000020090001021a80'
+         '00',
+         {'locator': 'DIMM A1', 'bank_locator': 'P0 CHANNEL A',
+          'size_mb': 8192, 'speed': None}),
+    ]
+
+    def _get(self, func, table):
+        with mock.patch.object(hardware, 'get_hardware_snapshot',
+                               return_value=table) as snapshot:
+            result = func()
+        snapshot.assert_called_once_with('dmi')
+        return result
+
+    def test_memory_devices(self):
+        for name, formatted, expected in self.memory_devices:
+            table = _SMBIOS_MEMORY_ARRAYS + _smbios_structure(
+                formatted, b'DIMM A1', b'P0 CHANNEL A', b'Samsung',
+                b'0123ABCD', b'M393A2K43CB2-CTD') + _SMBIOS_END
+            self.assertEqual(
+                [expected] if expected else [],
+                self._get(hardware._get_dmi_memory_devices, table), name)
+
+    def test_memory_devices_without_arrays(self):
+        table = _smbios_structure(
+            self.memory_devices[5][1], b'FLASH', b'BANK 0') + _SMBIOS_END
+        self.assertEqual(
+            [{'locator': 'FLASH', 'bank_locator': 'BANK 0', 'size_mb': 1024,
+              'speed': None}],
+            self._get(hardware._get_dmi_memory_devices, table))
+
+    def test_system_info(self):
+        table = _smbios_structure(
+            '011b0001010203044c4c4544004a10808053b4c04f385331060506',
+            b'Dell Inc.', b'PowerEdge R640', b'Not Specified', b'4XB8S52',
+            b'SKU=NotProvided;ModelName=PowerEdge R640',
+            b'PowerEdge') + _SMBIOS_END
+        self.assertEqual(
+            {'manufacturer': 'Dell Inc.', 'product_name': 'PowerEdge R640',
+             'serial_number': '4XB8S52'},
+            self._get(hardware._get_dmi_system_info, table))
+
+    def test_system_info_unset_strings(self):
+        table = (_SMBIOS_MEMORY_ARRAYS +
+                 _smbios_structure('0108000101020000', b'QEMU',
+                                   b'Standard PC (i440FX + PIIX, 1996)') +
+                 _SMBIOS_END)
+        self.assertEqual(
+            {'manufacturer': 'QEMU',
+             'product_name': 'Standard PC (i440FX + PIIX, 1996)',
+             'serial_number': None},
+            self._get(hardware._get_dmi_system_info, table))
+
+    def test_no_system_info(self):
+        self.assertRaises(ValueError, self._get,
+                          hardware._get_dmi_system_info,
+                          _SMBIOS_MEMORY_ARRAYS + _SMBIOS_END)
+
+    def test_native_dmi_disabled(self):
+        with mock.patch.object(hardware, '_get_dmi_system_info',
+                               autospec=True) as dmi, \
+                mock.patch.object(hardware, '_get_system_lshw_dict',
+                                  autospec=True,
+                                  return_value={'vendor': 'QEMU'}):
+            info = hardware.GenericHardwareManager().get_system_vendor_info()
+        self.assertEqual('QEMU', info.manufacturer)
+        self.assertFalse(dmi.called)
+
+
+class TestFindManagers(unittest.TestCase):
+
+    @mock.patch.object(hardware, '_load_hardware_manager_extensions',
+                       autospec=True, return_value=[])
+    def test_no_extension_loaded(self, mock_load):
+        self.assertRaises(hardware.errors.HardwareManagerNotFound,
+                          hardware._find_managers)
+
+
+_HDPARM_OUTPUT = """
+/dev/%(dev)s:
+
+ATA device, with non-removable media
+\tModel Number:       ST4000NM0035-1V4107
+\tSerial Number:      ZC1A2B3C
+Security: \n\tMaster password revision code = 65534
+%(security)s
+Logical Unit WWN Device Identifier: 5000c500a1b2c3d4
+"""
+
+_HDPARM_SECURITY_FROZEN = """\t\tsupported
+\tnot\tenabled
+\tnot\tlocked
+\t\tfrozen
+\tnot\texpired: security count
+\t\tsupported: enhanced erase
+\t%(minutes)s for SECURITY ERASE UNIT. \
+%(minutes)s for ENHANCED SECURITY ERASE UNIT."""
+
+
+class TestScheduleErase(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = [
+            hardware.BlockDevice('/dev/sda', 'hdd', 1000 * 1024 ** 3, True,
+                                 by_path='/dev/disk/by-path/'
+                                         'pci-0000:00:1f.2-ata-1'),
+            hardware.BlockDevice('/dev/sdb', 'hdd', 4000 * 1024 ** 3, True,
+                                 by_path='/dev/disk/by-path/'
+                                         'pci-0000:00:1f.2-ata-2'),
+            hardware.BlockDevice('/dev/nvme0n1', 'nvme', 1000 * 1024 ** 3,
+                                 False,
+                                 by_path='/dev/disk/by-path/'
+                                         'pci-0000:3b:00.0-nvme-1'),
+            hardware.BlockDevice('/dev/sdc', 'hdd', 500 * 1024 ** 3, True,
+                                 hctl='2:0:0:0'),
+        ]
+        self.erased = []
+        self.pool_sizes = []
+        thread_pool = hardware.ThreadPool
+        for patcher in (
+                mock.patch.object(hardware.utils, 'execute', autospec=True,
+                                  side_effect=self._execute),
+                mock.patch.object(hardware, '_erase_block_device_tracked',
+                                  autospec=True, side_effect=self._erase),
+                mock.patch.object(hardware, 'ThreadPool',
+                                  side_effect=self._thread_pool)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._real_thread_pool = thread_pool
+        hardware._ata_probes.clear()
+        self.addCleanup(hardware._ata_probes.clear)
+
+    def _thread_pool(self, size):
+        self.pool_sizes.append(size)
+        return self._real_thread_pool(size)
+
+    def _execute(self, *cmd, **kwargs):
+        if cmd[0] == 'hdparm':
+            # sda reports 2 hours, the other disks no estimate
+            security = _HDPARM_SECURITY_FROZEN % {'minutes': '120min'}
+            if cmd[-1] != '/dev/sda':
+                security = '\tnot\tsupported'
+            return _HDPARM_OUTPUT % {'dev': cmd[-1][5:],
+                                     'security': security}, ''
+        if cmd[0] == 'smartctl':
+            return 'ATA Security is:  Disabled, frozen [SEC2]', ''
+        raise AssertionError('Unexpected command %s' % (cmd,))
+
+    def _erase(self, node, block_device):
+        self.erased.append(block_device.name)
+        return 'erased %s' % block_device.name
+
+    def test_groups_and_order(self):
+        node = {'driver_internal_info': {
+            'disk_erasure_concurrency_rotational': 1}}
+        results = hardware._schedule_erase(node, self.devices)
+        self.assertEqual(
+            dict((dev.name, 'erased %s' % dev.name) for dev in self.devices),
+            dict((name, result.get()) for name, result in results.items()))
+        # One pool per controller and media type, sorted by controller:
+        # the SATA disks, the NVMe device, the SAS disk
+        self.assertEqual([1, 1, 1], self.pool_sizes)
+        # sdb (4 TB at the assumed throughput, about 7.6 hours) goes before
+        # sda (2 hours according to hdparm) on the shared controller
+        sata = [name for name in self.erased
+                if name in ('/dev/sda', '/dev/sdb')]
+        self.assertEqual(['/dev/sdb', '/dev/sda'], sata)
+
+    def test_default_concurrency(self):
+        hardware._schedule_erase({}, self.devices)
+        self.assertEqual([2, 1, 1], self.pool_sizes)
+        self.assertEqual(sorted(dev.name for dev in self.devices),
+                         sorted(self.erased))
+
+    def test_estimate_erase_time(self):
+        self.assertEqual(7200,
+                         hardware._estimate_erase_time(self.devices[0]))
+        self.assertEqual(
+            1000 * 1024 ** 3 / float(500 * 1024 * 1024),
+            hardware._estimate_erase_time(self.devices[2]))
+
+    def test_erase_controller(self):
+        self.assertEqual(
+            ['pci-0000:00:1f.2', 'pci-0000:00:1f.2', 'pci-0000:3b:00.0',
+             'scsi-host2'],
+            [hardware._get_erase_controller(dev) for dev in self.devices])
+
+
+class TestOverwriteBlockDevice(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        # A file standing for the block device, 3.5 buffers long
+        self.path = os.path.join(tempdir, 'sda')
+        self.size = 4096 * 3 + 2048
+        with open(self.path, 'wb') as f:
+            f.write(b'\xff' * self.size)
+        for patcher in (
+                mock.patch.object(hardware, 'ERASE_BUFFER_SIZE', 4096),
+                mock.patch.object(hardware, 'ERASE_WORKERS', 2),
+                mock.patch.object(hardware, 'ERASE_PROGRESS_FILE',
+                                  os.path.join(tempdir, 'progress.json')),
+                # O_DIRECT is not supported by every file system
+                mock.patch.object(hardware.os, 'O_DIRECT', 0, create=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(hardware._erase_progress.reset)
+        hardware._erase_progress.reset()
+        hardware._erase_progress.start(self.path, self.size)
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def _progress(self):
+        return hardware.get_erase_progress()[self.path]
+
+    def test_random_and_zeros(self):
+        self.assertEqual(2 * self.size, hardware._overwrite_block_device(
+            self.path, 1, True))
+        self.assertEqual(b'\x00' * self.size, self._read())
+        progress = self._progress()
+        self.assertEqual(
+            ('overwrite (native)', 2 * self.size, 2 * self.size),
+            (progress['method'], progress['bytes_done'],
+             progress['total_bytes']))
+
+    def test_random_only(self):
+        self.assertEqual(self.size, hardware._overwrite_block_device(
+            self.path, 1, False))
+        data = self._read()
+        self.assertEqual(self.size, len(data))
+        self.assertNotEqual(b'\xff' * self.size, data)
+        self.assertNotEqual(b'\x00' * self.size, data)
+        self.assertEqual(self.size, self._progress()['bytes_done'])
+
+    def test_partial_and_interrupted_writes(self):
+        real_write = os.write
+        interrupted = []
+
+        def write(fd, data):
+            if not interrupted:
+                interrupted.append(fd)
+                raise OSError(errno.EINTR, 'Interrupted system call')
+            return real_write(fd, bytes(data[:1000]))
+
+        with mock.patch.object(hardware.os, 'write', new=write):
+            self.assertEqual(self.size, hardware._overwrite_block_device(
+                self.path, 0, True))
+        self.assertEqual(b'\x00' * self.size, self._read())
+        self.assertEqual(self.size, self._progress()['bytes_done'])
+
+    def test_no_progress(self):
+        with mock.patch.object(hardware.os, 'write', new=lambda fd, d: 0):
+            self.assertRaises(IOError, hardware._overwrite_block_device,
+                              self.path, 0, True)
+            self.assertFalse(
+                hardware.GenericHardwareManager()._overwrite_block_device(
+                    {'driver_internal_info': {
+                        'agent_erase_devices_iterations': 0}},
+                    hardware.BlockDevice(self.path, '', self.size, False)))
+
+    def test_verify_short_pass(self):
+        with mock.patch.object(hardware, '_overwrite_region', autospec=True,
+                               return_value=4096):
+            self.assertRaises(IOError, hardware._overwrite_block_device,
+                              self.path, 1, False)
+
+    def test_empty_device(self):
+        with open(self.path, 'wb'):
+            pass
+        self.assertEqual(0, hardware._overwrite_block_device(
+            self.path, 1, True))
+
+
+class TestOffloadErase(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = {}
+        self.commands = []
+        self.ioctls = []
+        self.failing = set()
+        self.fna = 4
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        # Files standing for the block devices, for the ioctls to open
+        self.nvme = os.path.join(tempdir, 'nvme0n1')
+        self.sda = os.path.join(tempdir, 'sda')
+        for path in (self.nvme, self.sda):
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 8192)
+        for patcher in (
+                mock.patch.object(hardware, '_read_sysfs', autospec=True,
+                                  side_effect=self._read_sysfs),
+                mock.patch.object(hardware.utils, 'execute', autospec=True,
+                                  side_effect=self._execute),
+                mock.patch.object(hardware.fcntl, 'ioctl', autospec=True,
+                                  side_effect=self._ioctl)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = hardware.GenericHardwareManager()
+
+    def _read_sysfs(self, path):
+        return self.sysfs.get(path)
+
+    def _execute(self, *cmd, **kwargs):
+        self.commands.append(cmd)
+        if cmd[:2] == ('nvme', 'id-ctrl'):
+            return '{"fna": %d}' % self.fna, ''
+        if cmd[:2] == ('nvme', 'format'):
+            if 'NVMe format' in self.failing:
+                raise hardware.processutils.ProcessExecutionError(
+                    exit_code=1, cmd=' '.join(cmd))
+            return '', ''
+        raise AssertionError('Unexpected command %s' % (cmd,))
+
+    def _ioctl(self, fd, request, arg):
+        self.ioctls.append((request, tuple(arg)))
+        if request in self.failing:
+            raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+
+    def _queue(self, name, discard, write_zeroes):
+        queue_dir = '/sys/block/%s/queue/' % name
+        self.sysfs[queue_dir + 'discard_max_bytes'] = discard
+        self.sysfs[queue_dir + 'write_zeroes_max_bytes'] = write_zeroes
+
+    def _offload(self, path, iterations=1, zeroize=True):
+        node = {'driver_internal_info': {
+            'agent_erase_devices_iterations': iterations,
+            'agent_erase_devices_zeroize': zeroize}}
+        return self.manager._offload_erase(
+            node, hardware.BlockDevice(path, '', 8192, False))
+
+    def test_capabilities(self):
+        self._queue('sda', '2147450880\n', 'garbage')
+        self.assertEqual(
+            {'discard_max_bytes': 2147450880, 'write_zeroes_max_bytes': 0},
+            hardware._get_erase_offload_capabilities(
+                hardware.BlockDevice('/dev/sda', '', 0, False)))
+        self.assertEqual(
+            {'discard_max_bytes': 0, 'write_zeroes_max_bytes': 0},
+            hardware._get_erase_offload_capabilities(
+                hardware.BlockDevice('/dev/sdb', '', 0, False)))
+
+    def test_nvme_format(self):
+        self._queue('nvme0n1', '512', '512')
+        self.sysfs['/sys/block/nvme0n1/nsid'] = '1'
+        self.assertTrue(self._offload(self.nvme))
+        self.assertEqual(
+            [('nvme', 'id-ctrl', self.nvme, '-o', 'json'),
+             ('nvme', 'format', self.nvme, '--ses=2', '--force',
+              '--namespace-id=1')],
+            self.commands)
+        self.assertEqual([], self.ioctls)
+
+    def test_nvme_format_user_data_erase(self):
+        self.fna = 0
+        hardware._nvme_format('/dev/nvme0n1')
+        self.assertEqual(('nvme', 'format', '/dev/nvme0n1', '--ses=1',
+                          '--force'), self.commands[-1])
+
+    def test_fallback_to_secure_discard(self):
+        self._queue('nvme0n1', '512', '512')
+        self.failing.add('NVMe format')
+        self.assertTrue(self._offload(self.nvme))
+        self.assertEqual([(hardware._BLKSECDISCARD, (0, 8192))],
+                         self.ioctls)
+
+    def test_fallback_to_write_zeroes(self):
+        self._queue('sda', '512', '512')
+        self.failing.add(hardware._BLKSECDISCARD)
+        self.assertTrue(self._offload(self.sda, iterations=0))
+        self.assertEqual([], self.commands)
+        self.assertEqual([(hardware._BLKSECDISCARD, (0, 8192)),
+                          (hardware._BLKZEROOUT, (0, 8192))], self.ioctls)
+
+    def test_write_zeroes_only_replaces_a_pass_of_zeros(self):
+        self._queue('sda', '0', '512')
+        self.assertFalse(self._offload(self.sda, iterations=1))
+        self.assertFalse(self._offload(self.sda, iterations=0,
+                                       zeroize=False))
+        self.assertEqual([], self.ioctls)
+
+    def test_all_tiers_fail(self):
+        self._queue('nvme0n1', '512', '512')
+        self.failing.update(('NVMe format', hardware._BLKSECDISCARD,
+                             hardware._BLKZEROOUT))
+        self.assertFalse(self._offload(self.nvme, iterations=0))
+        self.assertEqual(2, len(self.commands))
+        self.assertEqual([hardware._BLKSECDISCARD, hardware._BLKZEROOUT],
+                         [request for request, _ in self.ioctls])
+
+    def test_unsupported(self):
+        self.assertFalse(self._offload(self.sda))
+        self.assertEqual([], self.commands)
+        self.assertEqual([], self.ioctls)
+
+
+_HDPARM_SECURITY_ENABLED = """\t\tsupported
+\t\tenabled
+\tnot\tlocked
+\tnot\tfrozen
+\tnot\texpired: security count
+\tnot\tsupported: enhanced erase
+\tSecurity level high
+\t2min for SECURITY ERASE UNIT."""
+
+
+class TestProbeAta(unittest.TestCase):
+
+    def setUp(self):
+        self.hdparm = {}
+        self.smartctl = 'ATA Security is:  Disabled, NOT FROZEN [SEC1]'
+        self.commands = []
+        patcher = mock.patch.object(hardware.utils, 'execute', autospec=True,
+                                    side_effect=self._execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        hardware._ata_probes.clear()
+        self.addCleanup(hardware._ata_probes.clear)
+
+    def _execute(self, *cmd, **kwargs):
+        self.commands.append(cmd)
+        if cmd[0] == 'hdparm':
+            security = self.hdparm.get(cmd[-1])
+            if security is None:
+                raise hardware.processutils.ProcessExecutionError(
+                    exit_code=2, cmd=' '.join(cmd))
+            return _HDPARM_OUTPUT % {'dev': cmd[-1][5:],
+                                     'security': security}, ''
+        if cmd[0] == 'smartctl':
+            return self.smartctl, ''
+        raise AssertionError('Unexpected command %s' % (cmd,))
+
+    def _device(self, name='/dev/sda', serial='ZC1A2B3C'):
+        return hardware.BlockDevice(name, 'hdd', 4000 * 1024 ** 3, True,
+                                    serial=serial)
+
+    def test_frozen(self):
+        self.hdparm['/dev/sda'] = _HDPARM_SECURITY_FROZEN % {
+            'minutes': '508min'}
+        probe = hardware._probe_ata(self._device())
+        self.assertEqual(
+            ['Master password revision code = 65534', 'supported',
+             'not enabled', 'not locked', 'frozen',
+             'not expired: security count', 'supported: enhanced erase',
+             '508min for SECURITY ERASE UNIT. 508min for ENHANCED SECURITY '
+             'ERASE UNIT.'],
+            probe.pop('security_lines'))
+        self.assertEqual(
+            {'supported': True, 'enabled': False, 'locked': False,
+             'frozen': True, 'enhanced_erase': True, 'erase_minutes': 508,
+             'enhanced_erase_minutes': 508, 'smartctl_check': True},
+            probe)
+
+    def test_enabled(self):
+        self.hdparm['/dev/sda'] = _HDPARM_SECURITY_ENABLED
+        probe = hardware._probe_ata(self._device())
+        self.assertEqual(
+            {'supported': True, 'enabled': True, 'locked': False,
+             'frozen': False, 'enhanced_erase': False, 'erase_minutes': 2,
+             'enhanced_erase_minutes': None, 'smartctl_check': True},
+            dict((key, value) for key, value in probe.items()
+                 if key != 'security_lines'))
+
+    def test_smartctl_unavailable(self):
+        self.hdparm['/dev/sda'] = _HDPARM_SECURITY_ENABLED
+        self.smartctl = 'ATA Security is:  Unavailable'
+        self.assertFalse(
+            hardware._probe_ata(self._device())['smartctl_check'])
+
+    def test_not_supported(self):
+        self.hdparm['/dev/sda'] = '\tnot\tsupported'
+        probe = hardware._probe_ata(self._device())
+        self.assertFalse(probe['supported'])
+        self.assertIsNone(probe['erase_minutes'])
+        # smartctl is only asked about devices supporting the security set
+        self.assertIsNone(probe['smartctl_check'])
+        self.assertEqual([('hdparm', '-I', '/dev/sda')], self.commands)
+
+    def test_empty_security_section(self):
+        self.hdparm['/dev/sda'] = ''
+        probe = hardware._probe_ata(self._device())
+        self.assertEqual(['Master password revision code = 65534'],
+                         probe['security_lines'])
+        self.assertFalse(probe['supported'])
+
+    def test_no_security_section(self):
+        self.assertEqual([], hardware._parse_ata_security_lines(
+            '/dev/sr0:\n\nATAPI CD-ROM, with removable media\n'))
+
+    def test_hdparm_fails(self):
+        probe = hardware._probe_ata(self._device())
+        self.assertIsNone(probe['security_lines'])
+        self.assertIsNone(probe['smartctl_check'])
+        self.assertFalse(probe['supported'])
+
+    def test_cache(self):
+        self.hdparm['/dev/sda'] = _HDPARM_SECURITY_ENABLED
+        self.hdparm['/dev/sdb'] = '\tnot\tsupported'
+        devices = [self._device(), self._device('/dev/sdb', 'ZC4D5E6F')]
+        hardware._probe_ata_devices(devices)
+        self.assertEqual(3, len(self.commands))
+        # Probed once per device
+        self.assertTrue(hardware._get_ata_probe(devices[0])['supported'])
+        self.assertEqual(3, len(self.commands))
+        # A replaced disk with the same name is probed again
+        hardware._get_ata_probe(self._device(serial='ZC7G8H9I'))
+        self.assertEqual(5, len(self.commands))
+        # A new run drops the previous probes
+        hardware._probe_ata_devices(devices[1:])
+        self.assertEqual(6, len(self.commands))
+        self.assertIsNone(hardware._pop_ata_probe(devices[0]))
+        self.assertFalse(hardware._pop_ata_probe(devices[1])['supported'])
+        self.assertIsNone(hardware._pop_ata_probe(devices[1]))
+
+    def test_ata_erase_uses_the_probe_once(self):
+        self.hdparm['/dev/sdb'] = '\tnot\tsupported'
+        device = self._device('/dev/sdb')
+        hardware._probe_ata_devices([device])
+        manager = hardware.GenericHardwareManager()
+        self.assertFalse(manager._ata_erase(device))
+        self.assertEqual(1, len(self.commands))
+        self.assertFalse(manager._ata_erase(device))
+        self.assertEqual(3, len(self.commands))
+
+
+class TestSetMdSyncSpeed(unittest.TestCase):
+
+    @mock.patch.object(hardware, 'open', new_callable=mock.mock_open,
+                       create=True)
+    def test_per_array_limits(self, mock_open):
+        hardware._set_md_sync_speed('/dev/md0', 1000, 20000)
+        self.assertEqual(
+            [mock.call('/sys/block/md0/md/sync_speed_min', 'w'),
+             mock.call('/sys/block/md0/md/sync_speed_max', 'w')],
+            mock_open.call_args_list)
+        handle = mock_open()
+        handle.write.assert_has_calls([mock.call('1000\n'),
+                                       mock.call('20000\n')])
+
+    @mock.patch.object(hardware, 'open', create=True,
+                       side_effect=IOError(errno.ENOENT, 'No such file'))
+    def test_no_global_fallback(self, mock_open):
+        hardware._set_md_sync_speed('/dev/md0', None, 20000)
+        # The system wide /proc/sys/dev/raid limits are left alone
+        mock_open.assert_called_once_with(
+            '/sys/block/md0/md/sync_speed_max', 'w')
+
+
+_MDADM_DETAIL_EXPORT = """MD_LEVEL=raid1
+MD_DEVICES=3
+MD_METADATA=1.2
+MD_UUID=83143055:2781ddf5:2c8f44c7:9b45d92e
+MD_NAME=host:0
+MD_DEVICE_dev_sda1_ROLE=0
+MD_DEVICE_dev_sda1_DEV=/dev/sda1
+MD_DEVICE_dev_sdc_ROLE=2
+MD_DEVICE_dev_sdc_DEV=/dev/sdc
+MD_DEVICE_dev_sdd1_ROLE=spare
+MD_DEVICE_dev_sdd1_DEV=/dev/sdd1
+MD_DEVICE_dev_sdb1_ROLE=1
+MD_DEVICE_dev_sdb1_DEV=/dev/sdb1
+MD_DEVICE_dev_sde1_ROLE=faulty
+MD_DEVICE_dev_sde1_DEV=/dev/sde1
+"""
+
+# The members of the array of the fixtures, in slot order, and the disks
+# they are on
+_MD_MEMBERS = [('/dev/sda1', 'in_sync'), ('/dev/sdb1', 'in_sync'),
+               ('/dev/sdc', 'in_sync'), ('/dev/sde1', 'faulty'),
+               ('/dev/sdd1', 'spare')]
+_MD_PARENT_DISKS = {'/dev/sda1': 'sda', '/dev/sdb1': 'sdb', '/dev/sdc': 'sdc',
+                    '/dev/sdd1': 'sdd', '/dev/sde1': 'sde'}
+
+
+class TestMdArray(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+        for patcher in (
+                mock.patch.object(hardware, '_get_md_sysfs_dir',
+                                  side_effect=self._md_dir),
+                mock.patch.object(hardware, '_get_parent_disk',
+                                  side_effect=_MD_PARENT_DISKS.get)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _md_dir(self, md_device):
+        return os.path.join(self.sysfs, os.path.basename(md_device), 'md')
+
+    def _write(self, path, value):
+        with open(path, 'w') as f:
+            f.write('%s\n' % value)
+
+    def _add_array(self, name, attributes, members):
+        md_dir = self._md_dir(name)
+        os.makedirs(md_dir)
+        for attribute, value in attributes.items():
+            self._write(os.path.join(md_dir, attribute), value)
+        for member, slot, state in members:
+            # dev-<member>/block links to the member in /sys/devices
+            block = os.path.join(self.sysfs, 'devices', member)
+            os.makedirs(block)
+            member_dir = os.path.join(md_dir, 'dev-%s' % member)
+            os.mkdir(member_dir)
+            os.symlink(block, os.path.join(member_dir, 'block'))
+            self._write(os.path.join(member_dir, 'slot'), slot)
+            self._write(os.path.join(member_dir, 'state'), state)
+
+    def test_from_sysfs(self):
+        self._add_array(
+            'md0',
+            {'level': 'raid1', 'array_state': 'clean',
+             'sync_action': 'recover', 'sync_completed': '1024 / 4096'},
+            [('sdd1', 'none', 'spare'), ('sdb1', '1', 'in_sync'),
+             ('sde1', '3', 'faulty'), ('sda1', '0', 'in_sync'),
+             ('sdc', '2', 'in_sync')])
+        md_array = hardware.MdArray.from_sysfs('/dev/md0')
+        self.assertEqual(
+            ('/dev/md0', 'raid1', 'clean', _MD_MEMBERS, 'recover', 0.25),
+            (md_array.device, md_array.level, md_array.state,
+             md_array.members, md_array.sync_action,
+             md_array.sync_progress))
+        self.assertEqual(['/dev/sda1', '/dev/sdb1', '/dev/sdc'],
+                         md_array.component_devices)
+        self.assertEqual(['/dev/sda', '/dev/sdb', '/dev/sdc'],
+                         md_array.holder_disks)
+
+    def test_from_sysfs_idle(self):
+        self._add_array(
+            'md1',
+            {'level': 'raid0', 'array_state': 'active',
+             'sync_action': 'idle', 'sync_completed': 'none'},
+            [('sdf', '0', 'in_sync'), ('sdg', '1', 'in_sync,write_mostly')])
+        md_array = hardware.MdArray.from_sysfs('/dev/md1')
+        self.assertEqual('idle', md_array.sync_action)
+        self.assertIsNone(md_array.sync_progress)
+        self.assertEqual(['/dev/sdf', '/dev/sdg'],
+                         md_array.component_devices)
+
+    def test_from_sysfs_unknown(self):
+        self.assertIsNone(hardware.MdArray.from_sysfs('/dev/md0'))
+
+    @mock.patch.object(hardware.utils, 'execute', autospec=True,
+                       return_value=(_MDADM_DETAIL_EXPORT, ''))
+    def test_from_mdadm(self, mock_execute):
+        md_array = hardware.MdArray.from_mdadm('/dev/md0')
+        mock_execute.assert_called_once_with(
+            'mdadm', '--detail', '--export', '/dev/md0',
+            use_standard_locale=True)
+        # mdadm does not tell the slot of faulty members
+        members = _MD_MEMBERS[:3] + [('/dev/sdd1', 'spare'),
+                                     ('/dev/sde1', 'faulty')]
+        self.assertEqual(('raid1', None, members, None, None),
+                         (md_array.level, md_array.state, md_array.members,
+                          md_array.sync_action, md_array.sync_progress))
+        self.assertEqual(['/dev/sda1', '/dev/sdb1', '/dev/sdc'],
+                         md_array.component_devices)
+
+    @mock.patch.object(hardware.utils, 'execute', autospec=True,
+                       return_value=(_MDADM_DETAIL_EXPORT, ''))
+    def test_holder_disks_without_sysfs(self, mock_execute):
+        # Without sysfs, the disks are told from the member names
+        hardware._get_parent_disk.side_effect = None
+        hardware._get_parent_disk.return_value = None
+        self.assertEqual(
+            ['/dev/sda', '/dev/sdb', '/dev/sdc'],
+            hardware.MdArray.from_mdadm('/dev/md0').holder_disks)
+
+    @mock.patch.object(hardware.utils, 'execute', autospec=True,
+                       return_value=(_MDADM_DETAIL_EXPORT, ''))
+    def test_get_md_array(self, mock_execute):
+        self._add_array('md0', {'level': 'raid1'},
+                        [('sda1', '0', 'in_sync')])
+        with hardware._md_array_cache_scope():
+            self.assertEqual(['/dev/sda1'],
+                             hardware._get_component_devices('/dev/md0'))
+            # Unknown to sysfs, read once with mdadm
+            self.assertEqual(['/dev/sda', '/dev/sdb', '/dev/sdc'],
+                             hardware.get_holder_disks('/dev/md1'))
+            hardware.get_holder_disks('/dev/md1')
+        mock_execute.assert_called_once_with(
+            'mdadm', '--detail', '--export', '/dev/md1',
+            use_standard_locale=True)
+
+    @mock.patch.object(hardware.utils, 'execute', autospec=True,
+                       side_effect=hardware.processutils.ProcessExecutionError)
+    def test_get_md_array_fails(self, mock_execute):
+        self.assertRaises(hardware.errors.SoftwareRAIDError,
+                          hardware.get_holder_disks, '/dev/md0')
+
+
+_MDSTAT = """Personalities : [raid1] [raid10]
+md0 : active raid1 sdb1[1] sda1[0]
+      1046528 blocks super 1.2 [2/2] [UU]
+      [=====>...............]  resync = 27.6% (289344/1046528) \
+finish=0.5min speed=24112K/sec
+
+md1 : active raid1 sdb2[1] sda2[0]
+      976630464 blocks super 1.2 [2/2] [UU]
+        resync=DELAYED
+      bitmap: 8/8 pages [32KB], 65536KB chunk
+
+md2 : active raid10 sdf1[4] sde1[2] sdd1[1] sdc1[0]
+      1953260544 blocks super 1.2 512K chunks 2 near-copies [4/3] [UU_U]
+      [>....................]  recovery =  1.2% (11776000/976630272) \
+finish=97.3min speed=102400K/sec
+
+md3 : active raid1 sdh1[1] sdg1[0]
+      1046528 blocks super 1.2 [2/2] [UU]
+
+unused devices: <none>
+"""
+
+
+class TestMdResyncStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+        patcher = mock.patch.object(
+            hardware, '_get_md_sysfs_dir',
+            side_effect=lambda md_device: os.path.join(
+                self.sysfs, os.path.basename(md_device), 'md'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _add_array(self, name, **attributes):
+        md_dir = os.path.join(self.sysfs, name, 'md')
+        os.makedirs(md_dir)
+        for attribute, value in attributes.items():
+            with open(os.path.join(md_dir, attribute), 'w') as f:
+                f.write('%s\n' % value)
+
+    def test_parse_mdstat(self):
+        idle = {'action': 'idle', 'progress': None,
+                'speed_kb_per_second': None, 'eta_seconds': None}
+        self.assertEqual(
+            {'/dev/md0': {'action': 'resync', 'progress': 27.6 / 100,
+                          'speed_kb_per_second': 24112,
+                          'eta_seconds': 0.5 * 60},
+             '/dev/md1': dict(idle, action='delayed'),
+             '/dev/md2': {'action': 'recovery', 'progress': 1.2 / 100,
+                          'speed_kb_per_second': 102400,
+                          'eta_seconds': 97.3 * 60},
+             '/dev/md3': idle},
+            hardware._parse_mdstat(_MDSTAT))
+
+    def test_parse_mdstat_empty(self):
+        self.assertEqual({}, hardware._parse_mdstat(
+            'Personalities : \nunused devices: <none>\n'))
+
+    def test_read_md_sync_status(self):
+        self._add_array('md0', sync_action='resync',
+                        sync_completed='1000 / 4000', sync_speed='500')
+        self.assertEqual(
+            {'action': 'resync', 'progress': 0.25,
+             'speed_kb_per_second': 500,
+             # 3000 sectors of 512 bytes at 500 KB/s
+             'eta_seconds': 3.0},
+            hardware._read_md_sync_status('/dev/md0'))
+
+    def test_read_md_sync_status_idle(self):
+        self._add_array('md0', sync_action='idle', sync_completed='none',
+                        sync_speed='none')
+        self.assertEqual(
+            {'action': 'idle', 'progress': None,
+             'speed_kb_per_second': None, 'eta_seconds': None},
+            hardware._read_md_sync_status('/dev/md0'))
+
+    def test_read_md_sync_status_starting(self):
+        # No speed yet, so no estimate
+        self._add_array('md0', sync_action='recover',
+                        sync_completed='0 / 4000', sync_speed='0')
+        self.assertEqual(
+            {'action': 'recover', 'progress': 0.0,
+             'speed_kb_per_second': None, 'eta_seconds': None},
+            hardware._read_md_sync_status('/dev/md0'))
+
+    def test_read_md_sync_status_unknown(self):
+        self.assertIsNone(hardware._read_md_sync_status('/dev/md0'))
+
+
+class TestWaitForRaidResync(unittest.TestCase):
+
+    def setUp(self):
+        self.status = {
+            '/dev/md0': {'action': 'resync', 'progress': 0.5,
+                         'speed_kb_per_second': 1000, 'eta_seconds': 60},
+            '/dev/md1': {'action': 'idle', 'progress': None,
+                         'speed_kb_per_second': None, 'eta_seconds': None}}
+        for patcher in (
+                mock.patch.object(hardware, 'get_md_resync_status',
+                                  autospec=True,
+                                  side_effect=lambda: self.status),
+                mock.patch.object(hardware, 'get_md_monitor', autospec=True,
+                                  return_value=None),
+                mock.patch.object(hardware, '_set_md_sync_speed',
+                                  autospec=True),
+                mock.patch.object(hardware.time, 'sleep', autospec=True,
+                                  side_effect=self._sleep),
+                mock.patch.object(hardware.time, 'time', autospec=True,
+                                  side_effect=lambda: self.now)):
+            setattr(self, 'mock_%s' % patcher.attribute.lstrip('_'),
+                    patcher.start())
+            self.addCleanup(patcher.stop)
+        self.now = 1000.0
+        self.manager = hardware.GenericHardwareManager()
+
+    def _sleep(self, seconds):
+        self.now += seconds
+        self.status['/dev/md0']['progress'] += 0.25
+
+    def _wait(self, **kwargs):
+        return self.manager.wait_for_raid_resync({}, [], **kwargs)
+
+    def test_argsinfo(self):
+        step = [step for step in self.manager.get_clean_steps({}, [])
+                if step['step'] == 'wait_for_raid_resync'][0]
+        self.assertEqual(['policy', 'speed_max', 'target', 'timeout'],
+                         sorted(step['argsinfo']))
+
+    def test_wait(self):
+        self.assertEqual(self.status, self._wait())
+        self.assertEqual(2, self.mock_sleep.call_count)
+        self.assertFalse(self.mock_set_md_sync_speed.called)
+
+    def test_wait_target(self):
+        self._wait(target=0.75)
+        self.assertEqual(1, self.mock_sleep.call_count)
+
+    def test_wait_timeout(self):
+        self.assertRaises(hardware.errors.SoftwareRAIDError,
+                          self._wait, timeout=hardware.MD_MONITOR_INTERVAL)
+        self.assertEqual(1, self.mock_sleep.call_count)
+        self.assertEqual(0.75, self.status['/dev/md0']['progress'])
+
+    def test_throttle(self):
+        self.assertEqual(self.status, self._wait(policy='throttle',
+                                                 speed_max=5000))
+        self.mock_set_md_sync_speed.assert_called_once_with(
+            '/dev/md0', None, 5000)
+        self.assertFalse(self.mock_sleep.called)
+
+    def test_invalid_arguments(self):
+        for kwargs in ({'policy': 'hurry'},
+                       {'target': '1'}, {'target': 0}, {'target': 1.5},
+                       {'target': True},
+                       {'timeout': '3600'}, {'timeout': 0},
+                       {'timeout': -1}, {'timeout': None},
+                       {'policy': 'throttle', 'speed_max': '10000'},
+                       {'policy': 'throttle', 'speed_max': 1000.5},
+                       {'policy': 'throttle', 'speed_max': 0},
+                       {'policy': 'throttle', 'speed_max': True}):
+            self.assertRaises(hardware.errors.InvalidCommandParamsError,
+                              self._wait, **kwargs)
+        self.assertFalse(self.mock_get_md_resync_status.called)
+        self.assertFalse(self.mock_set_md_sync_speed.called)
+
+
+if __name__ == '__main__':
+    unittest.main()